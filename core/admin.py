@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, BusinessProfile, SearchHistory, PosterGeneration, Festival, UserHistory
+from .models import CustomUser, BusinessProfile, SearchHistory, PosterGeneration, Festival, UserHistory, GenerationJob, GenerationTiming, ChatMessage
 from django.contrib.auth.admin import UserAdmin
 from django.db import transaction
 from django.contrib import messages
@@ -178,9 +178,30 @@ class UserHistoryAdmin(admin.ModelAdmin):
     is_text_action.boolean = True
     is_text_action.short_description = 'Text Action'
 
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'job_type', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'job_type', 'created_at')
+    search_fields = ('user__username', 'result_url', 'error')
+    readonly_fields = ('created_at', 'started_at', 'heartbeat_at', 'finished_at')
+
+class GenerationTimingAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'action_type', 'model', 'total_seconds', 'cache_hit', 'outcome', 'created_at')
+    list_filter = ('action_type', 'model', 'cache_hit', 'outcome', 'created_at')
+    search_fields = ('user__username', 'model')
+    readonly_fields = ('created_at',)
+
+class ChatMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'conversation', 'role', 'created_at')
+    list_filter = ('role', 'created_at')
+    search_fields = ('user__username', 'content')
+    readonly_fields = ('created_at',)
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(BusinessProfile, BusinessProfileAdmin)
 admin.site.register(SearchHistory, SearchHistoryAdmin)
 admin.site.register(PosterGeneration, PosterGenerationAdmin)
 admin.site.register(Festival, FestivalAdmin)
 admin.site.register(UserHistory, UserHistoryAdmin)
+admin.site.register(GenerationJob, GenerationJobAdmin)
+admin.site.register(GenerationTiming, GenerationTimingAdmin)
+admin.site.register(ChatMessage, ChatMessageAdmin)
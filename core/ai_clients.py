@@ -0,0 +1,146 @@
+# core/ai_clients.py
+"""
+Process-wide registry of AI provider clients.
+
+Clients are built lazily on first use and then shared by every request and
+gthread thread in the process, one per (provider, model, credentials).
+"""
+import time
+import hashlib
+import threading
+
+import cohere
+from google import genai as google_genai
+from vertexai.preview.vision_models import ImageGenerationModel
+
+from django.conf import settings
+
+from .emulators import build_emulated_client
+
+
+_clients = {}
+_client_info = {}
+_registry_lock = threading.Lock()
+_build_locks = {}
+
+
+def _fingerprint(api_key):
+    """Short, non-reversible tag for credentials so keys never appear in status output"""
+    if not api_key:
+        return ''
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def _build_client(provider, model, api_key):
+    if settings.AI_EMULATOR:
+        return build_emulated_client(provider, model)
+    if provider == 'cohere':
+        return cohere.Client(api_key)
+    if provider == 'cohere_v2':
+        # Chat API, the one with token streaming
+        return cohere.ClientV2(api_key)
+    if provider == 'genai':
+        return google_genai.Client(api_key=api_key)
+    if provider == 'imagen':
+        # Fetches model metadata from Vertex AI - the expensive part we only want to pay once
+        return ImageGenerationModel.from_pretrained(model)
+    raise ValueError(f"Unknown AI provider: {provider}")
+
+
+def get_client(provider, model=None, api_key=None):
+    """
+    Return the shared client for a provider, building it on first use.
+
+    Args:
+        provider: 'cohere', 'cohere_v2', 'genai' or 'imagen'
+        model: Model id, for providers whose client is bound to one model
+        api_key: Credentials the client is built with
+
+    Returns:
+        The provider client. Build errors are raised to the caller and the
+        registry stays cold so the next call retries.
+    """
+    key = (provider, model, _fingerprint(api_key))
+    client = _clients.get(key)
+    if client is not None:
+        _count_use(key)
+        return client
+
+    # One lock per key: a slow from_pretrained() must not block other providers
+    with _registry_lock:
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    with build_lock:
+        client = _clients.get(key)
+        if client is None:
+            started = time.monotonic()
+            client = _build_client(provider, model, api_key)
+            build_seconds = round(time.monotonic() - started, 3)
+            with _registry_lock:
+                _client_info[key] = {'built_at': time.time(), 'build_seconds': build_seconds, 'uses': 0}
+                _clients[key] = client
+            print(f"DEBUG: Built {provider} client (model={model}) in {build_seconds}s")
+        _count_use(key)
+    return client
+
+
+def _count_use(key):
+    # Same lock as evict_client(), so a count never races an eviction; an evicted client's
+    # remaining uses are simply not counted
+    with _registry_lock:
+        info = _client_info.get(key)
+        if info is not None:
+            info['uses'] += 1
+
+
+def get_cohere_client(api_key):
+    return get_client('cohere', api_key=api_key)
+
+
+def get_cohere_chat_client(api_key):
+    return get_client('cohere_v2', api_key=api_key)
+
+
+def get_genai_client(api_key):
+    return get_client('genai', api_key=api_key)
+
+
+def get_imagen_model(model):
+    return get_client('imagen', model=model)
+
+
+def is_warm(provider, model=None, api_key=None):
+    """Whether a client for this provider/model/credentials has already been built"""
+    return (provider, model, _fingerprint(api_key)) in _clients
+
+
+def evict_client(provider, model=None, api_key=None):
+    """Drop a cached client, e.g. after its credentials were rotated"""
+    key = (provider, model, _fingerprint(api_key))
+    with _registry_lock:
+        _clients.pop(key, None)
+        _client_info.pop(key, None)
+
+
+def client_status():
+    """
+    Describe every warm client in this process.
+
+    Returns:
+        list: One dict per client with provider, model, credentials tag,
+        build time and use count
+    """
+    with _registry_lock:
+        infos = [(key, dict(info)) for key, info in _client_info.items()]
+    status = []
+    for (provider, model, credentials), info in infos:
+        status.append({
+            'provider': provider,
+            'model': model,
+            'credentials': credentials,
+            'warm': True,
+            'built_at': info['built_at'],
+            'build_seconds': info['build_seconds'],
+            'uses': info['uses'],
+        })
+    return status
@@ -0,0 +1,327 @@
+# core/cache_utils.py
+"""
+Result caches backed by Django's cache framework (posters, backgrounds and
+LLM text replies), plus hit/miss counters and latency windows.
+"""
+import re
+import json
+import time
+import atexit
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+
+from .models import StatCounter
+
+
+STATS_PREFIX = "parlorpal:stats"
+
+# Latency windows and (with Redis) counters; entries never expire
+stats_cache = caches['stats']
+
+
+def normalize_prompt(prompt_text):
+    """Collapse whitespace so cosmetic prompt differences share a cache entry"""
+    return re.sub(r"\s+", " ", prompt_text or "").strip()
+
+
+def content_hash(*parts):
+    """sha256 over the given parts, separated so ('ab', 'c') != ('a', 'bc')"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def atomic_counters():
+    """Redis increments are atomic and keep the key's (absent) expiry; the database cache's are neither"""
+    return settings.CACHES['stats']['BACKEND'].endswith('RedisCache')
+
+
+def increment_counter(name, amount=1):
+    """
+    Increment a shared counter, creating it on first use. Counters are
+    metrics: an exception in the caller's request is never worth it, so
+    failures are logged and ignored.
+    """
+    try:
+        return _write_counter(name, amount)
+    except Exception as e:
+        print(f"WARNING: Could not update counter {STATS_PREFIX}:{name}: {e}")
+        return None
+
+
+def _write_counter(name, amount):
+    key = f"{STATS_PREFIX}:{name}"
+    if atomic_counters():
+        # Key missing: add() only wins for one concurrent caller, the others increment
+        if stats_cache.add(key, amount, timeout=None):
+            return amount
+        return stats_cache.incr(key, amount)
+    updated = StatCounter.objects.filter(name=name).update(value=F('value') + amount)
+    if not updated:
+        try:
+            with transaction.atomic():
+                StatCounter.objects.create(name=name, value=amount)
+            return amount
+        except IntegrityError:
+            # Created by a concurrent caller in the meantime
+            StatCounter.objects.filter(name=name).update(value=F('value') + amount)
+    return None
+
+
+def get_counter(name):
+    """The shared value plus this process's increments that are not flushed yet"""
+    with _pending_lock:
+        pending = _pending_counts.get(name, 0)
+    if atomic_counters():
+        return stats_cache.get(f"{STATS_PREFIX}:{name}", 0) + pending
+    return (StatCounter.objects.filter(name=name).values_list('value', flat=True).first() or 0) + pending
+
+
+# -----------------
+# BATCHED COUNTERS
+# -----------------
+# Cache hit/miss events happen on every lookup, so they are added up in memory and
+# written by a background thread every COUNTER_FLUSH_INTERVAL seconds (one UPDATE
+# per counter per flush) instead of costing the request a database write each.
+_pending_counts = {}
+_pending_lock = threading.Lock()
+_flusher = None
+
+
+def count_later(name, amount=1):
+    """Add to a counter without touching the cache or database; see flush_counters()"""
+    global _flusher
+    with _pending_lock:
+        _pending_counts[name] = _pending_counts.get(name, 0) + amount
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_periodically, name="counter-flusher", daemon=True)
+            _flusher.start()
+
+
+def flush_counters():
+    """
+    Write the batched increments of this process to the shared counters.
+
+    Returns:
+        int: The number of counters written
+    """
+    global _pending_counts
+    with _pending_lock:
+        pending, _pending_counts = _pending_counts, {}
+    for name, amount in pending.items():
+        try:
+            _write_counter(name, amount)
+        except Exception as e:
+            # Kept for the next flush
+            print(f"WARNING: Could not flush counter {STATS_PREFIX}:{name}: {e}")
+            with _pending_lock:
+                _pending_counts[name] = _pending_counts.get(name, 0) + amount
+    return len(pending)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.COUNTER_FLUSH_INTERVAL)
+        try:
+            flush_counters()
+        finally:
+            close_old_connections()
+
+
+# Counts still in memory when the process exits (deploys, worker restarts) are written out
+atexit.register(flush_counters)
+
+
+def record_cache_event(namespace, hit):
+    count_later(f"{namespace}:{'hits' if hit else 'misses'}")
+
+
+def cache_stats(namespace):
+    """
+    Hit/miss counters for one cache namespace.
+
+    Returns:
+        dict: hits, misses and hit_rate (0.0 - 1.0)
+    """
+    hits = get_counter(f"{namespace}:hits")
+    misses = get_counter(f"{namespace}:misses")
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 3) if total else 0.0,
+    }
+
+
+LATENCY_WINDOW = 200
+
+
+def record_latency(name, seconds):
+    """
+    Add a sample to a rolling window of recent latencies. Like the counters
+    this is best-effort: concurrent writers may drop a sample.
+    """
+    key = f"{STATS_PREFIX}:latency:{name}"
+    try:
+        samples = stats_cache.get(key) or []
+        samples.append(round(seconds, 3))
+        stats_cache.set(key, samples[-LATENCY_WINDOW:], timeout=None)
+    except Exception as e:
+        print(f"WARNING: Could not record latency for {name}: {e}")
+
+
+def latency_stats(name):
+    """
+    Percentiles over the recent latency window.
+
+    Returns:
+        dict: samples, p50 and p95 in seconds (None until a sample exists)
+    """
+    samples = sorted(stats_cache.get(f"{STATS_PREFIX}:latency:{name}") or [])
+    if not samples:
+        return {'samples': 0, 'p50': None, 'p95': None}
+
+    def percentile(p):
+        # Nearest-rank percentile
+        return samples[max(int(-(-p * len(samples) // 100)) - 1, 0)]
+
+    return {'samples': len(samples), 'p50': percentile(50), 'p95': percentile(95)}
+
+
+# -----------------
+# POSTER RESULT CACHE
+# -----------------
+def poster_cache_key(prompt_text, model_selection, variant=''):
+    parts = (normalize_prompt(prompt_text), model_selection)
+    if variant:
+        # Only added when set, so plain posters keep their existing keys
+        parts += (variant,)
+    return f"parlorpal:poster:{content_hash(*parts)}"
+
+
+def get_cached_poster(prompt_text, model_selection, variant=''):
+    """
+    Look up a previously stored poster for the same final prompt and model.
+    `variant` separates post-processed versions of the same generation
+    (e.g. with a logo overlay).
+
+    Returns:
+        dict: poster_url and renditions, or None on a miss or when caching is disabled
+    """
+    if not settings.POSTER_CACHE_TTL:
+        return None
+    cached = cache.get(poster_cache_key(prompt_text, model_selection, variant))
+    if isinstance(cached, str):
+        # Entries written before renditions existed held just the URL
+        cached = {'poster_url': cached, 'renditions': {}}
+    record_cache_event('poster_cache', cached is not None)
+    return cached
+
+
+def set_cached_poster(prompt_text, model_selection, poster_url, renditions=None, variant='', served_model=''):
+    if settings.POSTER_CACHE_TTL:
+        cache.set(
+            poster_cache_key(prompt_text, model_selection, variant),
+            {'poster_url': poster_url, 'renditions': renditions or {}, 'served_model': served_model},
+            timeout=settings.POSTER_CACHE_TTL
+        )
+
+
+# -----------------
+# POSTER BACKGROUND CACHE
+# -----------------
+def background_cache_key(prompt_text, model_selection):
+    return f"parlorpal:background:{content_hash(normalize_prompt(prompt_text), model_selection)}"
+
+
+def get_cached_background(prompt_text, model_selection):
+    """
+    Look up a stored text-free background. Background prompts carry no
+    business details, so entries are shared by every business.
+
+    Returns:
+        str: Background URL, or None on a miss or when caching is disabled
+    """
+    if not settings.POSTER_CACHE_TTL:
+        return None
+    cached = cache.get(background_cache_key(prompt_text, model_selection))
+    record_cache_event('background_cache', cached is not None)
+    return cached
+
+
+def set_cached_background(prompt_text, model_selection, background_url):
+    if settings.POSTER_CACHE_TTL:
+        cache.set(background_cache_key(prompt_text, model_selection), background_url, timeout=settings.POSTER_CACHE_TTL)
+
+
+# -----------------
+# TEXT RESPONSE CACHE
+# -----------------
+def text_cache_key(endpoint, prompt_text, model, params=None):
+    # Casing of the user's input rarely changes the reply, so it does not split entries
+    parts = (normalize_prompt(prompt_text).casefold(), model, json.dumps(params or {}, sort_keys=True))
+    return f"parlorpal:text:{endpoint}:{content_hash(*parts)}"
+
+
+def get_cached_text(endpoint, prompt_text, model, params=None):
+    """
+    Look up an LLM reply for the same normalized prompt, model and generation
+    params. Each endpoint has its own TTL in TEXT_CACHE_TTLS.
+
+    Args:
+        endpoint: 'caption', 'email_subjects' or 'chatbot'
+        params: Generation parameters that change the reply (max_tokens, temperature...)
+
+    Returns:
+        str: The cached reply, or None on a miss or when the endpoint is not cached
+    """
+    if not settings.TEXT_CACHE_TTLS.get(endpoint):
+        return None
+    cached = cache.get(text_cache_key(endpoint, prompt_text, model, params))
+    record_cache_event(f"text_cache:{endpoint}", cached is not None)
+    return cached
+
+
+def set_cached_text(endpoint, prompt_text, model, text, params=None):
+    ttl = settings.TEXT_CACHE_TTLS.get(endpoint)
+    if ttl and text:
+        cache.set(text_cache_key(endpoint, prompt_text, model, params), text, timeout=ttl)
+
+
+def text_cache_stats():
+    """Hit/miss counters of every cached text endpoint"""
+    return {endpoint: cache_stats(f"text_cache:{endpoint}") for endpoint in settings.TEXT_CACHE_TTLS}
+
+
+# -----------------
+# CHATBOT CONTEXT
+# -----------------
+def chat_context_key(user_id):
+    return f"parlorpal:chat_context:{user_id}"
+
+
+def get_chat_context(user_id):
+    """The user's cached chatbot context snapshot (dict), or None"""
+    context = cache.get(chat_context_key(user_id))
+    record_cache_event("chat_context", context is not None)
+    return context
+
+
+def set_chat_context(user_id, context):
+    cache.set(chat_context_key(user_id), context, timeout=settings.CHAT_CONTEXT_TTL)
+
+
+def invalidate_chat_context(user_id):
+    """
+    Drop the snapshot after the profile, posters or history change. Called by
+    the post_save signals in models.py, and directly after bulk_create and
+    queryset updates, which send no signals.
+    """
+    cache.delete(chat_context_key(user_id))
@@ -0,0 +1,108 @@
+# core/chat_store.py
+"""
+Chatbot conversation history, kept out of the session.
+
+With Redis configured (the 'chat' cache alias) each user/conversation gets
+a bounded ring buffer of recent turns in Redis: one read and one write per
+chat message, no database work. Appending a turn drops the oldest ones
+beyond CHAT_HISTORY_MAX_TURNS or CHAT_HISTORY_MAX_BYTES (UTF-8 size of the
+turn texts), and a conversation survives page navigation until
+CHAT_HISTORY_TTL passes without a message. With CHAT_HISTORY_PERSIST on,
+every turn is also appended to the ChatMessage table, and a buffer lost to
+eviction or expiry is rebuilt from its latest rows.
+
+Without Redis the ChatMessage table is the store: a turn is one INSERT of
+two small rows and the history one indexed SELECT of the latest rows. The
+database cache is not used - a cache row holding the whole buffer would be
+rewritten on every message, which is the session-row cost this module
+exists to avoid, and a per-process memory cache would give each web
+worker its own copy of the conversation.
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import ChatMessage
+
+
+DEFAULT_CONVERSATION = "default"
+
+# Conversation ids come from the browser (one per tab), so only short word-like ids are accepted
+_conversation_id = re.compile(r"^[\w-]{1,40}$")
+
+
+def conversation_id(value):
+    """The client's conversation id, or DEFAULT_CONVERSATION when it is missing or malformed"""
+    value = (value or '').strip()
+    return value if _conversation_id.match(value) else DEFAULT_CONVERSATION
+
+
+def cached_history():
+    """True when conversations are kept in the 'chat' (Redis) cache"""
+    return 'chat' in settings.CACHES
+
+
+def history_key(user_id, conversation):
+    return f"parlorpal:chat:{user_id}:{conversation}"
+
+
+def _trim(turns):
+    """
+    Apply the turn and byte caps: oldest turns go first, and a newest turn
+    that is too big on its own is truncated.
+    """
+    max_bytes = settings.CHAT_HISTORY_MAX_BYTES
+    turns = turns[-settings.CHAT_HISTORY_MAX_TURNS:]
+    sizes = [len(turn['content'].encode()) for turn in turns]
+    total = sum(sizes)
+    while len(turns) > 1 and total > max_bytes:
+        total -= sizes.pop(0)
+        turns.pop(0)
+    if turns and total > max_bytes:
+        turns[0] = {**turns[0], 'content': turns[0]['content'].encode()[:max_bytes].decode(errors='ignore')}
+    return turns
+
+
+def _stored_turns(user_id, conversation):
+    rows = ChatMessage.objects.filter(
+        user_id=user_id, conversation=conversation
+    ).values('role', 'content')[:settings.CHAT_HISTORY_MAX_TURNS]
+    return _trim([dict(row) for row in reversed(rows)])
+
+
+def get_history(user_id, conversation=DEFAULT_CONVERSATION):
+    """
+    Recent turns of a conversation.
+
+    Returns:
+        list: {'role': 'user' or 'bot', 'content': str} dicts, oldest first
+    """
+    if not cached_history():
+        return _stored_turns(user_id, conversation)
+    turns = caches['chat'].get(history_key(user_id, conversation))
+    if turns is None and settings.CHAT_HISTORY_PERSIST:
+        turns = _stored_turns(user_id, conversation)
+        if turns:
+            caches['chat'].set(history_key(user_id, conversation), turns, timeout=settings.CHAT_HISTORY_TTL)
+    return turns or []
+
+
+def append_turns(user_id, conversation, turns):
+    """
+    Add turns (normally a user message and its reply) to a conversation with
+    one cache write, and to the ChatMessage table when persistence is on or
+    there is no Redis.
+
+    Returns:
+        list: The conversation's turns after trimming
+    """
+    turns = [{'role': turn['role'], 'content': turn['content']} for turn in turns]
+    history = _trim(get_history(user_id, conversation) + turns)
+    if cached_history():
+        caches['chat'].set(history_key(user_id, conversation), history, timeout=settings.CHAT_HISTORY_TTL)
+    if settings.CHAT_HISTORY_PERSIST or not cached_history():
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user_id=user_id, conversation=conversation, **turn) for turn in turns
+        ])
+    return history
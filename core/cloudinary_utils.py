@@ -5,6 +5,10 @@ from cloudinary.utils import cloudinary_url
 from io import BytesIO
 from PIL import Image
 
+from django.conf import settings
+
+from .emulators import emulated_cloudinary_upload, emulated_cloudinary_destroy
+
 # Configure Cloudinary
 cloudinary.config(
     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -12,6 +16,13 @@ cloudinary.config(
     api_secret=os.getenv('CLOUDINARY_API_SECRET')
 )
 
+
+def _upload(file, **options):
+    if settings.AI_EMULATOR:
+        return emulated_cloudinary_upload(file, **options)
+    return cloudinary.uploader.upload(file, **options)
+
+
 def upload_image_to_cloudinary(image_bytes, folder="posters", public_id=None):
     """
     Upload image bytes to Cloudinary and return the URL
@@ -26,7 +37,7 @@ def upload_image_to_cloudinary(image_bytes, folder="posters", public_id=None):
     """
     try:
         # Upload to Cloudinary
-        response = cloudinary.uploader.upload(
+        response = _upload(
             image_bytes,
             folder=folder,
             public_id=public_id,
@@ -62,7 +73,7 @@ def upload_file_to_cloudinary(file, folder="logos", public_id=None):
     """
     try:
         # Upload to Cloudinary
-        response = cloudinary.uploader.upload(
+        response = _upload(
             file,
             folder=folder,
             public_id=public_id,
@@ -95,7 +106,10 @@ def delete_from_cloudinary(public_id):
         dict: Success status and response
     """
     try:
-        response = cloudinary.uploader.destroy(public_id)
+        if settings.AI_EMULATOR:
+            response = emulated_cloudinary_destroy(public_id)
+        else:
+            response = cloudinary.uploader.destroy(public_id)
         return {
             'success': True,
             'response': response
@@ -4,7 +4,7 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
-from .models import Festival
+from .models import Festival, PosterGeneration
 
 
 def generate_verification_token():
@@ -70,13 +70,18 @@ def send_festival_notification_email(user, festival, notification_type='pre'):
             subject = f"🎉 Happy {festival.name}! Special offers for your business!"
             countdown_text = "Today is the day!"
         
+        # Poster pre-generated overnight by pregenerate_festival_posters, if any
+        draft_poster = PosterGeneration.objects.filter(user=user, festival=festival).first()
+
         # HTML Email template
         html_message = render_to_string('core/emails/festival_notification.html', {
             'user': user,
             'festival': festival,
             'site_name': 'ParlorPal',
+            'site_url': settings.SITE_URL,
             'notification_type': notification_type,
-            'countdown_text': countdown_text
+            'countdown_text': countdown_text,
+            'draft_poster': draft_poster
         })
         
         # Plain text version
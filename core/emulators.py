@@ -0,0 +1,282 @@
+# core/emulators.py
+"""
+Offline stand-ins for the external providers (Cohere, Gemini, Imagen, Veo,
+Cloudinary and SMTP), enabled with AI_EMULATOR=True.
+
+Each emulated call sleeps for a latency drawn from a log-normal
+distribution, fails at the configured rates and returns a payload of the
+configured size, so views can be exercised and benchmarked without keys or
+network. Per-service settings come from DEFAULT_PROFILES, overridden by
+settings.AI_EMULATOR_CONFIG.
+"""
+import os
+import math
+import time
+import uuid
+import random
+import functools
+from io import BytesIO
+from types import SimpleNamespace
+
+import google.api_core.exceptions
+from google.genai import types
+from PIL import Image
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+
+
+# latency_p50 / latency_p95 in seconds; error_rate and quota_error_rate are
+# probabilities per call; payload is characters (text), pixels per side
+# (images) or bytes (video and uploads are sized by their input); block_rate
+# is the probability an image is withheld by the emulated safety filter;
+# ttft_fraction is the share of a streamed reply's latency before its first token
+DEFAULT_PROFILES = {
+    'cohere': {'latency_p50': 0.6, 'latency_p95': 1.8, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 400, 'ttft_fraction': 0.15},
+    'gemini_text': {'latency_p50': 0.8, 'latency_p95': 2.5, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 600},
+    'gemini_image': {'latency_p50': 12.0, 'latency_p95': 30.0, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 1024, 'block_rate': 0.0},
+    'imagen': {'latency_p50': 6.0, 'latency_p95': 15.0, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 1024, 'block_rate': 0.0},
+    'veo': {'latency_p50': 45.0, 'latency_p95': 90.0, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 2_000_000},
+    'cloudinary': {'latency_p50': 0.4, 'latency_p95': 1.2, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 0},
+    'smtp': {'latency_p50': 0.3, 'latency_p95': 1.0, 'error_rate': 0.0, 'quota_error_rate': 0.0, 'payload': 0},
+}
+
+_random = random.Random(getattr(settings, 'AI_EMULATOR_SEED', None))
+
+
+class EmulatedProviderError(Exception):
+    """A non-quota failure injected by the emulator"""
+
+
+def emulator_profile(service):
+    profile = dict(DEFAULT_PROFILES[service])
+    profile.update(settings.AI_EMULATOR_CONFIG.get(service, {}))
+    return profile
+
+
+def sample_latency(profile):
+    """Log-normal latency with the profile's median and 95th percentile"""
+    p50, p95 = profile['latency_p50'], profile['latency_p95']
+    if p50 <= 0:
+        return 0.0
+    sigma = math.log(max(p95, p50) / p50) / 1.645
+    return p50 * math.exp(sigma * _random.gauss(0, 1))
+
+
+def emulate_call(service):
+    """
+    Sleep like the real provider, then maybe fail like it.
+
+    Returns:
+        dict: The service profile, for sizing the payload
+    """
+    profile = emulator_profile(service)
+    time.sleep(sample_latency(profile))
+    emulate_failure(service, profile)
+    return profile
+
+
+def emulate_failure(service, profile):
+    """Raise a quota or provider error at the profile's rates"""
+    roll = _random.random()
+    if roll < profile['quota_error_rate']:
+        raise google.api_core.exceptions.ResourceExhausted(f"Emulated {service} quota exhausted")
+    if roll < profile['quota_error_rate'] + profile['error_rate']:
+        raise EmulatedProviderError(f"Emulated {service} failure")
+
+
+def emulated_block(profile):
+    """True when the emulated safety filter withholds an image"""
+    return _random.random() < profile.get('block_rate', 0.0)
+
+
+def emulated_text(prompt, size):
+    """Line-based filler text of about `size` characters"""
+    topic = " ".join(str(prompt).split()[:6]) or "your business"
+    lines = []
+    length = 0
+    while length < size:
+        line = f"✨ Emulated reply {len(lines) + 1} about {topic} 🎉"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=8)
+def emulated_image(side):
+    """A PNG with gradients and noise, so it encodes and resizes like a real poster"""
+    image = Image.merge('RGB', (
+        Image.linear_gradient('L').resize((side, side)),
+        Image.effect_noise((side, side), 48),
+        Image.radial_gradient('L').resize((side, side)),
+    ))
+    output = BytesIO()
+    image.save(output, format='PNG', compress_level=1)
+    return output.getvalue()
+
+
+@functools.lru_cache(maxsize=4)
+def emulated_video(size):
+    header = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+    return header + os.urandom(max(size - len(header), 0))
+
+
+# -----------------
+# COHERE
+# -----------------
+class EmulatedCohereClient:
+    def generate(self, model=None, prompt="", max_tokens=100, **kwargs):
+        profile = emulate_call('cohere')
+        text = emulated_text(prompt, min(profile['payload'], max_tokens * 4))
+        return SimpleNamespace(generations=[SimpleNamespace(text=text)])
+
+
+class EmulatedCohereV2Client:
+    """
+    cohere.ClientV2 stand-in. chat_stream sends the first token after
+    ttft_fraction of the sampled latency and spreads the rest over the words.
+    """
+
+    def chat_stream(self, model=None, messages=(), max_tokens=100, **kwargs):
+        profile = emulator_profile('cohere')
+        latency = sample_latency(profile)
+        ttft = latency * profile['ttft_fraction']
+        time.sleep(ttft)
+        emulate_failure('cohere', profile)
+        prompt = messages[-1]['content'] if messages else ""
+        words = emulated_text(prompt, min(profile['payload'], max_tokens * 4)).split(" ")
+        yield SimpleNamespace(type='message-start')
+        for index, word in enumerate(words):
+            text = word if index == 0 else f" {word}"
+            yield SimpleNamespace(type='content-delta', delta=SimpleNamespace(
+                message=SimpleNamespace(content=SimpleNamespace(text=text))
+            ))
+            time.sleep((latency - ttft) / len(words))
+        yield SimpleNamespace(type='message-end')
+
+
+# -----------------
+# GOOGLE GENAI (Gemini text/image, Veo)
+# -----------------
+class _EmulatedModels:
+    def generate_content(self, model, contents, config=None, **kwargs):
+        modalities = getattr(config, 'response_modalities', None) or []
+        if 'IMAGE' in modalities or 'image' in model:
+            profile = emulate_call('gemini_image')
+            if emulated_block(profile):
+                return types.GenerateContentResponse(candidates=[])
+            part = types.Part(inline_data=types.Blob(data=emulated_image(profile['payload']), mime_type='image/png'))
+        else:
+            profile = emulate_call('gemini_text')
+            part = types.Part(text=emulated_text(contents, profile['payload']))
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role='model', parts=[part]))]
+        )
+
+    def generate_videos(self, model, prompt, config=None, **kwargs):
+        profile = emulate_call('veo')
+        video = SimpleNamespace(uri=None, video_bytes=emulated_video(profile['payload']), mime_type='video/mp4')
+        return SimpleNamespace(
+            name=f"operations/emulated-{uuid.uuid4().hex[:8]}",
+            done=True,
+            response=SimpleNamespace(generated_videos=[SimpleNamespace(video=video)])
+        )
+
+
+class _EmulatedOperations:
+    def get(self, operation):
+        return operation
+
+
+class EmulatedGenaiClient:
+    def __init__(self):
+        self.models = _EmulatedModels()
+        self.operations = _EmulatedOperations()
+
+
+# -----------------
+# VERTEX IMAGEN
+# -----------------
+class EmulatedImagenModel:
+    def __init__(self, model):
+        self.model = model
+
+    def __repr__(self):
+        return f"EmulatedImagenModel({self.model})"
+
+    def generate_images(self, prompt, number_of_images=1, **kwargs):
+        profile = emulate_call('imagen')
+        image_bytes = emulated_image(profile['payload'])
+        return SimpleNamespace(images=[
+            SimpleNamespace(_image_bytes=image_bytes) for _ in range(number_of_images) if not emulated_block(profile)
+        ])
+
+
+def build_emulated_client(provider, model):
+    """Emulated counterpart of ai_clients._build_client"""
+    if provider == 'cohere':
+        return EmulatedCohereClient()
+    if provider == 'cohere_v2':
+        return EmulatedCohereV2Client()
+    if provider == 'genai':
+        return EmulatedGenaiClient()
+    if provider == 'imagen':
+        return EmulatedImagenModel(model)
+    raise ValueError(f"Unknown AI provider: {provider}")
+
+
+# -----------------
+# CLOUDINARY
+# -----------------
+def emulated_cloudinary_upload(file, folder="posters", public_id=None, **kwargs):
+    """
+    Stand-in for cloudinary.uploader.upload: writes the file under
+    MEDIA_ROOT/emulator/ so the returned URL is servable in development.
+    """
+    emulate_call('cloudinary')
+    data = file if isinstance(file, bytes) else file.read()
+    try:
+        with Image.open(BytesIO(data)) as image:
+            width, height, image_format = image.width, image.height, (image.format or 'png').lower()
+    except Exception:
+        width = height = None
+        image_format = 'bin'
+
+    public_id = f"{folder}/{public_id or uuid.uuid4().hex}"
+    relative_path = f"emulator/{public_id}.{image_format}"
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return {
+        'secure_url': settings.MEDIA_URL + relative_path,
+        'public_id': public_id,
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'bytes': len(data),
+    }
+
+
+def emulated_cloudinary_destroy(public_id, **kwargs):
+    emulate_call('cloudinary')
+    return {'result': 'ok'}
+
+
+# -----------------
+# SMTP
+# -----------------
+class EmulatedEmailBackend(BaseEmailBackend):
+    """Email backend that behaves like a slow, occasionally failing SMTP server and sends nothing"""
+
+    def send_messages(self, email_messages):
+        sent = 0
+        for message in email_messages:
+            try:
+                emulate_call('smtp')
+            except Exception:
+                if not self.fail_silently:
+                    raise
+                continue
+            sent += 1
+        return sent
@@ -0,0 +1,1756 @@
+# core/generation_utils.py
+"""
+Poster and video generation pipeline shared by the web views and the
+run_generation_worker management command.
+"""
+import io
+import os
+import csv
+import time
+import uuid
+import traceback
+import contextvars
+from io import BytesIO
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import vertexai
+import requests
+import google.api_core.exceptions
+from PIL import Image
+from dotenv import load_dotenv
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+# --- NEW: Gemini 3 Pro Image (Nano Banana) for better text rendering ---
+from google.genai import types
+
+from .models import BusinessProfile, GenerationJob, PosterGeneration, UserHistory
+from .cloudinary_utils import upload_image_to_cloudinary
+from .ai_clients import get_genai_client, get_imagen_model
+from .cache_utils import (
+    get_cached_poster, set_cached_poster, get_cached_background, set_cached_background,
+    increment_counter, record_latency, latency_stats, invalidate_chat_context,
+)
+from .renditions import render_poster_renditions
+from .prompt_templates import profile_fragments, render_prompt
+from .poster_layout import (
+    LAYOUT_TEMPLATES, LOGO_POSITIONS, fetch_image_bytes, load_remote_image, overlay_logo, render_composited_poster,
+)
+from .rate_limit import limited_call, is_quota_error
+from .timing import StageTimer, record_bytes, record_model, stage
+from .model_router import choose_poster_model
+from .preflight import JOB_TEXT_FIELDS, preflight_check, record_provider_block
+
+
+load_dotenv()
+
+DEFAULT_IMAGEN_MODEL = "imagen-4.0-ultra-generate-preview-06-06"
+
+
+class PosterGenerationError(Exception):
+    """Raised when a poster cannot be produced; the message is safe to show to the user"""
+
+
+class VideoGenerationError(PosterGenerationError):
+    """Raised when a video cannot be produced; the message is safe to show to the user"""
+
+
+class SafetyBlockedError(PosterGenerationError):
+    """Raised when the provider's safety filter returned no image"""
+
+
+class GenerationCancelled(Exception):
+    """Raised by a job runner that stopped because the user cancelled the work"""
+
+
+# -----------------
+# GOOGLE CREDENTIALS & VERTEX AI
+# -----------------
+# Handle Google credentials - support both file and environment variable
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREDENTIALS_PATH = os.path.join(BASE_DIR, 'secrets', 'image-gen-demo-epsilon-d9e1f100bfc8.json')
+
+# Try to set credentials from environment variable first (for production)
+google_creds_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
+if google_creds_json:
+    # Production: credentials provided as JSON string in environment variable
+    try:
+        credentials_file = '/tmp/google-credentials.json'
+        with open(credentials_file, 'w') as f:
+            f.write(google_creds_json)
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
+        print("SUCCESS: Using Google credentials from environment variable")
+    except Exception as e:
+        print(f"ERROR: Failed to write credentials from environment: {e}")
+elif os.path.exists(CREDENTIALS_PATH):
+    # Development: use local credentials file
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIALS_PATH
+    print(f"SUCCESS: Using local credentials file at {CREDENTIALS_PATH}")
+else:
+    print(f"WARNING: No Google credentials found. Image generation will not work.")
+
+# Initialize Vertex AI
+imagen_model_preview = None
+try:
+    if settings.AI_EMULATOR:
+        # Offline emulator: no Vertex AI project needed
+        imagen_model_preview = get_imagen_model(DEFAULT_IMAGEN_MODEL)
+        print("SUCCESS: Using emulated AI providers")
+    elif os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
+        vertexai.init(project=os.getenv('GCP_PROJECT_ID'), location="us-central1")
+
+        # A balanced model that offers a good mix of quality and speed for general-purpose image generation.
+        # Imagen_Model = "imagen-4.0-generate-preview-06-06"
+
+        # A model optimized for speed and low latency, ideal for real-time applications.
+        # Imagen_Model = "imagen-4.0-fast-generate-preview-06-06"
+
+        # The highest quality model in the family, best for complex prompts, high detail, and accurate text rendering.
+        # Imagen_Model = "imagen-4.0-ultra-generate-preview-06-06"
+
+
+        # NOTE: We are now using Gemini 3 Pro Image (Nano Banana) via the generate_poster_gemini_3() function
+        # This old Vertex AI initialization is kept for backwards compatibility but not actively used
+        # Gemini 3 Pro Image is NOT available via ImageGenerationModel - it requires the google.genai library
+        Imagen_Model = DEFAULT_IMAGEN_MODEL  # Keep using Imagen as fallback
+
+
+        # Warm the shared registry so the first poster does not pay for model metadata
+        imagen_model_preview = get_imagen_model(Imagen_Model)
+
+        if imagen_model_preview:
+            print(f"imagen_model_preview initialized successfully: {imagen_model_preview}")
+            print(f"Using model: {Imagen_Model}")
+        else:
+            print(f"imagen_model_preview failed to initialize")
+            print(f"Model failed: {Imagen_Model}")
+        print("SUCCESS: Vertex AI initialized successfully")
+    else:
+        print("WARNING: Skipping Vertex AI initialization - no credentials available")
+except Exception as e:
+    error_details = traceback.format_exc()
+    print(f"CRITICAL: Could not initialize Vertex AI. Error: {e}")
+    print(f"DEBUG: Full error traceback: {error_details}")
+    imagen_model_preview = None
+
+
+# -----------------
+# GEMINI 3 PRO IMAGE (NANO BANANA)
+# -----------------
+def generate_poster_gemini_3(user_prompt):
+    """
+    Generates a poster using Gemini 3 Pro Image (Nano Banana).
+    This model handles TEXT and EMOTIONS much better than Imagen.
+
+    Args:
+        user_prompt: The detailed prompt for poster generation
+
+    Returns:
+        bytes: The encoded image exactly as returned by the API, or None when
+        the response has no image part (safety filtered)
+
+    Raises:
+        PosterGenerationError: if GOOGLE_API_KEY is not configured
+        Quota errors left after the limiter's retries, ProviderBusyError and
+        transport errors, unchanged - these are not safety blocks
+    """
+    # 1. Get the shared Client (different from Vertex AI)
+    if not settings.GOOGLE_API_KEY:
+        print("ERROR: GOOGLE_API_KEY not configured in settings.py")
+        raise PosterGenerationError("Gemini image generation is not configured. Please choose an Imagen model.")
+
+    client = get_genai_client(settings.GOOGLE_API_KEY)
+
+    # 2. Define the Model ID (This is Nano Banana Pro)
+    model_id = "gemini-3-pro-image-preview"
+
+    # 3. Create a config to ensure high quality (simplified config)
+    config = types.GenerateContentConfig(
+        response_modalities=['IMAGE']  # Request an image back
+    )
+
+    print(f"DEBUG: Sending prompt to {model_id} (Nano Banana)...")
+
+    # 4. Generate content
+    try:
+        response = limited_call(
+            'gemini_image',
+            model_id,
+            client.models.generate_content,
+            model=model_id,
+            contents=[user_prompt],
+            config=config
+        )
+    except Exception as e:
+        print(f"ERROR: Gemini 3 Pro Image generation failed: {e}")
+        raise
+
+    print(f"DEBUG: Received response from Gemini 3 Pro Image")
+
+    # 5. Extract the Image
+    return gemini_response_image(response)
+
+
+def gemini_response_image(response):
+    """
+    The first inline image of a Gemini response.
+
+    Returns:
+        bytes: Raw image bytes (not base64), or None when the response has no image
+    """
+    if hasattr(response, 'candidates') and response.candidates:
+        for candidate in response.candidates:
+            if hasattr(candidate, 'content') and candidate.content:
+                content = candidate.content
+                if hasattr(content, 'parts') and content.parts:
+                    for part in content.parts:
+                        if hasattr(part, 'inline_data') and part.inline_data:
+                            if hasattr(part.inline_data, 'data'):
+                                # Data is already raw binary (not base64)
+                                image_data = part.inline_data.data
+                                print(f"DEBUG: Successfully extracted image ({len(image_data)} bytes)")
+                                return image_data
+
+    print("WARNING: No image found in Gemini 3 Pro response")
+    return None
+
+
+# -----------------
+# PIPELINE STAGES
+# -----------------
+def build_poster_prompt(profile, promotion_name, final_offer, language):
+    """
+    Render the poster prompt from the business profile and promotion details.
+
+    Returns:
+        tuple: (RenderedPrompt, details) where details holds the business fields used
+    """
+    fragments = profile_fragments(profile)
+    details = {
+        'business_name': profile.business_name,
+        'location': fragments['location'],
+        'phone': profile.phone if profile.phone else "Your Phone",
+        'timing': fragments['timing'] or "9:00 AM - 8:00 PM",
+    }
+    prompt = render_prompt(
+        'poster',
+        business_type=fragments['business_type'],
+        promotion_name=promotion_name,
+        final_offer=final_offer,
+        language=language,
+        **details
+    )
+    # Not a prompt variable; only used by the optional logo overlay
+    details['logo_url'] = profile.image_url
+    return prompt, details
+
+
+def build_background_prompt(profile, promotion_name, final_offer):
+    """
+    Render the text-free background prompt for a composited poster. The
+    business details are returned for the layout engine to draw instead.
+
+    Returns:
+        tuple: (RenderedPrompt, details) where details holds the fields drawn on the poster
+    """
+    fragments = profile_fragments(profile)
+    details = {
+        'business_name': profile.business_name,
+        'location': fragments['address_line'],
+        'phone': profile.phone,
+        'timing': fragments['timing'],
+        'logo_url': profile.image_url,
+    }
+    prompt = render_prompt(
+        'poster_background',
+        business_type=fragments['business_type'],
+        promotion_name=promotion_name
+    )
+    return prompt, details
+
+
+def generate_poster_image(prompt_text, model_selection):
+    """
+    Route the prompt to Gemini 3 Pro Image or a Vertex AI Imagen model.
+
+    Returns:
+        bytes: The encoded image as returned by the provider
+
+    Raises:
+        PosterGenerationError: if the provider produced no usable image
+        google.api_core.exceptions.ResourceExhausted: on provider quota errors
+    """
+    return generate_poster_images(prompt_text, model_selection, 1)[0]
+
+
+def _gemini_variant_task(prompt_text):
+    try:
+        return generate_poster_gemini_3(prompt_text)
+    finally:
+        # The rate limiter's state is read through the database cache from this thread
+        connections.close_all()
+
+
+def generate_poster_images(prompt_text, model_selection, count):
+    """
+    Generate `count` candidates for one prompt: a single Imagen call with
+    number_of_images, or one concurrent fan-out of Gemini calls (Gemini
+    returns one image per request).
+
+    Returns:
+        list: Encoded images as returned by the provider - at least one,
+        possibly fewer than count when some were blocked or failed
+
+    Raises:
+        SafetyBlockedError: only when the provider answered without any image
+        PosterGenerationError: if the provider produced no usable image
+        google.api_core.exceptions.ResourceExhausted: on provider quota errors
+    """
+    print(f"DEBUG: About to generate {count} image(s) with model: {model_selection}")
+
+    if "gemini" in model_selection.lower():
+        # Use Gemini 3 Pro Image (Nano Banana) for better text rendering
+        print(f"DEBUG: Using Gemini 3 Pro Image API")
+        if count == 1:
+            images = [generate_poster_gemini_3(prompt_text)]
+            errors = []
+        else:
+            futures = [_hedge_executor.submit(_gemini_variant_task, prompt_text) for _ in range(count)]
+            images, errors = [], []
+            for future in futures:
+                try:
+                    images.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+        images = [image_bytes for image_bytes in images if image_bytes]
+        if not images:
+            if errors:
+                # Quota, capacity or transport failures, not a safety block
+                raise errors[0]
+            print(f"DEBUG: Gemini 3 Pro Image returned no image")
+            raise SafetyBlockedError("Image could not be generated (it may have been blocked by safety filters).")
+        return images
+
+    # Use Vertex AI Imagen models (free with credits)
+    print(f"DEBUG: Using Vertex AI Imagen: {model_selection}")
+    if not imagen_model_preview:
+        raise PosterGenerationError("Imagen models are not initialized. Please check your Google credentials.")
+
+    # Reuse the warm client for the selected model
+    try:
+        imagen_model = get_imagen_model(model_selection)
+        response = limited_call(
+            'imagen',
+            model_selection,
+            imagen_model.generate_images,
+            prompt=prompt_text,
+            number_of_images=count,
+            aspect_ratio="1:1",
+            safety_filter_level="block_some",
+            person_generation="allow_all"
+        )
+    except google.api_core.exceptions.ResourceExhausted:
+        raise
+    except Exception as img_error:
+        print(f"DEBUG: Imagen generation error: {img_error}")
+        print(f"DEBUG: Full error traceback: {traceback.format_exc()}")
+        raise PosterGenerationError("Image generation failed with selected model. Please try a different model or contact support.")
+
+    # ImageGenerationResponse has .images attribute; filtered candidates are left out
+    if response and hasattr(response, 'images') and len(response.images) > 0:
+        images = [image._image_bytes for image in response.images]
+        print(f"DEBUG: Successfully generated {len(images)} image(s) with Imagen: {model_selection}")
+        return images
+
+    print(f"DEBUG: Imagen returned no images (may be blocked by safety filters)")
+    raise SafetyBlockedError("Image could not be generated. It may have been blocked by safety filters. Try rephrasing your promotion.")
+
+
+# -----------------
+# HEDGED GENERATION
+# -----------------
+HEDGE_MIN_SAMPLES = 20
+
+# Provider calls cannot be aborted once sent, so a losing hedge keeps its thread
+# until the provider answers; the pool is sized for that.
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='poster-hedge')
+
+
+def poster_provider(model_selection):
+    """'gemini' or 'imagen' - the backend a model id is served by"""
+    return 'gemini' if "gemini" in model_selection.lower() else 'imagen'
+
+
+def hedge_alternate(model_selection):
+    """The model on the other backend used to hedge a slow request"""
+    if poster_provider(model_selection) == 'gemini':
+        return settings.POSTER_HEDGE_IMAGEN_MODEL
+    return settings.POSTER_HEDGE_GEMINI_MODEL
+
+
+def hedge_delay(provider):
+    """
+    Seconds to wait for a provider before hedging: its recent p95, bounded by
+    POSTER_HEDGE_MIN_DELAY and POSTER_HEDGE_DELAY.
+    """
+    stats = latency_stats(f"provider:{provider}")
+    if stats['samples'] < HEDGE_MIN_SAMPLES:
+        return settings.POSTER_HEDGE_DELAY
+    return min(max(stats['p95'], settings.POSTER_HEDGE_MIN_DELAY), settings.POSTER_HEDGE_DELAY)
+
+
+def timed_generate_poster_image(prompt_text, model_selection):
+    """generate_poster_image, recording provider and model latency for successful calls"""
+    started = time.monotonic()
+    image_bytes = generate_poster_image(prompt_text, model_selection)
+    elapsed = time.monotonic() - started
+    record_latency(f"provider:{poster_provider(model_selection)}", elapsed)
+    record_latency(f"model:{model_selection}", elapsed)
+    return image_bytes
+
+
+def _hedge_task(prompt_text, model_selection):
+    try:
+        return timed_generate_poster_image(prompt_text, model_selection)
+    finally:
+        # Latency samples may be written through the database cache from this thread
+        connections.close_all()
+
+
+def generate_poster_image_hedged(prompt_text, model_selection):
+    """
+    Generate with the selected model, and if it is slower than the hedge delay
+    (or fails), also ask the alternate backend. The first valid image wins and
+    the other request is ignored.
+
+    Returns:
+        tuple: (image_bytes, served_model) from whichever provider answered first
+
+    Raises:
+        The primary request's error when both requests fail
+    """
+    alternate = hedge_alternate(model_selection)
+    delay = hedge_delay(poster_provider(model_selection))
+    primary = _hedge_executor.submit(_hedge_task, prompt_text, model_selection)
+
+    done, _ = wait([primary], timeout=delay)
+    if done and primary.exception() is None:
+        return primary.result(), model_selection
+
+    print(f"DEBUG: Hedging {model_selection} with {alternate} after "
+          f"{'an error' if done else f'{delay:.1f}s'}")
+    increment_counter("hedge:fired")
+    hedge = _hedge_executor.submit(_hedge_task, prompt_text, alternate)
+
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    increment_counter("hedge:won")
+                    print(f"DEBUG: Hedge request to {alternate} answered first")
+                for loser in pending:
+                    loser.cancel()
+                return future.result(), (alternate if future is hedge else model_selection)
+    raise primary.exception()
+
+
+def generate_poster_bytes(prompt_text, input_data):
+    """
+    Route a request to a model (see core/model_router.py) and generate,
+    hedged when POSTER_HEDGING is on.
+
+    Returns:
+        tuple: (image_bytes, served_model) - served_model is the model that actually answered
+    """
+    model_selection = choose_poster_model(input_data.get('model') or DEFAULT_IMAGEN_MODEL)
+    with stage('generate'):
+        if settings.POSTER_HEDGING:
+            image_bytes, served_model = generate_poster_image_hedged(prompt_text, model_selection)
+        else:
+            image_bytes, served_model = timed_generate_poster_image(prompt_text, model_selection), model_selection
+    record_model(served_model)
+    record_bytes('provider', len(image_bytes))
+    return image_bytes, served_model
+
+
+OUTPUT_FORMATS = {
+    # format name: (PIL format, file extension)
+    'png': ('PNG', 'png'),
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+
+
+def encode_poster_output(image_bytes):
+    """
+    Pick the bytes to store for a generated poster.
+
+    Provider bytes pass through untouched when their format is listed in
+    POSTER_PASSTHROUGH_FORMATS. Otherwise the image is decoded and encoded
+    exactly once to POSTER_OUTPUT_FORMAT with POSTER_OUTPUT_QUALITY.
+
+    Returns:
+        tuple: (output_bytes, file_extension)
+    """
+    # Image.open only parses the header here; pixels are decoded on demand
+    with Image.open(BytesIO(image_bytes)) as image:
+        source_format = (image.format or '').lower().replace('jpg', 'jpeg')
+        if source_format in settings.POSTER_PASSTHROUGH_FORMATS and source_format in OUTPUT_FORMATS:
+            print(f"DEBUG: Passing through {source_format} poster ({len(image_bytes)} bytes)")
+            return image_bytes, OUTPUT_FORMATS[source_format][1]
+
+        encoded, extension = encode_poster_image(image)
+
+    print(f"DEBUG: Encoded {source_format or 'unknown'} poster to {extension}: {len(image_bytes)} -> {len(encoded)} bytes")
+    return encoded, extension
+
+
+def encode_poster_image(image):
+    """
+    Encode a PIL image to POSTER_OUTPUT_FORMAT with the configured quality.
+
+    Returns:
+        tuple: (output_bytes, file_extension)
+    """
+    pil_format, extension = OUTPUT_FORMATS[settings.POSTER_OUTPUT_FORMAT]
+    output = BytesIO()
+    if pil_format == 'PNG':
+        image.save(output, format='PNG', compress_level=settings.POSTER_PNG_COMPRESS_LEVEL)
+    elif pil_format == 'JPEG':
+        image.convert('RGB').save(output, format='JPEG', quality=settings.POSTER_OUTPUT_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(output, format='WEBP', quality=settings.POSTER_OUTPUT_QUALITY, method=4)
+    return output.getvalue(), extension
+
+
+def save_poster_locally(image_bytes, extension):
+    """Write a poster under MEDIA_ROOT and return its MEDIA_URL path"""
+    filename = f"{uuid.uuid4()}.{extension}"
+    save_path = os.path.join(settings.MEDIA_ROOT, filename)
+    print(f"DEBUG: Attempting to save to: {save_path}")
+
+    os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+    with open(save_path, 'wb') as f:
+        f.write(image_bytes)
+
+    print(f"DEBUG: Image saved successfully")
+    return settings.MEDIA_URL + filename
+
+
+def store_poster(user, image_bytes):
+    """
+    Upload the poster to Cloudinary, writing to local disk only if the upload fails.
+
+    Returns:
+        tuple: (poster_url, uploaded) where uploaded is False when the
+        Cloudinary upload failed and the local MEDIA_URL copy is used instead
+    """
+    with stage('encode'):
+        output_bytes, extension = encode_poster_output(image_bytes)
+    record_bytes('output', len(output_bytes))
+
+    # Upload to Cloudinary
+    print("DEBUG: Uploading to Cloudinary...")
+    with stage('upload'):
+        cloudinary_result = upload_image_to_cloudinary(
+            output_bytes,
+            folder="posters",
+            public_id=f"poster_{user.username}_{uuid.uuid4().hex[:8]}"
+        )
+
+    if cloudinary_result['success']:
+        print(f"DEBUG: Cloudinary URL = {cloudinary_result['url']}")
+        return cloudinary_result['url'], True
+
+    print(f"DEBUG: Cloudinary upload failed: {cloudinary_result['error']}")
+    # Fallback to local storage
+    with stage('disk_write'):
+        return save_poster_locally(output_bytes, extension), False
+
+
+def store_poster_renditions(user, image_bytes):
+    """
+    Render POSTER_RENDITIONS in the process pool and upload them to Cloudinary.
+    Renditions are an optimisation, so any failure just leaves them out.
+
+    Returns:
+        dict: rendition name -> URL
+    """
+    if not settings.POSTER_RENDITIONS:
+        return {}
+
+    try:
+        with stage('renditions'):
+            rendered = render_poster_renditions(
+                image_bytes,
+                settings.POSTER_RENDITIONS,
+                max_workers=settings.RENDITION_PROCESSES,
+                output_format=OUTPUT_FORMATS[settings.POSTER_OUTPUT_FORMAT][0],
+                quality=settings.POSTER_OUTPUT_QUALITY
+            )
+    except Exception as e:
+        print(f"WARNING: Poster renditions failed: {e}")
+        return {}
+    record_bytes('renditions', sum(len(data) for data in rendered.values()))
+
+    base_id = f"poster_{user.username}_{uuid.uuid4().hex[:8]}"
+    urls = {}
+    with stage('rendition_upload'), ThreadPoolExecutor(max_workers=max(len(rendered), 1)) as executor:
+        uploads = {
+            name: executor.submit(upload_image_to_cloudinary, data, folder="posters/renditions", public_id=f"{base_id}_{name}")
+            for name, data in rendered.items()
+        }
+        for name, future in uploads.items():
+            result = future.result()
+            if result['success']:
+                urls[name] = result['url']
+            else:
+                print(f"DEBUG: Rendition {name} upload failed: {result['error']}")
+    return urls
+
+
+def record_poster(user, input_data, prompt, details, result, parent=None):
+    """
+    Write the PosterGeneration row and, for stored posters, the UserHistory row.
+    `parent` is the poster an edit was made from.
+
+    Returns:
+        tuple: (poster, history) - history is None when the poster was only stored locally
+    """
+    renditions = result.get('renditions') or {}
+    history = None
+    with stage('db_write'), transaction.atomic():
+        # Track poster generation
+        poster = PosterGeneration.objects.create(
+            user=user,
+            promotion_name=input_data['promotion_name'],
+            offer_type=input_data['offer_type'],
+            poster_url=result['poster_url'],
+            thumbnail_url=renditions.get('thumbnail', ''),
+            renditions=renditions,
+            served_model=result.get('served_model', ''),
+            parent=parent,
+            upgrade_status=result.get('upgrade_status', '')
+        )
+
+        if result['uploaded']:
+            # Track in user history
+            history = UserHistory.objects.create(
+                user=user,
+                action_type='poster_generation',
+                input_data=poster_history_input(input_data, details, result['cache_hit'], result.get('served_model', '')),
+                output_data=result['poster_url'],
+                poster=poster,
+                **prompt.history_fields()
+            )
+    return poster, history
+
+
+def poster_history_input(input_data, details, cache_hit=False, served_model=''):
+    """The UserHistory.input_data payload for a poster generation"""
+    return {
+        'promotion_name': input_data['promotion_name'],
+        'offer_type': input_data['offer_type'],
+        'language': input_data.get('language'),
+        'model': input_data.get('model') or DEFAULT_IMAGEN_MODEL,
+        'served_model': served_model,
+        'cache_hit': cache_hit,
+        **details
+    }
+
+
+def prepare_poster_prompt(user, input_data):
+    """Load the user's profile and render the poster prompt for a job's input"""
+    try:
+        profile = BusinessProfile.objects.get(user=user)
+    except BusinessProfile.DoesNotExist:
+        raise PosterGenerationError("You must create a business profile first.")
+
+    if input_data.get('layout'):
+        return build_background_prompt(profile, input_data['promotion_name'], input_data['offer_type'])
+    return build_poster_prompt(
+        profile,
+        input_data['promotion_name'],
+        input_data['offer_type'],
+        input_data.get('language')
+    )
+
+
+def serve_cached_poster(user, input_data):
+    """
+    Finish a poster request from the result cache without calling a provider.
+    Composited (layout) posters are always left to the job queue: even on a
+    background cache hit, loading and drawing the poster is worker work.
+
+    Returns:
+        GenerationJob: An already finished job, or None on a cache miss
+    """
+    if input_data.get('regenerate') or input_data.get('variants') or input_data.get('layout'):
+        return None
+
+    model_selection = input_data.get('model') or DEFAULT_IMAGEN_MODEL
+    timer = StageTimer('poster_generation', model_selection)
+    cached = history = None
+    try:
+        with timer:
+            with stage('prompt'):
+                prompt, details = prepare_poster_prompt(user, input_data)
+            with stage('cache_lookup'):
+                cached = get_cached_poster(prompt.text, model_selection, poster_variant(input_data, details.get('logo_url')))
+            if not cached:
+                return None
+            print(f"DEBUG: Poster cache hit for {user.username}: {cached['poster_url']}")
+            result = {**cached, 'uploaded': True, 'cache_hit': True}
+
+            timer.cache_hit = True
+            _poster, history = record_poster(user, input_data, prompt, details, result)
+    finally:
+        # A plain cache miss is no generation: the queued job records its own timing
+        if cached or timer.outcome != 'ok':
+            timer.save(user, history)
+    now = timezone.now()
+    return GenerationJob.objects.create(
+        user=user,
+        job_type='poster_generation',
+        status='done',
+        input_data=input_data,
+        result_url=result['poster_url'],
+        started_at=now,
+        finished_at=now
+    )
+
+
+def poster_variant(input_data, logo_url):
+    """Poster cache variant for the post-processing a request asks for ('' for none)"""
+    if input_data.get('logo_position') in LOGO_POSITIONS and logo_url:
+        return f"logo:{input_data['logo_position']}:{logo_url}"
+    return ''
+
+
+def add_poster_logo(image_bytes, logo_url, position):
+    """
+    Overlay the business logo on a generated poster. A logo that cannot be
+    loaded is skipped, never failing the poster.
+
+    Returns:
+        bytes: The poster with the logo, or the original bytes
+    """
+    try:
+        with stage('logo_overlay'), Image.open(BytesIO(image_bytes)) as source:
+            image = overlay_logo(source, logo_url, position)
+    except Exception as e:
+        print(f"WARNING: Could not add logo {logo_url}: {e}")
+        return image_bytes
+    with stage('encode'):
+        return encode_poster_image(image)[0]
+
+
+def produce_poster(user, input_data, prompt_text, logo_url=None):
+    """
+    Get a poster for a prompt - from the result cache when allowed, otherwise
+    by calling the provider and storing the image and its renditions. Makes no
+    PosterGeneration or UserHistory writes so callers can record results
+    individually or in bulk. The logo is overlaid when input_data has a
+    logo_position and the business has a logo. Requests for several
+    variants go to produce_poster_variants.
+
+    Returns:
+        dict: poster_url, renditions, uploaded and cache_hit
+    """
+    if input_data.get('variants'):
+        return produce_poster_variants(user, input_data, prompt_text, logo_url)
+
+    model_selection = input_data.get('model') or DEFAULT_IMAGEN_MODEL
+    variant = poster_variant(input_data, logo_url)
+
+    # A duplicate submission may have been queued before the first one finished
+    if not input_data.get('regenerate'):
+        with stage('cache_lookup'):
+            cached = get_cached_poster(prompt_text, model_selection, variant)
+        if cached:
+            return {**cached, 'uploaded': True, 'cache_hit': True}
+
+    image_bytes, served_model = generate_poster_bytes(prompt_text, input_data)
+    if variant:
+        image_bytes = add_poster_logo(image_bytes, logo_url, input_data['logo_position'])
+    poster_url, uploaded = store_poster(user, image_bytes)
+    renditions = {}
+    if uploaded:
+        renditions = store_poster_renditions(user, image_bytes)
+        set_cached_poster(prompt_text, model_selection, poster_url, renditions, variant, served_model)
+    return {
+        'poster_url': poster_url,
+        'renditions': renditions,
+        'uploaded': uploaded,
+        'cache_hit': False,
+        'served_model': served_model,
+    }
+
+
+def _store_variant_task(user, image_bytes):
+    try:
+        return store_poster(user, image_bytes)
+    finally:
+        connections.close_all()
+
+
+def produce_poster_variants(user, input_data, prompt_text, logo_url=None):
+    """
+    Generate input_data['variants'] candidates in one provider round trip and
+    store each as a variant_N rendition for the user to choose from. The first
+    candidate is the poster until choose_poster_variant picks another; the
+    size renditions are only rendered for the chosen one. Variants bypass the
+    result cache, since the point is a fresh set to pick from.
+
+    Returns:
+        dict: poster_url, renditions (the variants), uploaded and cache_hit
+    """
+    model_selection = choose_poster_model(input_data.get('model') or DEFAULT_IMAGEN_MODEL)
+    count = min(int(input_data['variants']), settings.POSTER_MAX_VARIANTS)
+    with stage('generate'):
+        # Not fed to the latency stats: a multi-image call is slower than the
+        # single-image calls the hedge delay and router are tuned on
+        candidates = generate_poster_images(prompt_text, model_selection, count)
+    record_model(model_selection)
+    record_bytes('provider', sum(len(image_bytes) for image_bytes in candidates))
+    print(f"DEBUG: Got {len(candidates)} of {count} variants from {model_selection}")
+
+    if poster_variant(input_data, logo_url):
+        candidates = [add_poster_logo(image_bytes, logo_url, input_data['logo_position']) for image_bytes in candidates]
+
+    # Uploads run side by side; each task carries the timer so stages still add up
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _store_variant_task, user, image_bytes)
+            for image_bytes in candidates
+        ]
+        stored = [future.result() for future in futures]
+
+    return {
+        'poster_url': stored[0][0],
+        'renditions': {
+            f"{PosterGeneration.VARIANT_PREFIX}{index}": url
+            for index, (url, _uploaded) in enumerate(stored, start=1)
+        },
+        'uploaded': all(uploaded for _url, uploaded in stored),
+        'cache_hit': False,
+        'served_model': model_selection,
+    }
+
+
+def choose_poster_variant(poster, name):
+    """
+    Make one of a poster's variants the poster: point poster_url (and the
+    history entry) at it and render its size renditions. The other variants
+    are kept so the user can change their mind. Runs in a poster_variant job.
+
+    Returns:
+        PosterGeneration: The updated poster
+
+    Raises:
+        PosterGenerationError: if the poster has no variant by that name
+    """
+    variants = dict(poster.variants)
+    if name not in variants:
+        raise PosterGenerationError("That variant does not exist for this poster.")
+
+    poster_url = variants[name]
+    try:
+        with stage('download'):
+            image_bytes = fetch_image_bytes(poster_url)
+    except Exception as e:
+        print(f"WARNING: Could not load variant {poster_url}: {e}")
+        image_bytes = None
+    renditions = store_poster_renditions(poster.user, image_bytes) if image_bytes else {}
+
+    with transaction.atomic():
+        poster.poster_url = poster_url
+        poster.thumbnail_url = renditions.get('thumbnail', '')
+        poster.renditions = {**variants, **renditions}
+        poster.save(update_fields=['poster_url', 'thumbnail_url', 'renditions'])
+        UserHistory.objects.filter(poster=poster).update(output_data=poster_url)
+    print(f"DEBUG: Poster #{poster.pk} now uses {name}: {poster_url}")
+    return poster
+
+
+def run_poster_variant_job(job):
+    """
+    Apply a user's pick among a poster's variants (choose_poster_variant): the
+    variant is downloaded and its renditions rendered and uploaded off the request.
+
+    Returns:
+        str: The poster URL, now the chosen variant's
+    """
+    data = job.input_data
+    poster = PosterGeneration.objects.filter(pk=data['poster_id'], user=job.user).first()
+    if poster is None:
+        raise PosterGenerationError("That poster no longer exists.")
+    # Timed only to report the job's progress stages
+    with StageTimer('poster_variant', on_stage=job_stage_reporter(job)):
+        choose_poster_variant(poster, data['variant'])
+    return poster.poster_url
+
+
+def composite_poster(user, input_data, details, background, cache_hit):
+    """
+    Draw the business details over a background and store the poster and its renditions.
+
+    Returns:
+        dict: poster_url, renditions, uploaded and cache_hit (of the background)
+    """
+    fields = {
+        'business_name': details['business_name'],
+        'promotion_name': input_data['promotion_name'],
+        'offer': input_data['offer_type'],
+        'phone': details['phone'],
+        'timing': details['timing'],
+        'location': details['location'],
+    }
+    with stage('composite'):
+        poster = render_composited_poster(background, fields, input_data['layout'], details.get('logo_url'))
+    with stage('encode'):
+        image_bytes, _extension = encode_poster_image(poster)
+    poster_url, uploaded = store_poster(user, image_bytes)
+    renditions = store_poster_renditions(user, image_bytes) if uploaded else {}
+    return {
+        'poster_url': poster_url,
+        'renditions': renditions,
+        'uploaded': uploaded,
+        'cache_hit': cache_hit,
+    }
+
+
+def produce_composited_poster(user, input_data, prompt, details):
+    """
+    Composited poster: reuse a cached background for the same theme when
+    allowed, otherwise generate and store a new one, then draw the details.
+
+    Returns:
+        dict: poster_url, renditions, uploaded and cache_hit
+    """
+    model_selection = input_data.get('model') or DEFAULT_IMAGEN_MODEL
+    background_url = None
+    if not input_data.get('regenerate'):
+        with stage('cache_lookup'):
+            background_url = get_cached_background(prompt.text, model_selection)
+    if background_url:
+        with stage('background_load'):
+            background = load_remote_image(background_url)
+        return composite_poster(user, input_data, details, background, True)
+
+    background_bytes, served_model = generate_poster_bytes(prompt.text, input_data)
+
+    with stage('background_upload'):
+        output_bytes, extension = encode_poster_output(background_bytes)
+        upload = upload_image_to_cloudinary(
+            output_bytes,
+            folder="backgrounds",
+            public_id=f"background_{uuid.uuid4().hex[:12]}"
+        )
+    if upload['success']:
+        set_cached_background(prompt.text, model_selection, upload['url'])
+    else:
+        print(f"DEBUG: Background upload failed: {upload['error']}")
+
+    with Image.open(BytesIO(background_bytes)) as source:
+        background = source.convert('RGBA')
+    return {**composite_poster(user, input_data, details, background, False), 'served_model': served_model}
+
+
+def run_poster_job(job):
+    """
+    Run every stage of a poster generation job and record the result.
+
+    Returns:
+        str: The stored poster URL
+    """
+    data = job.input_data
+    model_selection = data.get('model') or DEFAULT_IMAGEN_MODEL
+    timer = StageTimer('poster_generation', model_selection, on_stage=job_stage_reporter(job))
+    history = None
+    try:
+        with timer:
+            if job.started_at:
+                timer.add('queue_wait', (job.started_at - job.created_at).total_seconds())
+            with stage('prompt'):
+                prompt, details = prepare_poster_prompt(job.user, data)
+            print(f"DEBUG: Poster prompt {prompt.template_id} v{prompt.version}, ~{prompt.estimated_tokens} tokens")
+
+            if data.get('layout'):
+                result = produce_composited_poster(job.user, data, prompt, details)
+            elif wants_draft(data):
+                # Quick draft now; run_poster_upgrade_job swaps in the full render later
+                draft_data = {**data, 'model': settings.POSTER_DRAFT_MODEL}
+                result = produce_poster(job.user, draft_data, prompt.text, details.get('logo_url'))
+                if result['uploaded']:
+                    result['upgrade_status'] = 'pending'
+            else:
+                result = produce_poster(job.user, data, prompt.text, details.get('logo_url'))
+            timer.cache_hit = result['cache_hit']
+            poster, history = record_poster(job.user, data, prompt, details, result)
+    finally:
+        timer.save(job.user, history)
+
+    if result.get('upgrade_status') == 'pending':
+        upgrade = enqueue_generation_job(job.user, 'poster_upgrade', {**data, 'poster_id': poster.pk})
+        print(f"DEBUG: Queued upgrade job #{upgrade.pk} for draft poster #{poster.pk}")
+    return result['poster_url']
+
+
+def wants_draft(input_data):
+    """Progressive requests get a quick draft first, unless they already asked for the draft model"""
+    model_selection = input_data.get('model') or DEFAULT_IMAGEN_MODEL
+    return bool(input_data.get('progressive')) and model_selection != settings.POSTER_DRAFT_MODEL
+
+
+def upgrade_cancelled(poster_id):
+    return PosterGeneration.objects.filter(pk=poster_id, upgrade_status='cancelled').exists()
+
+
+def run_poster_upgrade_job(job):
+    """
+    Render the full-quality version of a progressive request's draft and swap
+    it into the draft's PosterGeneration. Cancelling the upgrade is checked
+    before the provider call, which cannot be aborted once sent, and again
+    before the swap, so a late cancel still keeps the draft.
+
+    Returns:
+        str: The full-quality poster URL
+
+    Raises:
+        GenerationCancelled: if the user cancelled the upgrade
+    """
+    data = job.input_data
+    poster_id = data['poster_id']
+    model_selection = data.get('model') or DEFAULT_IMAGEN_MODEL
+    timer = StageTimer('poster_upgrade', model_selection, on_stage=job_stage_reporter(job))
+    try:
+        with timer:
+            if job.started_at:
+                timer.add('queue_wait', (job.started_at - job.created_at).total_seconds())
+            with stage('prompt'):
+                prompt, details = prepare_poster_prompt(job.user, data)
+            if upgrade_cancelled(poster_id):
+                raise GenerationCancelled()
+
+            result = produce_poster(job.user, {**data, 'progressive': False}, prompt.text, details.get('logo_url'))
+            timer.cache_hit = result['cache_hit']
+            if not result['uploaded']:
+                raise PosterGenerationError("The full-quality poster could not be uploaded; keeping the draft.")
+
+            with stage('db_write'), transaction.atomic():
+                # Only swaps while still pending, so a cancel that raced the render wins
+                swapped = PosterGeneration.objects.filter(pk=poster_id, upgrade_status='pending').update(
+                    poster_url=result['poster_url'],
+                    thumbnail_url=result['renditions'].get('thumbnail', ''),
+                    renditions=result['renditions'],
+                    served_model=result.get('served_model', ''),
+                    upgrade_status='done'
+                )
+                if swapped:
+                    UserHistory.objects.filter(poster_id=poster_id).update(output_data=result['poster_url'])
+            if not swapped:
+                raise GenerationCancelled()
+    except GenerationCancelled:
+        timer.outcome, timer.error = 'cancelled', ''
+        raise
+    except Exception:
+        PosterGeneration.objects.filter(pk=poster_id, upgrade_status='pending').update(upgrade_status='failed')
+        raise
+    finally:
+        # The draft's timing row already owns the history link
+        timer.save(job.user)
+    print(f"DEBUG: Upgraded draft poster #{poster_id} to {result['poster_url']}")
+    return result['poster_url']
+
+
+def cancel_poster_upgrade(poster):
+    """
+    Keep a draft poster as it is. A queued upgrade job is cancelled before
+    it reaches a worker; a running one stops before (or discards) its
+    provider call.
+
+    Returns:
+        bool: False when there was no pending upgrade to cancel
+    """
+    with transaction.atomic():
+        cancelled = PosterGeneration.objects.filter(pk=poster.pk, upgrade_status='pending').update(upgrade_status='cancelled')
+        if cancelled:
+            GenerationJob.objects.filter(
+                user=poster.user,
+                job_type='poster_upgrade',
+                status='queued',
+                input_data__poster_id=poster.pk
+            ).update(status='cancelled', finished_at=timezone.now())
+    return bool(cancelled)
+
+
+# -----------------
+# POSTER EDITS
+# -----------------
+# Only Gemini takes an image as input; Imagen can only start from scratch
+POSTER_EDIT_MODEL = "gemini-3-pro-image-preview"
+
+
+def edit_poster_gemini(image_bytes, instruction_text):
+    """
+    Send an existing poster and a short change instruction to Gemini 3 Pro
+    Image, which returns the edited poster.
+
+    Returns:
+        bytes: The edited image as returned by the API
+
+    Raises:
+        PosterGenerationError: if Gemini is not configured or returned no image
+        google.api_core.exceptions.ResourceExhausted: on provider quota errors
+    """
+    if not settings.GOOGLE_API_KEY:
+        raise PosterGenerationError("Editing posters needs Gemini. Please configure GOOGLE_API_KEY.")
+
+    with Image.open(BytesIO(image_bytes)) as source:
+        mime_type = Image.MIME.get(source.format, 'image/png')
+
+    client = get_genai_client(settings.GOOGLE_API_KEY)
+    try:
+        response = limited_call(
+            'gemini_image',
+            POSTER_EDIT_MODEL,
+            client.models.generate_content,
+            model=POSTER_EDIT_MODEL,
+            contents=[types.Part.from_bytes(data=image_bytes, mime_type=mime_type), instruction_text],
+            config=types.GenerateContentConfig(response_modalities=['IMAGE'])
+        )
+    except Exception as e:
+        if is_quota_error(e) or isinstance(e, google.api_core.exceptions.ResourceExhausted):
+            raise
+        print(f"ERROR: Gemini poster edit failed: {e}")
+        print(f"DEBUG: Full error traceback: {traceback.format_exc()}")
+        raise PosterGenerationError("The poster could not be edited. Please try again or generate a new one.")
+
+    edited = gemini_response_image(response)
+    if not edited:
+        raise SafetyBlockedError("The edit could not be applied (it may have been blocked by safety filters). Try rewording it.")
+    return edited
+
+
+def run_poster_edit_job(job):
+    """
+    Edit one of the user's posters: the stored image plus the instruction go
+    to Gemini in place of the full poster prompt, and the result is recorded
+    as a new poster linked to its parent.
+
+    Returns:
+        str: The stored poster URL
+    """
+    data = job.input_data
+    timer = StageTimer('poster_edit', POSTER_EDIT_MODEL, on_stage=job_stage_reporter(job))
+    history = None
+    try:
+        with timer:
+            if job.started_at:
+                timer.add('queue_wait', (job.started_at - job.created_at).total_seconds())
+            with stage('prompt'):
+                parent = PosterGeneration.objects.filter(pk=data['parent_id'], user=job.user).first()
+                if parent is None:
+                    raise PosterGenerationError("The poster to edit no longer exists.")
+                profile = BusinessProfile.objects.filter(user=job.user).first()
+                prompt = render_prompt(
+                    'poster_edit',
+                    business_name=profile.business_name if profile else "",
+                    instruction=data['instruction'],
+                )
+            with stage('source_load'):
+                try:
+                    source_bytes = fetch_image_bytes(parent.poster_url)
+                except Exception as e:
+                    print(f"DEBUG: Could not load poster #{parent.pk} for editing: {e}")
+                    raise PosterGenerationError("The original poster could not be loaded for editing.")
+            record_bytes('source', len(source_bytes))
+
+            with stage('generate'):
+                image_bytes = edit_poster_gemini(source_bytes, prompt.text)
+            record_bytes('provider', len(image_bytes))
+
+            poster_url, uploaded = store_poster(job.user, image_bytes)
+            result = {
+                'poster_url': poster_url,
+                'renditions': store_poster_renditions(job.user, image_bytes) if uploaded else {},
+                'uploaded': uploaded,
+                'cache_hit': False,
+                'served_model': POSTER_EDIT_MODEL,
+            }
+            input_data = {
+                'promotion_name': parent.promotion_name,
+                'offer_type': parent.offer_type,
+                'model': POSTER_EDIT_MODEL,
+            }
+            details = {'edit_of': parent.pk, 'instruction': data['instruction']}
+            _poster, history = record_poster(job.user, input_data, prompt, details, result, parent=parent)
+    finally:
+        timer.save(job.user, history)
+    return poster_url
+
+
+# -----------------
+# VIDEO GENERATION
+# -----------------
+VIDEO_MODEL = "veo-3.0-generate-preview"
+VIDEO_POLL_INTERVAL = 20
+VIDEO_MAX_POLLS = 30  # Wait up to 10 minutes
+
+
+def save_video_locally(generated_video):
+    """
+    Write a generated video under MEDIA_ROOT/videos, from inline bytes or its download URI.
+
+    Returns:
+        str: MEDIA_URL path of the saved video
+    """
+    media_videos_path = os.path.join(settings.MEDIA_ROOT, 'videos')
+    os.makedirs(media_videos_path, exist_ok=True)
+    filename = f"video_{uuid.uuid4().hex[:12]}.mp4"
+    file_path = os.path.join(media_videos_path, filename)
+
+    if getattr(generated_video.video, 'video_bytes', None):
+        # Some responses carry the video inline instead of a download URI
+        with stage('disk_write'), open(file_path, 'wb') as f:
+            f.write(generated_video.video.video_bytes)
+    elif getattr(generated_video.video, 'uri', None):
+        with stage('download'):
+            try:
+                r = requests.get(generated_video.video.uri, stream=True, timeout=60)
+                r.raise_for_status()
+                with open(file_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=8192):
+                        f.write(chunk)
+            except requests.RequestException as e:
+                print(f"DEBUG: Video download failed: {e}")
+                raise VideoGenerationError("Failed to download generated video.")
+    else:
+        raise VideoGenerationError("Video generation did not return a video.")
+
+    record_bytes('video', os.path.getsize(file_path))
+    return settings.MEDIA_URL + f"videos/{filename}"
+
+
+def run_video_job(job):
+    """
+    Generate a Veo video for a job and save it under MEDIA_ROOT/videos.
+
+    Returns:
+        str: The saved video URL
+    """
+    data = job.input_data
+    timer = StageTimer('video_generation', VIDEO_MODEL, on_stage=job_stage_reporter(job))
+    try:
+        with timer:
+            if job.started_at:
+                timer.add('queue_wait', (job.started_at - job.created_at).total_seconds())
+            profile = BusinessProfile.objects.filter(user=job.user).first()
+            with stage('prompt'):
+                prompt = render_prompt(
+                    'video',
+                    script=data.get('script', ''),
+                    theme=data.get('theme', ''),
+                    campaign_name=data.get('campaign_name', ''),
+                    business_name=profile.business_name if profile else "",
+                    description=profile.description if profile else ""
+                )
+
+            client = get_genai_client(os.getenv('GOOGLE_VERTEX_API_KEY'))
+            with stage('generate'):
+                operation = limited_call(
+                    'veo',
+                    VIDEO_MODEL,
+                    client.models.generate_videos,
+                    model=VIDEO_MODEL,
+                    prompt=prompt.text,
+                    config=types.GenerateVideosConfig(
+                        person_generation="allow_all",
+                        aspect_ratio=data.get('aspect_ratio', '16:9'),
+                    ),
+                )
+            with stage('render_wait'):
+                for _ in range(VIDEO_MAX_POLLS):
+                    if operation.done:
+                        break
+                    time.sleep(VIDEO_POLL_INTERVAL)
+                    operation = client.operations.get(operation)
+
+            response = operation.response if operation.done else None
+            if not response or not getattr(response, 'generated_videos', None):
+                raise VideoGenerationError("Video generation did not complete successfully.")
+            video_url = save_video_locally(response.generated_videos[0])
+    finally:
+        # Videos have no history entry; the timing row stands alone
+        timer.save(job.user)
+    return video_url
+
+
+# -----------------
+# BULK GENERATION
+# -----------------
+POSTER_MODELS = [
+    "imagen-4.0-generate-preview-06-06",
+    "imagen-4.0-fast-generate-preview-06-06",
+    "imagen-4.0-ultra-generate-preview-06-06",
+    "gemini-3-pro-image-preview",
+]
+
+POSTER_LANGUAGES = ["English", "Kannada", "Hindi"]
+
+
+def parse_bulk_poster_csv(uploaded_file, max_rows):
+    """
+    Read a CSV of promotions with columns promotion_name, offer_type,
+    language and model (only promotion_name and offer_type are required).
+
+    Returns:
+        tuple: (rows, errors) - rows are job-style input_data dicts, errors are
+        human readable messages for rows that were skipped
+    """
+    try:
+        text = uploaded_file.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return [], ["The CSV file must be UTF-8 encoded."]
+
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or 'promotion_name' not in [f.strip() for f in reader.fieldnames]:
+        return [], ["The CSV needs a header row with at least promotion_name and offer_type columns."]
+
+    rows, errors = [], []
+    for line_number, raw in enumerate(reader, start=2):
+        row = {(key or '').strip(): (value or '').strip() for key, value in raw.items()}
+        if not any(row.values()):
+            continue
+        if len(rows) >= max_rows:
+            errors.append(f"Only the first {max_rows} promotions are generated per upload.")
+            break
+
+        promotion_name = row.get('promotion_name', '')
+        offer_type = row.get('offer_type', '')
+        language = row.get('language') or "English"
+        model = row.get('model') or DEFAULT_IMAGEN_MODEL
+
+        if not promotion_name or not offer_type:
+            errors.append(f"Line {line_number}: promotion_name and offer_type are required.")
+            continue
+        if language not in POSTER_LANGUAGES:
+            errors.append(f"Line {line_number}: unsupported language '{language}'.")
+            continue
+        if model not in POSTER_MODELS:
+            errors.append(f"Line {line_number}: unknown model '{model}'.")
+            continue
+        if "gemini" in model and not settings.GOOGLE_API_KEY:
+            errors.append(f"Line {line_number}: Gemini models require GOOGLE_API_KEY.")
+            continue
+        preflight = preflight_check('poster_bulk', {name: row.get(name, '') for name in JOB_TEXT_FIELDS['poster_bulk']})
+        if not preflight['success']:
+            errors.append(f"Line {line_number}: {preflight['error']}")
+            continue
+
+        rows.append({
+            'promotion_name': preflight['fields']['promotion_name'],
+            'offer_type': preflight['fields']['offer_type'],
+            'language': language,
+            'model': model,
+        })
+    return rows, errors
+
+
+def _bulk_poster_task(user, input_data, prompt_text):
+    try:
+        return produce_poster(user, input_data, prompt_text)
+    finally:
+        # Cache lookups may open a DB connection in this pool thread
+        connections.close_all()
+
+
+def _save_bulk_chunk(job, rows, prompts, finished, progress):
+    """
+    Record a chunk of finished bulk rows - their posters, history and the
+    job's progress - in one transaction, so a requeued job never redoes or
+    loses a saved row.
+    """
+    with transaction.atomic():
+        posters = PosterGeneration.objects.bulk_create([
+            PosterGeneration(
+                user=job.user,
+                promotion_name=rows[index]['promotion_name'],
+                offer_type=rows[index]['offer_type'],
+                poster_url=result['poster_url'],
+                thumbnail_url=result['renditions'].get('thumbnail', ''),
+                renditions=result['renditions'],
+                served_model=result.get('served_model', '')
+            )
+            for index, result in finished
+        ])
+        UserHistory.objects.bulk_create([
+            UserHistory(
+                user=job.user,
+                action_type='poster_generation',
+                input_data={
+                    **poster_history_input(rows[index], prompts[index][1], result['cache_hit'], result.get('served_model', '')),
+                    'bulk': True,
+                },
+                output_data=result['poster_url'],
+                poster=poster,
+                **prompts[index][0].history_fields()
+            )
+            for (index, result), poster in zip(finished, posters)
+            if result['uploaded']
+        ])
+        GenerationJob.objects.filter(pk=job.pk).update(progress=progress)
+    if finished:
+        # bulk_create sends no post_save
+        invalidate_chat_context(job.user_id)
+
+
+def run_bulk_poster_job(job):
+    """
+    Generate posters for every row of a CSV upload through a bounded thread
+    pool. Finished rows are saved every BULK_POSTER_SAVE_CHUNK rows together
+    with job.progress, which the bulk page polls. Rows already in the
+    progress of a requeued job are skipped.
+
+    Raises:
+        PosterGenerationError: if the profile is missing or no row produced a poster
+    """
+    try:
+        profile = BusinessProfile.objects.get(user=job.user)
+    except BusinessProfile.DoesNotExist:
+        raise PosterGenerationError("You must create a business profile first.")
+
+    rows = job.input_data['rows']
+    results = list(job.progress.get('results', []))
+    saved = {entry['row'] for entry in results}
+    pending = [index for index in range(len(rows)) if index + 1 not in saved]
+    prompts = {
+        index: build_poster_prompt(profile, rows[index]['promotion_name'], rows[index]['offer_type'], rows[index]['language'])
+        for index in pending
+    }
+
+    def current_progress():
+        return {
+            'total': len(rows),
+            'completed': len(results),
+            'created': sum(entry['status'] == 'done' for entry in results),
+            'failed': sum(entry['status'] == 'failed' for entry in results),
+            'results': results,
+        }
+
+    finished = []
+    unsaved = 0
+    with ThreadPoolExecutor(max_workers=settings.BULK_POSTER_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_bulk_poster_task, job.user, rows[index], prompts[index][0].text): index
+            for index in pending
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            entry = {'row': index + 1, 'promotion_name': rows[index]['promotion_name']}
+            try:
+                result = future.result()
+            except PosterGenerationError as e:
+                if isinstance(e, SafetyBlockedError):
+                    record_provider_block(job.job_type, {name: rows[index].get(name) for name in JOB_TEXT_FIELDS[job.job_type]})
+                entry.update(status='failed', error=str(e))
+            except Exception as e:
+                if isinstance(e, google.api_core.exceptions.ResourceExhausted) or is_quota_error(e):
+                    print(f"Quota Error: {e}")
+                    entry.update(status='failed', error="🚦 Too many requests! Please wait a minute and try again.")
+                else:
+                    print(f"General Error: {e}")
+                    print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+                    entry.update(status='failed', error=f"An unexpected error occurred: {e}")
+            else:
+                finished.append((index, result))
+                entry.update(
+                    status='done',
+                    poster_url=result['poster_url'],
+                    thumbnail_url=result['renditions'].get('thumbnail', ''),
+                    cache_hit=result['cache_hit'],
+                )
+            results.append(entry)
+            unsaved += 1
+            if unsaved >= settings.BULK_POSTER_SAVE_CHUNK:
+                _save_bulk_chunk(job, rows, prompts, finished, current_progress())
+                finished, unsaved = [], 0
+
+    job.progress = current_progress()
+    _save_bulk_chunk(job, rows, prompts, finished, job.progress)
+    if rows and not job.progress['created']:
+        raise PosterGenerationError("None of the posters could be generated. See the row errors for details.")
+    return ''
+
+
+# -----------------
+# JOB QUEUE
+# -----------------
+JOB_RUNNERS = {
+    'poster_generation': run_poster_job,
+    'poster_edit': run_poster_edit_job,
+    'poster_upgrade': run_poster_upgrade_job,
+    'video_generation': run_video_job,
+    'poster_bulk': run_bulk_poster_job,
+    'poster_variant': run_poster_variant_job,
+}
+
+# Worker queues (run_generation_worker): a video job holds its thread for many minutes while
+# Veo renders, so video jobs get their own threads and never delay posters
+JOB_QUEUES = {
+    'images': tuple(job_type for job_type in JOB_RUNNERS if job_type != 'video_generation'),
+    'video': ('video_generation',),
+}
+
+# Timing stage -> GenerationJob.stage shown to the user
+JOB_PROGRESS_STAGES = {
+    'prompt': 'prompting',
+    'cache_lookup': 'prompting',
+    'source_load': 'prompting',
+    'generate': 'generating',
+    'background_load': 'generating',
+    'composite': 'encoding',
+    'encode': 'encoding',
+    'background_upload': 'uploading',
+    'upload': 'uploading',
+    'disk_write': 'uploading',
+    'download': 'uploading',
+    'renditions': 'uploading',
+    'rendition_upload': 'uploading',
+    'db_write': 'saving',
+}
+
+
+def job_stage_reporter(job):
+    """
+    A StageTimer on_stage callback that stores a job's progress stage for the
+    events stream. Only changes are written; failures are logged and ignored.
+    """
+    last = [job.stage]
+
+    def report(timing_stage):
+        progress = JOB_PROGRESS_STAGES.get(timing_stage)
+        if progress is None or progress == last[0]:
+            return
+        last[0] = progress
+        try:
+            GenerationJob.objects.filter(pk=job.pk).update(stage=progress)
+        except Exception as e:
+            print(f"WARNING: Could not update stage of job #{job.pk}: {e}")
+
+    return report
+
+
+def enqueue_generation_job(user, job_type, input_data):
+    """
+    Create a queued generation job. When GENERATION_JOBS_INLINE is set the job
+    is processed immediately in the calling thread (useful without a worker).
+    """
+    job = GenerationJob.objects.create(
+        user=user,
+        job_type=job_type,
+        input_data=input_data
+    )
+    if getattr(settings, 'GENERATION_JOBS_INLINE', False):
+        if claim_generation_job(job):
+            process_generation_job(job)
+    return job
+
+
+def claim_generation_job(job):
+    """
+    Atomically move a queued job to running. Only one worker can win the
+    conditional UPDATE, so several workers can poll the same table safely.
+    """
+    now = timezone.now()
+    claimed = GenerationJob.objects.filter(pk=job.pk, status='queued').update(
+        status='running',
+        started_at=now,
+        heartbeat_at=now,
+        attempts=job.attempts + 1
+    )
+    if claimed:
+        job.status = 'running'
+        job.started_at = now
+        job.heartbeat_at = now
+        job.attempts += 1
+    return bool(claimed)
+
+
+def claim_next_generation_job(job_types=None):
+    """
+    Claim the oldest queued job, optionally only of the given job types, or
+    return None when the queue is empty
+    """
+    queued = GenerationJob.objects.filter(status='queued')
+    if job_types is not None:
+        queued = queued.filter(job_type__in=job_types)
+    for job in queued.order_by('created_at')[:10]:
+        if claim_generation_job(job):
+            return job
+    return None
+
+
+def heartbeat_generation_jobs(job_ids):
+    """Mark running jobs as still alive, so requeue_stale_generation_jobs leaves them alone"""
+    if not job_ids:
+        return 0
+    return GenerationJob.objects.filter(pk__in=job_ids, status='running').update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_generation_jobs(stale_after, max_attempts):
+    """
+    Put jobs whose worker died mid-run back on the queue, or fail them once
+    they have used up their attempts. A job is stale when its worker has not
+    sent a heartbeat for stale_after, however long the job itself has run.
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    cutoff = timezone.now() - stale_after
+    stale = GenerationJob.objects.filter(status='running').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status='failed',
+        error="Generation timed out. Please try again.",
+        finished_at=timezone.now()
+    )
+    return stale.filter(attempts__lt=max_attempts).update(status='queued', stage='queued')
+
+
+def process_generation_job(job):
+    """Run a claimed job and persist its final status"""
+    runner = JOB_RUNNERS.get(job.job_type)
+    try:
+        if runner is None:
+            raise PosterGenerationError(f"Unknown job type: {job.job_type}")
+        job.result_url = runner(job)
+        job.status = 'done'
+        job.stage = 'done'
+        job.error = ''
+    except GenerationCancelled:
+        job.status = 'cancelled'
+        job.error = ''
+    except PosterGenerationError as e:
+        if isinstance(e, SafetyBlockedError):
+            record_provider_block(job.job_type, {
+                name: job.input_data.get(name) for name in JOB_TEXT_FIELDS.get(job.job_type, ())
+            })
+        job.status = 'failed'
+        job.error = str(e)
+    except Exception as e:
+        job.status = 'failed'
+        if isinstance(e, google.api_core.exceptions.ResourceExhausted) or is_quota_error(e):
+            # Quota errors left after the limiter's retries (google.genai raises its own 429
+            # type), or no limiter slot free: never counted as a safety block
+            print(f"Quota Error: {e}")
+            job.error = "🚦 Too many requests! Please wait a minute and try again."
+        else:
+            print(f"General Error: {e}")
+            print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+            job.error = f"An unexpected error occurred: {e}"
+    job.finished_at = timezone.now()
+    fields = ['status', 'result_url', 'error', 'finished_at']
+    if job.status == 'done':
+        # Failed jobs keep the stage they reached (written by job_stage_reporter, not this instance)
+        fields.append('stage')
+    job.save(update_fields=fields)
+    return job
+
+
+# -----------------
+# FESTIVAL DRAFTS
+# -----------------
+def festival_draft_input(festival, model_selection, layout):
+    """The input_data used for every business's draft poster for a festival"""
+    return {
+        'promotion_name': f"{festival.name} Special",
+        'offer_type': settings.FESTIVAL_DRAFT_OFFER,
+        'language': 'English',
+        'model': model_selection,
+        'layout': layout,
+        'festival_id': festival.pk,
+    }
+
+
+def _festival_draft_task(profile, input_data):
+    try:
+        if input_data.get('layout'):
+            prompt, details = build_background_prompt(profile, input_data['promotion_name'], input_data['offer_type'])
+            return produce_composited_poster(profile.user, input_data, prompt, details)
+        prompt, details = build_poster_prompt(
+            profile, input_data['promotion_name'], input_data['offer_type'], input_data['language']
+        )
+        return produce_poster(profile.user, input_data, prompt.text, details.get('logo_url'))
+    finally:
+        connections.close_all()
+
+
+def generate_festival_drafts(festival, profiles, input_data, max_workers, batch_size, batch_interval):
+    """
+    Pre-generate a draft festival poster for each business profile.
+
+    Profiles are sent in batches of batch_size, at most one batch per
+    batch_interval seconds, through a pool of max_workers threads, so the
+    provider sees a steady paced load instead of a burst. The drafts of each
+    batch are saved with one bulk_create.
+
+    Yields a progress dict per profile and a final summary dict.
+    """
+    profiles = list(profiles)
+    total = len(profiles)
+    created = failed = completed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, total, batch_size):
+            batch_started = time.monotonic()
+            batch = profiles[start:start + batch_size]
+            futures = {executor.submit(_festival_draft_task, profile, input_data): profile for profile in batch}
+            drafts = []
+
+            for future in as_completed(futures):
+                profile = futures[future]
+                completed += 1
+                progress = {'business': profile.business_name, 'username': profile.user.username,
+                            'completed': completed, 'total': total}
+                try:
+                    result = future.result()
+                except google.api_core.exceptions.ResourceExhausted as e:
+                    print(f"Quota Error: {e}")
+                    failed += 1
+                    yield {**progress, 'status': 'failed', 'error': "Provider quota exhausted"}
+                    continue
+                except Exception as e:
+                    failed += 1
+                    yield {**progress, 'status': 'failed', 'error': str(e)}
+                    continue
+
+                drafts.append(PosterGeneration(
+                    user=profile.user,
+                    promotion_name=input_data['promotion_name'],
+                    offer_type=input_data['offer_type'],
+                    poster_url=result['poster_url'],
+                    thumbnail_url=result['renditions'].get('thumbnail', ''),
+                    renditions=result['renditions'],
+                    served_model=result.get('served_model', ''),
+                    is_draft=True,
+                    festival=festival
+                ))
+                yield {**progress, 'status': 'done', 'poster_url': result['poster_url'], 'cache_hit': result['cache_hit']}
+
+            PosterGeneration.objects.bulk_create(drafts)
+            created += len(drafts)
+
+            # Pace the provider: wait out the rest of this batch's window
+            remaining = batch_interval - (time.monotonic() - batch_started)
+            if start + batch_size < total and remaining > 0:
+                time.sleep(remaining)
+
+    yield {'status': 'complete', 'created': created, 'failed': failed, 'total': total}
@@ -0,0 +1,101 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from core.models import CustomUser
+
+
+# name: (url name, POST data builder taking the request number, send as AJAX)
+SCENARIOS = {
+    'captions': ('ai_suggestions', lambda i: {'user_input': f'Weekend offer {i}', 'language': 'english', 'length': 'small'}, True),
+    'chatbot': ('chatbot', lambda i: {'message': f'Give me a caption idea #{i}', 'current_page': '/dashboard/'}, True),
+    'email_subjects': ('email_subjects', lambda i: {'offer': f'{i}% off facials', 'audience': 'students', 'tone': 'playful'}, False),
+    'poster': ('generate_poster', lambda i: {
+        'promotion_name': f'Benchmark Sale {i}',
+        'offer_type': '20% OFF',
+        'language': 'English',
+        'model_selection': 'imagen-4.0-fast-generate-preview-06-06',
+        'regenerate': 'on',
+    }, True),
+    'video': ('generate_video', lambda i: {'campaign_name': f'Campaign {i}', 'theme': 'Festive', 'script': 'Short and sweet', 'aspect_ratio': '16:9'}, False),
+}
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[max(-(-p * len(samples) // 100) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = 'Measure throughput and tail latency of the AI views, normally against the offline emulator (AI_EMULATOR=True).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all): {', '.join(SCENARIOS)}")
+        parser.add_argument('--username', required=True, help='Existing user (with a business profile) to log in as')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+        parser.add_argument('--live', action='store_true', help='Allow running against real providers (costs money)')
+
+    def handle(self, *args, **options):
+        if not settings.AI_EMULATOR and not options['live']:
+            raise CommandError("AI_EMULATOR is off; set AI_EMULATOR=True or pass --live to call real providers.")
+
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        try:
+            user = CustomUser.objects.get(username=options['username'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+
+        for name in names:
+            self.run_scenario(name, user, options['requests'], options['concurrency'])
+
+    def run_scenario(self, name, user, total, concurrency):
+        url_name, build_data, ajax = SCENARIOS[name]
+        url = reverse(url_name)
+        host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*', '')), 'localhost').lstrip('.')
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        local = threading.local()
+
+        def one_request(i):
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_HOST=host)
+                local.client.force_login(user)
+            started = time.monotonic()
+            try:
+                response = local.client.post(url, build_data(i), **headers)
+                ok = response.status_code < 400
+                if ok and response.get('Content-Type', '').startswith('application/json'):
+                    data = json.loads(response.content)
+                    # Inline poster jobs report provider failures as a failed job status
+                    ok = data.get('success', True) and data.get('status') != 'failed'
+            except Exception as e:
+                self.stderr.write(f"  {name} #{i}: {e}")
+                ok = False
+            finally:
+                connections.close_all()
+            return time.monotonic() - started, ok
+
+        self.stdout.write(f"⏱️  {name}: {total} requests to {url} with {concurrency} clients")
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one_request, range(total)))
+        elapsed = time.monotonic() - started
+
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        self.stdout.write(self.style.SUCCESS(
+            f"  {total / elapsed:.2f} req/s, errors {errors}/{total}, "
+            f"p50 {percentile(latencies, 50):.3f}s, p95 {percentile(latencies, 95):.3f}s, "
+            f"p99 {percentile(latencies, 99):.3f}s, max {latencies[-1]:.3f}s"
+        ))
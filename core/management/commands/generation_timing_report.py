@@ -0,0 +1,101 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import GenerationTiming
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[max(-(-p * len(samples) // 100) - 1, 0)]
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = 'Print p50/p95/p99 of every generation stage per action and model over a date range.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to include, YYYY-MM-DD (default: 7 days ago)')
+        parser.add_argument('--until', help='Last day to include, YYYY-MM-DD (default: today)')
+        parser.add_argument('--action', help='Only this action type, e.g. poster_generation')
+        parser.add_argument('--model', help='Only this model id')
+        parser.add_argument(
+            '--include-cache-hits',
+            action='store_true',
+            help='Include generations answered from the poster/background cache',
+        )
+        parser.add_argument(
+            '--outcome',
+            choices=['ok', 'failed', 'cancelled', 'all'],
+            default='ok',
+            help='Stage percentiles of successful (default), failed or cancelled generations, or all of them',
+        )
+
+    def handle(self, *args, **options):
+        until = parse_date(options['until']) if options['until'] else timezone.localdate()
+        since = parse_date(options['since']) if options['since'] else until - timedelta(days=7)
+        if since > until:
+            raise CommandError("--since must not be after --until.")
+
+        timings = GenerationTiming.objects.filter(
+            created_at__gte=timezone.make_aware(datetime.combine(since, time.min)),
+            created_at__lt=timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min)),
+        )
+        if options['action']:
+            timings = timings.filter(action_type=options['action'])
+        if options['model']:
+            timings = timings.filter(model=options['model'])
+        if not options['include_cache_hits']:
+            timings = timings.filter(cache_hit=False)
+
+        # (action, model) -> stage -> seconds, -> payload -> bytes, and -> outcome -> count
+        stage_samples = defaultdict(lambda: defaultdict(list))
+        size_samples = defaultdict(lambda: defaultdict(list))
+        outcomes = defaultdict(lambda: defaultdict(int))
+        for action_type, model, outcome, total, stages, sizes in timings.values_list(
+            'action_type', 'model', 'outcome', 'total_seconds', 'stages', 'sizes'
+        ).iterator():
+            group = (action_type, model)
+            outcomes[group][outcome] += 1
+            if options['outcome'] not in ('all', outcome):
+                continue
+            stage_samples[group]['total'].append(total)
+            for name, seconds in stages.items():
+                stage_samples[group][name].append(seconds)
+            for name, size in sizes.items():
+                size_samples[group][name].append(size)
+
+        self.stdout.write(f"⏱️  Generation timings {since} to {until}")
+        if not outcomes:
+            self.stdout.write(self.style.WARNING("No timings recorded in this range."))
+            return
+
+        for group in sorted(outcomes):
+            action_type, model = group
+            counts = ", ".join(f"{count} {outcome}" for outcome, count in sorted(outcomes[group].items()))
+            self.stdout.write(self.style.SUCCESS(f"\n{action_type} / {model or '-'} ({counts})"))
+            stages = stage_samples[group]
+            if not stages:
+                self.stdout.write(f"  no {options['outcome']} generations")
+                continue
+            self.stdout.write(f"  {'stage':<18}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+            # Slowest stages first, total last
+            names = sorted((name for name in stages if name != 'total'),
+                           key=lambda name: -percentile(sorted(stages[name]), 50))
+            for name in names + ['total']:
+                samples = sorted(stages[name])
+                self.stdout.write(
+                    f"  {name:<18}{len(samples):>6}{percentile(samples, 50):>9.3f}s"
+                    f"{percentile(samples, 95):>9.3f}s{percentile(samples, 99):>9.3f}s"
+                )
+            for name, sizes in sorted(size_samples[group].items()):
+                sizes.sort()
+                self.stdout.write(f"  {name} bytes: p50 {percentile(sizes, 50):,}  p95 {percentile(sizes, 95):,}")
@@ -0,0 +1,122 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import BusinessProfile, Festival, PosterGeneration
+from core.generation_utils import (
+    POSTER_MODELS,
+    festival_draft_input,
+    generate_festival_drafts,
+)
+from core.poster_layout import LAYOUT_TEMPLATES
+
+
+class Command(BaseCommand):
+    help = ('Pre-generate draft festival posters for opted-in businesses ahead of the festival notification. '
+            'Run nightly (off-peak), before send_festival_notifications.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days-ahead',
+            type=int,
+            default=1,
+            help='Prepare festivals whose notification date is within this many days',
+        )
+        parser.add_argument(
+            '--festival',
+            type=int,
+            help='Only this festival id (ignores --days-ahead)',
+        )
+        parser.add_argument(
+            '--model',
+            default='imagen-4.0-fast-generate-preview-06-06',
+            choices=POSTER_MODELS,
+            help='Model used for the drafts',
+        )
+        parser.add_argument(
+            '--layout',
+            default='classic',
+            choices=list(LAYOUT_TEMPLATES) + ['none'],
+            help="Crisp-text layout (backgrounds are shared across businesses), or 'none' for AI-drawn text",
+        )
+        parser.add_argument(
+            '--max-workers',
+            type=int,
+            default=settings.BULK_POSTER_MAX_WORKERS,
+            help='Concurrent provider calls',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Businesses per pacing window',
+        )
+        parser.add_argument(
+            '--batch-interval',
+            type=float,
+            default=60.0,
+            help='Minimum seconds between the start of two batches',
+        )
+        parser.add_argument(
+            '--test',
+            action='store_true',
+            help='Test mode - show which businesses would get a draft without generating',
+        )
+
+    def handle(self, *args, **options):
+        today = date.today()
+        if options['festival']:
+            festivals = Festival.objects.filter(pk=options['festival'])
+            if not festivals.exists():
+                raise CommandError(f"Festival {options['festival']} does not exist.")
+        else:
+            window_end = today + timedelta(days=options['days_ahead'])
+            festivals = [
+                festival for festival in Festival.objects.filter(is_active=True, date__gte=today)
+                if today <= festival.notification_date <= window_end
+            ]
+
+        self.stdout.write("🎨 Festival Poster Pre-generation")
+        self.stdout.write(f"Date: {today}")
+        self.stdout.write(f"Mode: {'TEST' if options['test'] else 'LIVE'}")
+        self.stdout.write("-" * 50)
+
+        if not festivals:
+            self.stdout.write(self.style.WARNING("No festival notifications coming up."))
+            return
+
+        layout = '' if options['layout'] == 'none' else options['layout']
+        for festival in festivals:
+            self.stdout.write(f"\n📅 {festival.name} ({festival.date}), notification on {festival.notification_date}")
+
+            profiles = (
+                BusinessProfile.objects
+                .filter(user__email_verified=True, user__notifications_enabled=True, user__is_active=True)
+                .exclude(user__in=PosterGeneration.objects.filter(festival=festival).values('user'))
+                .select_related('user')
+            )
+            count = profiles.count()
+            self.stdout.write(f"  {count} businesses need a draft")
+            if options['test'] or not count:
+                continue
+
+            input_data = festival_draft_input(festival, options['model'], layout)
+            for event in generate_festival_drafts(
+                festival,
+                profiles,
+                input_data,
+                max_workers=options['max_workers'],
+                batch_size=options['batch_size'],
+                batch_interval=options['batch_interval'],
+            ):
+                if event['status'] == 'done':
+                    self.stdout.write(f"  ✅ [{event['completed']}/{event['total']}] {event['business']}: {event['poster_url']}")
+                elif event['status'] == 'failed':
+                    self.stdout.write(self.style.ERROR(
+                        f"  ❌ [{event['completed']}/{event['total']}] {event['business']}: {event['error']}"
+                    ))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"  Created {event['created']} drafts, {event['failed']} failed"
+                    ))
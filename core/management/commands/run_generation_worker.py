@@ -0,0 +1,169 @@
+import time
+import threading
+import traceback
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+
+from core.generation_utils import (
+    JOB_QUEUES,
+    claim_next_generation_job,
+    heartbeat_generation_jobs,
+    process_generation_job,
+    requeue_stale_generation_jobs,
+)
+
+# Seconds between heartbeats of the jobs this process is running; keep well below --stale-after
+HEARTBEAT_INTERVAL = 30
+
+
+class Command(BaseCommand):
+    help = (
+        'Process queued poster and video generation jobs. Poster jobs and video jobs run on '
+        'separate thread pools, so a long video render never holds up posters. Run it as its '
+        'own supervised process (Render worker service, docker compose "worker" service) and '
+        'start several instances to scale throughput.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the jobs currently queued and exit',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to sleep when the queue is empty',
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=0,
+            help='Exit after processing this many jobs (0 = unlimited)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Threads processing poster jobs (0 = leave them to another worker)',
+        )
+        parser.add_argument(
+            '--video-concurrency',
+            type=int,
+            default=1,
+            help='Threads processing video jobs (0 = leave them to another worker)',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=5,
+            help='Minutes without a heartbeat after which a running job is considered abandoned and requeued',
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=2,
+            help='Give up on a job after this many worker pickups',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 0 or options['video_concurrency'] < 0:
+            raise CommandError("--concurrency and --video-concurrency cannot be negative.")
+        pools = [('images', options['concurrency']), ('video', options['video_concurrency'])]
+        if not any(size for _queue, size in pools):
+            raise CommandError("Nothing to do: both --concurrency and --video-concurrency are 0.")
+
+        self.options = options
+        self.processed = 0
+        self.running = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        stale_after = timedelta(minutes=options['stale_after'])
+
+        self.stdout.write(
+            f"🛠️  Generation worker started ({options['concurrency']} poster, "
+            f"{options['video_concurrency']} video threads, poll every {options['poll_interval']}s)"
+        )
+
+        threads = [
+            threading.Thread(target=self.run_queue, args=(queue,), name=f"{queue}-{number}", daemon=True)
+            for queue, size in pools
+            for number in range(size)
+        ]
+        requeue_stale_generation_jobs(stale_after, options['max_attempts'])
+        for thread in threads:
+            thread.start()
+
+        last_heartbeat = time.monotonic()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(options['poll_interval'])
+                close_old_connections()
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    with self.lock:
+                        running = list(self.running)
+                    try:
+                        heartbeat_generation_jobs(running)
+                    except Exception as e:
+                        print(f"WARNING: Could not send job heartbeats: {e}")
+                requeued = requeue_stale_generation_jobs(stale_after, options['max_attempts'])
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale jobs"))
+        except KeyboardInterrupt:
+            self.stopping.set()
+            self.stdout.write("Stopping after the jobs in progress...")
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {self.processed} jobs"))
+
+    def run_queue(self, queue):
+        """One worker thread: claim and process jobs of a queue until stopped"""
+        options = self.options
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_next_generation_job(JOB_QUEUES[queue])
+                except Exception as e:
+                    # A database hiccup must not kill the thread; the queue is polled again
+                    print(f"WARNING: Could not claim a {queue} job: {e}")
+                    job = None
+                if job is None:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"▶️  Job #{job.pk} ({job.job_type}) for {job.user.username}")
+                started = time.monotonic()
+                with self.lock:
+                    self.running.add(job.pk)
+                try:
+                    process_generation_job(job)
+                except Exception as e:
+                    # process_generation_job records job errors itself; this is a failure saving them.
+                    # The job stays 'running' and is requeued once it goes stale.
+                    print(f"WARNING: Job #{job.pk} could not be finished: {e}")
+                    print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+                    continue
+                finally:
+                    with self.lock:
+                        self.running.discard(job.pk)
+                elapsed = time.monotonic() - started
+
+                if job.status == 'done':
+                    self.stdout.write(self.style.SUCCESS(f"  ✅ Job #{job.pk} done in {elapsed:.1f}s: {job.result_url}"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"  ❌ Job #{job.pk} {job.status} in {elapsed:.1f}s: {job.error}"))
+
+                with self.lock:
+                    self.processed += 1
+                    if options['max_jobs'] and self.processed >= options['max_jobs']:
+                        self.stopping.set()
+        finally:
+            connection.close()
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_alter_postergeneration_promotion_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(choices=[('poster_generation', 'Poster Generation')], default='poster_generation', max_length=30)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('input_data', models.JSONField(help_text='Form input the job was created from')),
+                ('result_url', models.CharField(blank=True, help_text='Cloudinary or local URL of the result', max_length=500)),
+                ('error', models.TextField(blank=True, help_text='User-facing error message when the job failed')),
+                ('attempts', models.IntegerField(default=0, help_text='Number of times a worker picked up this job')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Generation Job',
+                'verbose_name_plural': 'Generation Jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postergeneration',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, help_text='Rendition name -> URL (instagram, whatsapp, story, ...)'),
+        ),
+        migrations.AddField(
+            model_name='postergeneration',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, help_text='Small rendition for lists and history', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='userhistory',
+            name='poster',
+            field=models.ForeignKey(blank=True, help_text='Poster row for poster generations (used for thumbnails)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='history_entries', to='core.postergeneration'),
+        ),
+    ]
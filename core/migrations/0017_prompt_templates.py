@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_poster_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='businessprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Changes on every save; keys cached prompt fragments'),
+        ),
+        migrations.AddField(
+            model_name='userhistory',
+            name='prompt_template',
+            field=models.CharField(blank=True, help_text="Prompt template id, e.g. 'poster'", max_length=50),
+        ),
+        migrations.AddField(
+            model_name='userhistory',
+            name='prompt_variables',
+            field=models.JSONField(blank=True, default=dict, help_text='Variables the prompt template was rendered with'),
+        ),
+        migrations.AddField(
+            model_name='userhistory',
+            name='prompt_version',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='userhistory',
+            name='prompt_used',
+            field=models.TextField(blank=True, help_text='Final prompt sent to AI (rows created before prompt templates)'),
+        ),
+    ]
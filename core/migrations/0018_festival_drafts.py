@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_prompt_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postergeneration',
+            name='festival',
+            field=models.ForeignKey(blank=True, help_text='Festival a pre-generated draft was made for', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='posters', to='core.festival'),
+        ),
+        migrations.AddField(
+            model_name='postergeneration',
+            name='is_draft',
+            field=models.BooleanField(default=False, help_text='Pre-generated for a festival and not yet kept by the user'),
+        ),
+    ]
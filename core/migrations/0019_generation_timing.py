@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_festival_drafts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action_type', models.CharField(help_text='poster_generation, text_generation or video_generation', max_length=30)),
+                ('model', models.CharField(blank=True, help_text='Model that served the generation', max_length=100)),
+                ('cache_hit', models.BooleanField(default=False)),
+                ('total_seconds', models.FloatField(help_text='Processing wall time; time spent queued is the queue_wait stage')),
+                ('stages', models.JSONField(default=dict, help_text='Stage name -> seconds')),
+                ('sizes', models.JSONField(blank=True, default=dict, help_text='Payload name -> bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('history', models.OneToOneField(blank=True, help_text='History entry of the generation (empty when none was written)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='timing', to='core.userhistory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_timings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
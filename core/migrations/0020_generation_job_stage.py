@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_generation_timing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='stage',
+            field=models.CharField(choices=[('queued', 'Queued'), ('prompting', 'Preparing prompt'), ('generating', 'Generating'), ('encoding', 'Encoding'), ('uploading', 'Uploading'), ('saving', 'Saving')], default='queued', help_text='Last stage a running job reached', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='job_type',
+            field=models.CharField(choices=[('poster_generation', 'Poster Generation'), ('video_generation', 'Video Generation')], default='poster_generation', max_length=30),
+        ),
+    ]
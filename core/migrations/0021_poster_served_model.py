@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_generation_job_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postergeneration',
+            name='served_model',
+            field=models.CharField(blank=True, help_text='Model that actually generated the image (blank when unknown)', max_length=100),
+        ),
+    ]
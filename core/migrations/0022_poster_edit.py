@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_poster_served_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postergeneration',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='Poster this one was edited from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='edits', to='core.postergeneration'),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='job_type',
+            field=models.CharField(choices=[('poster_generation', 'Poster Generation'), ('poster_edit', 'Poster Edit'), ('video_generation', 'Video Generation')], default='poster_generation', max_length=30),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_poster_edit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postergeneration',
+            name='upgrade_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Upgrading'), ('done', 'Upgraded'), ('cancelled', 'Cancelled'), ('failed', 'Failed')], help_text='Full-quality upgrade of a quick draft (blank for normal posters)', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='job_type',
+            field=models.CharField(choices=[('poster_generation', 'Poster Generation'), ('poster_edit', 'Poster Edit'), ('poster_upgrade', 'Poster Upgrade'), ('video_generation', 'Video Generation')], default='poster_generation', max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='queued', max_length=20),
+        ),
+    ]
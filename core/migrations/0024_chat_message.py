@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_poster_upgrade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.CharField(default='default', max_length=40)),
+                ('role', models.CharField(choices=[('user', 'User'), ('bot', 'Bot')], max_length=10)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_messages', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['user', 'conversation', '-id'], name='core_chatme_user_id_690a4e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_chat_message'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='generationjob',
+            name='stage',
+            field=models.CharField(choices=[('queued', 'Queued'), ('prompting', 'Preparing prompt'), ('generating', 'Generating'), ('encoding', 'Encoding'), ('uploading', 'Uploading'), ('saving', 'Saving'), ('done', 'Done')], default='queued', help_text='Last stage a running job reached', max_length=20),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_job_stage_done'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_stat_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict, help_text='Per-row results of a bulk job, saved with each chunk of posters'),
+        ),
+        migrations.AlterField(
+            model_name='generationjob',
+            name='job_type',
+            field=models.CharField(choices=[('poster_generation', 'Poster Generation'), ('poster_edit', 'Poster Edit'), ('poster_upgrade', 'Poster Upgrade'), ('video_generation', 'Video Generation'), ('poster_bulk', 'Bulk Posters')], default='poster_generation', max_length=30),
+        ),
+    ]
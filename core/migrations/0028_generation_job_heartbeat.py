@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_generation_job_bulk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text='Last time the worker running this job reported it alive', null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_generation_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderLimitState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='provider:model', max_length=200, unique=True)),
+                ('tokens', models.FloatField(help_text='Token bucket level at `refilled`')),
+                ('refilled', models.FloatField(help_text='Unix time of the last bucket refill')),
+                ('concurrency_limit', models.FloatField(help_text='Current adaptive concurrent-call limit')),
+                ('leases', models.JSONField(blank=True, default=dict, help_text='Slot lease -> Unix time it expires')),
+                ('waiting', models.JSONField(blank=True, default=dict, help_text='Queued call -> Unix time it gives up')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_provider_limit_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='generationjob',
+            name='job_type',
+            field=models.CharField(choices=[('poster_generation', 'Poster Generation'), ('poster_edit', 'Poster Edit'), ('poster_upgrade', 'Poster Upgrade'), ('video_generation', 'Video Generation'), ('poster_bulk', 'Bulk Posters'), ('poster_variant', 'Poster Variant Choice')], default='poster_generation', max_length=30),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_generation_job_poster_variant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationtiming',
+            name='error',
+            field=models.CharField(blank=True, help_text='Why the generation failed or was cancelled', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='generationtiming',
+            name='outcome',
+            field=models.CharField(choices=[('ok', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='ok', max_length=20),
+        ),
+    ]
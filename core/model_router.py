@@ -0,0 +1,99 @@
+# core/model_router.py
+"""
+Load-aware poster model routing.
+
+Requests for the 'auto' model walk POSTER_MODEL_ROUTE (best quality first)
+and get the first model that has headroom. A model is under pressure when:
+- its rate limiter is nearly full or has callers queued,
+- its limiter's AIMD limit was cut by recent quota errors, or
+- its recent p95 latency exceeds MODEL_ROUTER_MAX_P95.
+The top tier is also skipped while the poster job backlog is above
+MODEL_ROUTER_BACKLOG. When every model is under pressure,
+MODEL_ROUTER_FALLBACK is used. Any other requested model is pinned and
+used as-is.
+"""
+from django.conf import settings
+
+from .models import GenerationJob
+from .cache_utils import increment_counter, get_counter, latency_stats
+from .rate_limit import ProviderLimiter
+
+
+AUTO_MODEL = "auto"
+
+# Latency samples needed before p95 is trusted
+ROUTER_MIN_SAMPLES = 10
+
+
+def limiter_for(model):
+    """The rate limiter a poster model's provider calls go through"""
+    return ProviderLimiter('gemini_image' if "gemini" in model.lower() else 'imagen', model)
+
+
+def model_available(model):
+    """Gemini models need GOOGLE_API_KEY; Imagen models need only Vertex AI"""
+    if "gemini" in model.lower():
+        return bool(settings.GOOGLE_API_KEY)
+    return True
+
+
+def model_pressure(model):
+    """
+    Why a model should not take new work right now.
+
+    Returns:
+        list: Reasons ('busy', 'queued', 'quota', 'slow'); empty when it has headroom
+    """
+    limiter = limiter_for(model)
+    in_flight, limit, waiting = limiter.load()
+    reasons = []
+    if in_flight >= limit * settings.MODEL_ROUTER_MAX_UTILIZATION:
+        reasons.append('busy')
+    if waiting > 0:
+        reasons.append('queued')
+    if limit < limiter.limits['max_concurrency'] / 2:
+        # The AIMD controller halves the limit on every quota error
+        reasons.append('quota')
+    stats = latency_stats(f"model:{model}")
+    if stats['samples'] >= ROUTER_MIN_SAMPLES and stats['p95'] > settings.MODEL_ROUTER_MAX_P95:
+        reasons.append('slow')
+    return reasons
+
+
+def choose_poster_model(requested):
+    """
+    Pick the model that should serve a poster request.
+
+    Args:
+        requested: A model id (pinned) or AUTO_MODEL
+
+    Returns:
+        str: The model id to call
+    """
+    if requested != AUTO_MODEL:
+        return requested
+
+    route = [model for model in settings.POSTER_MODEL_ROUTE if model_available(model)]
+    backlog = GenerationJob.objects.filter(job_type='poster_generation', status__in=['queued', 'running']).count()
+    for index, model in enumerate(route):
+        reasons = model_pressure(model)
+        if index == 0 and backlog > settings.MODEL_ROUTER_BACKLOG:
+            reasons.append('backlog')
+        if not reasons:
+            if index:
+                increment_counter("router:degraded")
+            increment_counter(f"router:{model}")
+            return model
+        print(f"DEBUG: Router skipped {model}: {', '.join(reasons)}")
+
+    increment_counter("router:degraded")
+    increment_counter(f"router:{settings.MODEL_ROUTER_FALLBACK}")
+    return settings.MODEL_ROUTER_FALLBACK
+
+
+def router_stats():
+    """How often each model was picked for auto requests, and how often the router degraded"""
+    return {
+        'degraded': get_counter("router:degraded"),
+        'served': {model: get_counter(f"router:{model}") for model in settings.POSTER_MODEL_ROUTE},
+    }
@@ -212,7 +212,7 @@ import sys
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.exceptions import ValidationError
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 
@@ -269,6 +269,8 @@ class BusinessProfile(models.Model):
     business_hours_end = models.TimeField(null=True, blank=True, help_text="Closing time")
     timing = models.CharField(max_length=100, blank=True, help_text="Business hours (e.g., 9:00 AM - 8:00 PM)")
 
+    updated_at = models.DateTimeField(auto_now=True, help_text="Changes on every save; keys cached prompt fragments")
+
     class Meta:
         verbose_name = "Business Profile"
         verbose_name_plural = "Business Profiles"
@@ -339,6 +341,14 @@ class SearchHistory(models.Model):
 
 
 class PosterGeneration(models.Model):
+    # Quick drafts are replaced by a full-quality render unless the user cancels
+    UPGRADE_STATUSES = [
+        ("pending", "Upgrading"),
+        ("done", "Upgraded"),
+        ("cancelled", "Cancelled"),
+        ("failed", "Failed"),
+    ]
+
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
 
     # ✅ FIX: was CharField(max_length=200) -> fails in Postgres if string > 200
@@ -346,14 +356,110 @@ class PosterGeneration(models.Model):
 
     offer_type = models.CharField(max_length=100)
     poster_url = models.CharField(max_length=500)
+    thumbnail_url = models.CharField(max_length=500, blank=True, help_text="Small rendition for lists and history")
+    renditions = models.JSONField(default=dict, blank=True, help_text="Rendition name -> URL (instagram, whatsapp, story, ...)")
+    served_model = models.CharField(max_length=100, blank=True, help_text="Model that actually generated the image (blank when unknown)")
+    is_draft = models.BooleanField(default=False, help_text="Pre-generated for a festival and not yet kept by the user")
+    festival = models.ForeignKey(
+        "Festival",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="posters",
+        help_text="Festival a pre-generated draft was made for"
+    )
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="edits",
+        help_text="Poster this one was edited from"
+    )
+    upgrade_status = models.CharField(
+        max_length=20,
+        choices=UPGRADE_STATUSES,
+        blank=True,
+        help_text="Full-quality upgrade of a quick draft (blank for normal posters)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Renditions named variant_1, variant_2, ... are candidates the user picks from
+    VARIANT_PREFIX = "variant_"
+
     class Meta:
         ordering = ["-created_at"]
 
     def __str__(self):
         return f"{self.user.username}: {self.promotion_name[:50]} - {self.created_at.strftime('%Y-%m-%d')}"
 
+    @property
+    def display_thumbnail_url(self):
+        """Thumbnail for list pages, falling back to the full poster for older rows"""
+        return self.thumbnail_url or self.poster_url
+
+    @property
+    def variants(self):
+        """(name, url) of the candidates stored by a variants request, in generation order"""
+        names = [name for name in self.renditions if name.startswith(self.VARIANT_PREFIX)]
+        names.sort(key=lambda name: int(name[len(self.VARIANT_PREFIX):]))
+        return [(name, self.renditions[name]) for name in names]
+
+
+class GenerationJob(models.Model):
+    """Queued AI generation request, processed by the run_generation_worker command"""
+    JOB_TYPES = [
+        ("poster_generation", "Poster Generation"),
+        ("poster_edit", "Poster Edit"),
+        ("poster_upgrade", "Poster Upgrade"),
+        ("video_generation", "Video Generation"),
+        ("poster_bulk", "Bulk Posters"),
+        ("poster_variant", "Poster Variant Choice"),
+    ]
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    ]
+    # Progress of a running job, streamed to the page by generation_job_events_view
+    STAGE_CHOICES = [
+        ("queued", "Queued"),
+        ("prompting", "Preparing prompt"),
+        ("generating", "Generating"),
+        ("encoding", "Encoding"),
+        ("uploading", "Uploading"),
+        ("saving", "Saving"),
+        ("done", "Done"),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="generation_jobs")
+    job_type = models.CharField(max_length=30, choices=JOB_TYPES, default="poster_generation")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued", db_index=True)
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES, default="queued", help_text="Last stage a running job reached")
+    input_data = models.JSONField(help_text="Form input the job was created from")
+    result_url = models.CharField(max_length=500, blank=True, help_text="Cloudinary or local URL of the result")
+    error = models.TextField(blank=True, help_text="User-facing error message when the job failed")
+    attempts = models.IntegerField(default=0, help_text="Number of times a worker picked up this job")
+    progress = models.JSONField(default=dict, blank=True, help_text="Per-row results of a bulk job, saved with each chunk of posters")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, help_text="Last time the worker running this job reported it alive")
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "Generation Job"
+        verbose_name_plural = "Generation Jobs"
+
+    def __str__(self):
+        return f"{self.user.username} - {self.get_job_type_display()} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ["done", "failed", "cancelled"]
+
 
 class Festival(models.Model):
     name = models.CharField(max_length=100, help_text="Name of the festival")
@@ -393,7 +499,18 @@ class UserHistory(models.Model):
     action_type = models.CharField(max_length=20, choices=ACTION_TYPES)
     input_data = models.JSONField(help_text="Original input data from user")
     output_data = models.TextField(help_text="Generated content or Cloudinary URL")
-    prompt_used = models.TextField(blank=True, help_text="Final prompt sent to AI")
+    prompt_used = models.TextField(blank=True, help_text="Final prompt sent to AI (rows created before prompt templates)")
+    prompt_template = models.CharField(max_length=50, blank=True, help_text="Prompt template id, e.g. 'poster'")
+    prompt_version = models.PositiveIntegerField(null=True, blank=True)
+    prompt_variables = models.JSONField(default=dict, blank=True, help_text="Variables the prompt template was rendered with")
+    poster = models.ForeignKey(
+        PosterGeneration,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="history_entries",
+        help_text="Poster row for poster generations (used for thumbnails)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -412,6 +529,112 @@ class UserHistory(models.Model):
     def is_text_action(self):
         return self.action_type == "text_generation"
 
+    @property
+    def prompt_text(self):
+        """The prompt sent to AI, rebuilt from its template when not stored verbatim"""
+        if self.prompt_used or not self.prompt_template:
+            return self.prompt_used
+        from .prompt_templates import rebuild_prompt
+        return rebuild_prompt(self.prompt_template, self.prompt_version, self.prompt_variables)
+
+    @property
+    def display_image_url(self):
+        """Thumbnail of the poster when one exists, otherwise the stored output URL"""
+        if self.poster_id and self.poster.thumbnail_url:
+            return self.poster.thumbnail_url
+        return self.output_data
+
+
+# Keep the chatbot's cached context snapshot (core/cache_utils.py) in step with what it summarises
+@receiver([post_save, post_delete], sender=BusinessProfile)
+@receiver([post_save, post_delete], sender=PosterGeneration)
+@receiver([post_save, post_delete], sender=UserHistory)
+def invalidate_chat_context_on_change(sender, instance, **kwargs):
+    if "loaddata" in sys.argv or not instance.user_id:
+        return
+    from .cache_utils import invalidate_chat_context
+    invalidate_chat_context(instance.user_id)
+
+
+class GenerationTiming(models.Model):
+    """Stage timings, payload sizes and model of one generation (see core/timing.py)"""
+    OUTCOMES = [
+        ("ok", "Succeeded"),
+        ("failed", "Failed"),
+        ("cancelled", "Cancelled"),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="generation_timings")
+    history = models.OneToOneField(
+        UserHistory,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="timing",
+        help_text="History entry of the generation (empty when none was written)"
+    )
+    action_type = models.CharField(max_length=30, help_text="poster_generation, text_generation or video_generation")
+    model = models.CharField(max_length=100, blank=True, help_text="Model that served the generation")
+    cache_hit = models.BooleanField(default=False)
+    outcome = models.CharField(max_length=20, choices=OUTCOMES, default="ok", db_index=True)
+    error = models.CharField(max_length=200, blank=True, help_text="Why the generation failed or was cancelled")
+    total_seconds = models.FloatField(help_text="Processing wall time; time spent queued is the queue_wait stage")
+    stages = models.JSONField(default=dict, help_text="Stage name -> seconds")
+    sizes = models.JSONField(default=dict, blank=True, help_text="Payload name -> bytes")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.action_type} {self.model} {self.total_seconds:.2f}s"
+
+
+class ChatMessage(models.Model):
+    """Append-only log of chatbot turns: the history store without Redis, otherwise written when CHAT_HISTORY_PERSIST is on (see core/chat_store.py)"""
+    ROLES = [
+        ("user", "User"),
+        ("bot", "Bot"),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="chat_messages")
+    conversation = models.CharField(max_length=40, default="default")
+    role = models.CharField(max_length=10, choices=ROLES)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-id"]
+        indexes = [models.Index(fields=["user", "conversation", "-id"])]
+
+    def __str__(self):
+        return f"{self.user.username} [{self.conversation}] {self.role}: {self.content[:50]}"
+
+
+class StatCounter(models.Model):
+    """Persistent hit/miss and event counter, used when no Redis cache is configured (see core/cache_utils.py)"""
+    name = models.CharField(max_length=200, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class ProviderLimitState(models.Model):
+    """
+    Rate limiter state of one provider/model, shared by all processes when no Redis
+    cache is configured. Rows are updated under select_for_update (see core/rate_limit.py).
+    """
+    name = models.CharField(max_length=200, unique=True, help_text="provider:model")
+    tokens = models.FloatField(help_text="Token bucket level at `refilled`")
+    refilled = models.FloatField(help_text="Unix time of the last bucket refill")
+    concurrency_limit = models.FloatField(help_text="Current adaptive concurrent-call limit")
+    leases = models.JSONField(default=dict, blank=True, help_text="Slot lease -> Unix time it expires")
+    waiting = models.JSONField(default=dict, blank=True, help_text="Queued call -> Unix time it gives up")
+
+    def __str__(self):
+        return f"{self.name}: {len(self.leases)}/{self.concurrency_limit:.2f} in flight"
+
 
 class TwoFactorAuth(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name="twofactor")
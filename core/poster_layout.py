@@ -0,0 +1,355 @@
+# core/poster_layout.py
+"""
+Deterministic poster compositing.
+
+The image model only paints a text-free themed background; business
+details are drawn on top with Pillow using a layout template. Fonts,
+decoded backgrounds and pre-scaled logos are cached in memory, so one
+background can be reused for many businesses in milliseconds and repeat
+posters by the same business never download or decode their logo again.
+"""
+import os
+import time
+import hashlib
+import threading
+import functools
+from io import BytesIO
+from string import Formatter
+from collections import OrderedDict
+
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+from django.conf import settings
+
+
+# Blocks are drawn in order. Boxes are (left, top, right, bottom) as fractions
+# of the poster size.
+#   panel - filled (optionally rounded) rectangle behind text
+#   text  - `parts` are formatted with the poster fields and joined with `sep` (default two
+#           spaces). A part is left out when a field it uses is empty, so separators and
+#           prefixes like "Call " only appear next to real values; a block with no parts left is skipped
+#   logo  - the business logo, fitted inside the box
+LAYOUT_TEMPLATES = {
+    'classic': [
+        {'type': 'panel', 'box': (0, 0, 1, 0.15), 'fill': (0, 0, 0, 150)},
+        {'type': 'text', 'parts': ['{business_name}'], 'box': (0.05, 0.02, 0.95, 0.13), 'bold': True, 'fill': (255, 255, 255)},
+        {'type': 'text', 'parts': ['{promotion_name}'], 'box': (0.08, 0.36, 0.92, 0.52), 'bold': True, 'max_lines': 2,
+         'fill': (255, 255, 255), 'stroke': (0, 0, 0)},
+        {'type': 'panel', 'box': (0.2, 0.55, 0.8, 0.66), 'fill': (255, 196, 0, 235), 'radius': 0.03},
+        {'type': 'text', 'parts': ['{offer}'], 'box': (0.23, 0.565, 0.77, 0.645), 'bold': True, 'fill': (40, 20, 0)},
+        {'type': 'logo', 'box': (0.80, 0.66, 0.96, 0.79)},
+        {'type': 'panel', 'box': (0, 0.80, 1, 1), 'fill': (0, 0, 0, 170)},
+        {'type': 'text', 'parts': ['Call {phone}', '{timing}'], 'sep': '  |  ', 'box': (0.05, 0.82, 0.95, 0.89),
+         'fill': (255, 255, 255)},
+        {'type': 'text', 'parts': ['{location}'], 'box': (0.05, 0.90, 0.95, 0.98), 'max_lines': 2, 'fill': (230, 230, 230)},
+    ],
+    'banner': [
+        {'type': 'logo', 'box': (0.82, 0.03, 0.97, 0.18)},
+        {'type': 'panel', 'box': (0, 0.68, 1, 1), 'fill': (0, 0, 0, 175)},
+        {'type': 'text', 'parts': ['{business_name}'], 'box': (0.05, 0.70, 0.95, 0.78), 'bold': True, 'fill': (255, 214, 90)},
+        {'type': 'text', 'parts': ['{promotion_name}', '{offer}'], 'sep': ' - ', 'box': (0.05, 0.79, 0.95, 0.88), 'bold': True, 'max_lines': 2,
+         'fill': (255, 255, 255)},
+        {'type': 'text', 'parts': ['{phone}', '{timing}', '{location}'], 'sep': '  |  ', 'box': (0.05, 0.89, 0.95, 0.98), 'max_lines': 2,
+         'fill': (230, 230, 230)},
+    ],
+}
+
+# Logo corners for AI-drawn posters: (x, y) anchor as fractions of the free space
+LOGO_POSITIONS = {
+    'top-left': (0, 0),
+    'top-right': (1, 0),
+    'bottom-left': (0, 1),
+    'bottom-right': (1, 1),
+}
+
+_remote_images = OrderedDict()
+_remote_bytes = 0
+_remote_lock = threading.Lock()
+
+# (url, etag, box) -> RGBA logo; box None is the decoded original, others are pre-scaled
+_logos = OrderedDict()
+_logo_bytes = 0
+# url -> (etag, monotonic time it was last confirmed)
+_logo_etags = {}
+_logo_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=256)
+def get_font(size, bold=False):
+    """A font at a pixel size, from POSTER_FONT_BOLD/POSTER_FONT_REGULAR or Pillow's built-in font"""
+    path = settings.POSTER_FONT_BOLD if bold else settings.POSTER_FONT_REGULAR
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError as e:
+            print(f"WARNING: Could not load font {path}: {e}")
+    return ImageFont.load_default(size)
+
+
+def fetch_image_bytes(url):
+    """Raw bytes of a stored image; MEDIA_URL paths are read from disk"""
+    if url.startswith(settings.MEDIA_URL):
+        with open(os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):]), 'rb') as f:
+            return f.read()
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+
+def load_remote_image(url):
+    """
+    Fetch and decode an image once per process, in an LRU bounded by
+    POSTER_REMOTE_IMAGE_CACHE_BYTES of decoded pixels. MEDIA_URL paths (local
+    fallback and emulator uploads) are read from disk.
+
+    Returns:
+        PIL.Image: RGBA image; callers must copy before drawing on it
+    """
+    with _remote_lock:
+        image = _remote_images.get(url)
+        if image is not None:
+            _remote_images.move_to_end(url)
+            return image
+
+    with Image.open(BytesIO(fetch_image_bytes(url))) as source:
+        image = source.convert('RGBA')
+
+    global _remote_bytes
+    with _remote_lock:
+        if url not in _remote_images:
+            _remote_images[url] = image
+            _remote_bytes += image.width * image.height * 4
+        while _remote_bytes > settings.POSTER_REMOTE_IMAGE_CACHE_BYTES and len(_remote_images) > 1:
+            _old_url, old = _remote_images.popitem(last=False)
+            _remote_bytes -= old.width * old.height * 4
+    return image
+
+
+def _fetch_logo(url, known_etag=None):
+    """
+    Fetch a logo unless it still matches known_etag. MEDIA_URL paths use
+    mtime and size as their ETag; remote logos without one use a content hash.
+
+    Returns:
+        tuple: (etag, data) - data is None when known_etag is still current
+    """
+    if url.startswith(settings.MEDIA_URL):
+        path = os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):])
+        stat = os.stat(path)
+        etag = f"{stat.st_mtime_ns}-{stat.st_size}"
+        if etag == known_etag:
+            return etag, None
+        with open(path, 'rb') as f:
+            return etag, f.read()
+
+    headers = {'If-None-Match': known_etag} if known_etag else {}
+    response = requests.get(url, headers=headers, timeout=10)
+    if response.status_code == 304 and known_etag:
+        return known_etag, None
+    response.raise_for_status()
+    return response.headers.get('ETag') or hashlib.sha256(response.content).hexdigest(), response.content
+
+
+def _cache_logo(key, image):
+    global _logo_bytes
+    with _logo_lock:
+        if key in _logos:
+            return
+        _logos[key] = image
+        _logo_bytes += image.width * image.height * 4
+        while _logo_bytes > settings.POSTER_LOGO_CACHE_BYTES and len(_logos) > 1:
+            _old_key, old = _logos.popitem(last=False)
+            _logo_bytes -= old.width * old.height * 4
+
+
+def get_scaled_logo(url, box):
+    """
+    A business logo decoded and scaled to fit box (width, height), from a
+    byte-bounded in-memory LRU keyed by URL and ETag. The ETag is revalidated
+    with a conditional request at most every POSTER_LOGO_REVALIDATE seconds.
+
+    Returns:
+        PIL.Image: RGBA logo; callers must not draw on it
+    """
+    with _logo_lock:
+        known = _logo_etags.get(url)
+    data = None
+    if known and time.monotonic() - known[1] < settings.POSTER_LOGO_REVALIDATE:
+        etag = known[0]
+    else:
+        etag, data = _fetch_logo(url, known[0] if known else None)
+        with _logo_lock:
+            _logo_etags[url] = (etag, time.monotonic())
+
+    with _logo_lock:
+        for key in ((url, etag, box), (url, etag, None)):
+            image = _logos.get(key)
+            if image is not None:
+                _logos.move_to_end(key)
+                break
+    if image is not None and key[2] == box:
+        return image
+
+    if image is None:
+        if data is None:
+            etag, data = _fetch_logo(url)
+            with _logo_lock:
+                _logo_etags[url] = (etag, time.monotonic())
+        with Image.open(BytesIO(data)) as source:
+            image = source.convert('RGBA')
+        _cache_logo((url, etag, None), image)
+
+    scaled = image.copy()
+    scaled.thumbnail(box, Image.Resampling.LANCZOS)
+    _cache_logo((url, etag, box), scaled)
+    return scaled
+
+
+def overlay_logo(image, logo_url, position):
+    """
+    Place the business logo in a corner of a finished poster.
+
+    Args:
+        image: PIL image (not modified)
+        logo_url: Logo URL (Cloudinary or MEDIA_URL path)
+        position: Name of a LOGO_POSITIONS entry
+
+    Returns:
+        PIL.Image: RGB poster with the logo
+    """
+    poster = image.convert('RGBA')
+    side = int(poster.width * settings.POSTER_LOGO_SCALE)
+    margin = int(poster.width * 0.03)
+    logo = get_scaled_logo(logo_url, (side, side))
+    anchor_x, anchor_y = LOGO_POSITIONS[position]
+    x = margin + int(anchor_x * (poster.width - 2 * margin - logo.width))
+    y = margin + int(anchor_y * (poster.height - 2 * margin - logo.height))
+    poster.alpha_composite(logo, (x, y))
+    return poster.convert('RGB')
+
+
+def _pixel_box(box, size):
+    width, height = size
+    left, top, right, bottom = box
+    return int(left * width), int(top * height), int(right * width), int(bottom * height)
+
+
+def _wrap(draw, text, font, max_width, max_lines):
+    """Greedy word wrap; returns None if the text needs more than max_lines"""
+    lines = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if not current or draw.textlength(candidate, font=font) <= max_width:
+            current = candidate
+        else:
+            lines.append(current)
+            current = word
+    lines.append(current)
+    if len(lines) > max_lines or any(draw.textlength(line, font=font) > max_width for line in lines):
+        return None
+    return lines
+
+
+def _fit_text(draw, text, width, height, bold, max_lines):
+    """Largest font size (binary search) at which the wrapped text fits the box"""
+    low, high = 8, max(height, 8)
+    best = None
+    while low <= high:
+        size = (low + high) // 2
+        font = get_font(size, bold)
+        lines = _wrap(draw, text, font, width, max_lines)
+        if lines and size * 1.15 * len(lines) <= height:
+            best = (font, lines, size)
+            low = size + 1
+        else:
+            high = size - 1
+    if best is None:
+        font = get_font(8, bold)
+        return font, [text], 8
+    return best
+
+
+def _draw_text(draw, block, text, size):
+    left, top, right, bottom = _pixel_box(block['box'], size)
+    font, lines, font_size = _fit_text(draw, text, right - left, bottom - top, block.get('bold', False),
+                                       block.get('max_lines', 1))
+    line_height = font_size * 1.15
+    y = top + ((bottom - top) - line_height * len(lines)) / 2
+    stroke = block.get('stroke')
+    # Without a real bold font, a thin stroke in the text colour thickens it
+    stroke_width = max(font_size // 18, 1) if stroke else (1 if block.get('bold') and not settings.POSTER_FONT_BOLD else 0)
+    for line in lines:
+        draw.text(
+            ((left + right) / 2, y),
+            line,
+            font=font,
+            fill=block['fill'],
+            anchor='ma',
+            stroke_width=stroke_width,
+            stroke_fill=stroke or block['fill'],
+        )
+        y += line_height
+
+
+def block_text(block, fields):
+    """The text of a layout text block, built only from the parts whose fields are all set"""
+    parts = []
+    for part in block['parts']:
+        used = [name for _literal, name, _spec, _conversion in Formatter().parse(part) if name]
+        if all(str(fields.get(name) or '').strip() for name in used):
+            parts.append(part.format(**fields).strip())
+    return block.get('sep', '  ').join(part for part in parts if part)
+
+
+def compose_poster(background, fields, layout='classic', logo_url=None):
+    """
+    Draw business details and the logo over a generated background.
+
+    Args:
+        background: PIL image (not modified)
+        fields: business_name, promotion_name, offer, phone, timing, location
+        layout: Name of a LAYOUT_TEMPLATES entry
+        logo_url: Optional logo URL, fetched through the logo cache
+
+    Returns:
+        PIL.Image: The composited RGB poster
+    """
+    poster = background.convert('RGBA')
+    overlay = Image.new('RGBA', poster.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    for block in LAYOUT_TEMPLATES[layout]:
+        if block['type'] == 'panel':
+            box = _pixel_box(block['box'], poster.size)
+            radius = int(block.get('radius', 0) * poster.width)
+            if radius:
+                draw.rounded_rectangle(box, radius=radius, fill=block['fill'])
+            else:
+                draw.rectangle(box, fill=block['fill'])
+        elif block['type'] == 'text':
+            text = block_text(block, fields)
+            if text:
+                _draw_text(draw, block, text, poster.size)
+        elif block['type'] == 'logo' and logo_url:
+            left, top, right, bottom = _pixel_box(block['box'], poster.size)
+            try:
+                scaled = get_scaled_logo(logo_url, (right - left, bottom - top))
+            except Exception as e:
+                # A broken logo must not cost the user their poster
+                print(f"WARNING: Could not load logo {logo_url}: {e}")
+                continue
+            overlay.alpha_composite(scaled, (left + (right - left - scaled.width) // 2, top + (bottom - top - scaled.height) // 2))
+
+    return Image.alpha_composite(poster, overlay).convert('RGB')
+
+
+def render_composited_poster(background, fields, layout='classic', logo_url=None):
+    """
+    Composite a poster from a background image and the business details.
+
+    Returns:
+        PIL.Image: The finished RGB poster, ready to be encoded
+    """
+    return compose_poster(background, fields, layout, logo_url)
@@ -0,0 +1,228 @@
+# core/preflight.py
+"""
+Local prompt pre-flight for image and video requests.
+
+Provider safety filters only answer after a full multi-second round trip
+that still counts against quota. The free-text fields of a request
+(promotion name, offer, edit instruction, video script...) are checked here
+first, in this order:
+1. Rewrites: everyday marketing slang that trips the filters ("killer
+   deal", "bomb offer") is replaced with a safe phrase.
+2. Block rules: terms the providers always refuse reject the request.
+3. Classifier: a small weighted-term logistic scorer. Requests scoring at
+   or above PREFLIGHT_BLOCK_THRESHOLD are rejected.
+
+Predicted blocks, rewrites and actual provider blocks are counted so the
+rate of each can be compared at /generation-stats/. Inputs the providers
+blocked are logged with their score so missed terms can be added here.
+"""
+import re
+import math
+
+from django.conf import settings
+
+from .cache_utils import increment_counter, get_counter
+
+
+# Phrases rewritten before scoring: (pattern, replacement)
+REWRITE_RULES = [
+    (r"\bkiller (deals?|offers?|prices?|looks?|discounts?)\b", r"amazing \1"),
+    (r"\b(bomb|bombshell|explosive|blast(?:ing)?) (deals?|offers?|sale|discounts?|prices?)\b", r"blockbuster \2"),
+    (r"\bto die for\b", "irresistible"),
+    (r"\bdrop[- ]dead (?:gorgeous|beautiful)\b", "stunning"),
+    (r"\bsexy\b", "glamorous"),
+    (r"\bhot (deals?|offers?|sale|prices?)\b", r"trending \1"),
+    (r"\bshoot(?:ing)? (packages?|offers?|deals?)\b", r"photoshoot \1"),
+    (r"\bslash(?:ed|ing)? prices?\b", "reduced prices"),
+    # Beauty shade names, not nudity
+    (r"\bnude (makeup|make-up|lipsticks?|shades?|tones?|nails?|looks?|manicure|pedicure)\b", r"natural \1"),
+]
+
+# Terms providers refuse regardless of context
+BLOCK_RULES = [
+    r"\bnudes\b",
+    r"\bnudity\b",
+    r"\bnaked\b",
+    r"\btopless\b",
+    r"\bporn\w*\b",
+    r"\bexplicit\b",
+    r"\bnsfw\b",
+    r"\bgore\b",
+    r"\bbeheading\b",
+    r"\bterroris[mt]\w*\b",
+    r"\bsuicide\b",
+]
+
+# Classifier features: term -> weight (log-odds of a provider block)
+RISK_WEIGHTS = {
+    'nude': 3.0,
+    'blood': 2.0,
+    'bloody': 2.0,
+    'gun': 2.5,
+    'guns': 2.5,
+    'weapon': 2.5,
+    'knife': 1.5,
+    'kill': 2.0,
+    'killing': 2.5,
+    'dead': 1.2,
+    'death': 1.5,
+    'drug': 2.0,
+    'drugs': 2.5,
+    'weed': 2.0,
+    'alcohol': 1.0,
+    'beer': 0.8,
+    'cigarette': 1.2,
+    'smoking': 1.0,
+    'lingerie': 2.5,
+    'bikini': 2.0,
+    'seductive': 2.0,
+    'body': 0.6,
+    'waxing': 0.4,
+    'skin': 0.3,
+    'child': 0.8,
+    'children': 0.8,
+    'kid': 0.6,
+    'kids': 0.6,
+    'baby': 0.6,
+    'celebrity': 1.2,
+    'politician': 1.5,
+    'election': 1.5,
+    'religion': 1.0,
+    'fight': 1.0,
+    'war': 1.5,
+    'violence': 2.5,
+}
+# Term pairs that are much riskier together than apart
+RISK_PAIRS = {
+    ('body', 'kid'): 2.5,
+    ('body', 'kids'): 2.5,
+    ('body', 'child'): 2.5,
+    ('skin', 'child'): 2.0,
+    ('bikini', 'waxing'): 1.0,
+}
+RISK_BIAS = -4.0
+
+# Free-text input of each generation job type, checked before queueing and logged on provider blocks
+JOB_TEXT_FIELDS = {
+    'poster_generation': ('promotion_name', 'offer_type'),
+    'poster_edit': ('instruction',),
+    'poster_upgrade': ('promotion_name', 'offer_type'),
+    'video_generation': ('campaign_name', 'theme', 'script'),
+    # Per CSV row: each row is checked when the upload is parsed and logged when its poster is blocked
+    'poster_bulk': ('promotion_name', 'offer_type'),
+}
+
+_rewrites = [(re.compile(pattern, re.IGNORECASE), replacement) for pattern, replacement in REWRITE_RULES]
+_block_rules = [re.compile(pattern, re.IGNORECASE) for pattern in BLOCK_RULES]
+_words = re.compile(r"[a-z]+")
+
+
+def _extra_block_rules():
+    return [re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE) for term in settings.PREFLIGHT_EXTRA_BLOCK_TERMS]
+
+
+def _keep_case(match, replacement):
+    """Expand a rewrite, capitalised like the text it replaces"""
+    new = match.expand(replacement)
+    return new[:1].upper() + new[1:] if match.group(0)[:1].isupper() else new
+
+
+def rewrite_text(text):
+    """Apply the rewrite rules; returns the (possibly) new text"""
+    for pattern, replacement in _rewrites:
+        text = pattern.sub(lambda match: _keep_case(match, replacement), text)
+    return text
+
+
+def risk_score(text):
+    """
+    Estimated probability that a provider safety filter blocks a prompt
+    built from this text.
+
+    Returns:
+        tuple: (score 0-1, matched terms)
+    """
+    words = set(_words.findall(text.lower()))
+    matched = sorted(word for word in words if word in RISK_WEIGHTS)
+    logit = RISK_BIAS + sum(RISK_WEIGHTS[word] for word in matched)
+    for (first, second), weight in RISK_PAIRS.items():
+        if first in words and second in words:
+            logit += weight
+            matched.append(f"{first}+{second}")
+    return 1 / (1 + math.exp(-logit)), matched
+
+
+def preflight_check(action, fields):
+    """
+    Check the free-text fields of a generation request before it is queued.
+
+    Args:
+        action: What is being generated, e.g. 'poster' or 'video' (for the logs)
+        fields: Field name -> user text
+
+    Returns:
+        dict: {'success': bool, 'fields': fields with rewrites applied,
+        'rewritten': names of rewritten fields, 'score': float,
+        'reasons': matched rules/terms, 'error': message when rejected}
+    """
+    if not settings.PREFLIGHT_ENABLED:
+        return {'success': True, 'fields': dict(fields), 'rewritten': [], 'score': 0.0, 'reasons': []}
+
+    increment_counter("preflight:checked")
+    cleaned, rewritten = {}, []
+    for name, value in fields.items():
+        value = value or ''
+        cleaned[name] = rewrite_text(value)
+        if cleaned[name] != value:
+            rewritten.append(name)
+    if rewritten:
+        increment_counter("preflight:rewritten")
+        print(f"DEBUG: Preflight rewrote {rewritten} of {action} request")
+
+    text = " ".join(cleaned.values())
+    reasons = [pattern.pattern for pattern in _block_rules + _extra_block_rules() if pattern.search(text)]
+    score, terms = risk_score(text)
+    if reasons:
+        score = 1.0
+    reasons += terms
+
+    result = {'success': True, 'fields': cleaned, 'rewritten': rewritten, 'score': round(score, 3), 'reasons': reasons}
+    if score >= settings.PREFLIGHT_BLOCK_THRESHOLD:
+        increment_counter("preflight:blocked")
+        print(f"DEBUG: Preflight blocked {action} request (score {score:.2f}, {reasons}): {text[:200]!r}")
+        result['success'] = False
+        result['error'] = (
+            "This request looks likely to be blocked by the AI safety filters, so it was not sent. "
+            "Please reword it and try again."
+        )
+    return result
+
+
+def record_provider_block(action, fields):
+    """
+    Count a request the provider's safety filter blocked after it passed the
+    pre-flight, and log it with its score so the rules can be extended.
+    """
+    increment_counter("preflight:actual_blocked")
+    text = " ".join(str(value) for value in fields.values() if value)
+    score, terms = risk_score(text)
+    print(f"WARNING: Provider blocked {action} request that passed preflight "
+          f"(score {score:.2f}, terms {terms}): {text[:200]!r}")
+
+
+def preflight_stats():
+    """Predicted-block and actual-block counts and rates"""
+    checked = get_counter("preflight:checked")
+    blocked = get_counter("preflight:blocked")
+    actual = get_counter("preflight:actual_blocked")
+    sent = checked - blocked
+    return {
+        'enabled': settings.PREFLIGHT_ENABLED,
+        'checked': checked,
+        'rewritten': get_counter("preflight:rewritten"),
+        'predicted_blocks': blocked,
+        'predicted_block_rate': round(blocked / checked, 4) if checked else None,
+        'actual_blocks': actual,
+        # Of the requests that were sent (cache hits included, so a lower bound)
+        'actual_block_rate': round(actual / sent, 4) if sent > 0 else None,
+    }
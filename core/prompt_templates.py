@@ -0,0 +1,339 @@
+# core/prompt_templates.py
+"""
+Versioned prompt templates.
+
+Each template is parsed once at import time and rendered by joining its
+pre-split segments. History rows store the template id, version and
+variables instead of the full prompt text, which can be rebuilt on demand.
+When you change a template's wording, register it under a new version and
+keep the old one so existing history still renders.
+"""
+import threading
+from string import Formatter
+from collections import OrderedDict
+
+
+# Rough size of a token for English/Indic prompt text; good enough to budget with
+CHARS_PER_TOKEN = 4
+TRIM_MARKER = "…"
+
+PROMPT_TEMPLATES = {}
+_latest_versions = {}
+
+_fragment_cache = OrderedDict()
+_fragment_lock = threading.Lock()
+FRAGMENT_CACHE_SIZE = 1024
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used to keep prompts inside a provider budget"""
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class RenderedPrompt:
+    """The final prompt text plus what is needed to rebuild it later"""
+
+    def __init__(self, template, text, variables, trimmed):
+        self.template_id = template.template_id
+        self.version = template.version
+        self.text = text
+        self.variables = variables
+        self.trimmed = trimmed
+        self.estimated_tokens = estimate_tokens(text)
+
+    def history_fields(self):
+        """UserHistory keyword arguments that reference this prompt"""
+        return {
+            'prompt_template': self.template_id,
+            'prompt_version': self.version,
+            'prompt_variables': self.variables,
+        }
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once into literal/field segments.
+
+    Args:
+        template_id: Stable name of the prompt, e.g. 'poster'
+        version: Bumped whenever the wording changes
+        source: str.format style template text
+        max_tokens: Estimated token budget for the rendered prompt
+        trim_fields: Variables that may be shortened, in order, to fit the budget.
+            Descriptive text goes first; text the model must draw exactly on the
+            poster (business name, address, offer) is left out so it stays intact
+    """
+
+    def __init__(self, template_id, version, source, max_tokens=None, trim_fields=()):
+        self.template_id = template_id
+        self.version = version
+        self.max_tokens = max_tokens
+        self.trim_fields = tuple(trim_fields)
+        self._segments = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            if format_spec or conversion:
+                raise ValueError(f"Prompt template {template_id} v{version}: format specs are not supported")
+            self._segments.append((literal, field))
+        self.fields = {field for _, field in self._segments if field}
+        self._occurrences = {field: sum(1 for _, name in self._segments if name == field) for field in self.fields}
+
+    def _join(self, variables):
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field:
+                parts.append(str(variables[field]))
+        return "".join(parts)
+
+    def render(self, **variables):
+        """
+        Render the template, trimming the trimmable variables if the result
+        is over the token budget.
+
+        Returns:
+            RenderedPrompt
+        """
+        missing = self.fields - variables.keys()
+        if missing:
+            raise KeyError(f"Prompt template {self.template_id} v{self.version} is missing {sorted(missing)}")
+        variables = {name: str(variables[name]) for name in self.fields}
+
+        text = self._join(variables)
+        trimmed = []
+        if self.max_tokens:
+            for field in self.trim_fields:
+                excess_chars = (estimate_tokens(text) - self.max_tokens) * CHARS_PER_TOKEN
+                if excess_chars <= 0:
+                    break
+                value = variables[field]
+                if not value:
+                    continue
+                # A variable used several times shrinks the prompt several times over
+                cut = -(-excess_chars // self._occurrences[field]) + len(TRIM_MARKER)
+                keep = max(len(value) - cut, 0)
+                variables[field] = value[:keep].rstrip() + TRIM_MARKER
+                trimmed.append(field)
+                text = self._join(variables)
+            if trimmed:
+                print(f"DEBUG: Trimmed {trimmed} in prompt {self.template_id} v{self.version} "
+                      f"to ~{estimate_tokens(text)} tokens (budget {self.max_tokens})")
+        return RenderedPrompt(self, text, variables, trimmed)
+
+    def rebuild(self, variables):
+        """Recreate stored prompt text from history variables without re-trimming"""
+        return self._join(variables)
+
+
+def register_template(template_id, version, source, max_tokens=None, trim_fields=()):
+    template = PromptTemplate(template_id, version, source, max_tokens, trim_fields)
+    PROMPT_TEMPLATES[(template_id, version)] = template
+    _latest_versions[template_id] = max(version, _latest_versions.get(template_id, 0))
+    return template
+
+
+def get_template(template_id, version=None):
+    """The given version of a template, or its latest version"""
+    if version is None:
+        version = _latest_versions[template_id]
+    return PROMPT_TEMPLATES[(template_id, version)]
+
+
+def render_prompt(template_id, **variables):
+    """Render the latest version of a template"""
+    return get_template(template_id).render(**variables)
+
+
+def rebuild_prompt(template_id, version, variables):
+    """
+    Rebuild the prompt text recorded by a history row.
+
+    Returns:
+        str: The prompt, or '' if the template version is no longer registered
+    """
+    try:
+        return get_template(template_id, version).rebuild(variables)
+    except KeyError:
+        return ""
+
+
+# -----------------
+# PROFILE FRAGMENTS
+# -----------------
+def _build_profile_fragments(profile):
+    business_type = profile.description.split('.')[0] if profile.description else "Business"
+
+    # Poster location: detailed address plus town, district, state, country
+    location_parts = [part for part in (profile.town, profile.district, profile.state, profile.country) if part]
+    location = ", ".join(location_parts) if location_parts else "Your Location"
+    if profile.address:
+        location = f"{profile.address}, {location}"
+
+    # Caption location: just town and state
+    short_parts = [part for part in (profile.town, profile.state) if part]
+
+    if profile.business_hours_start and profile.business_hours_end:
+        timing = f"{profile.business_hours_start.strftime('%I:%M %p')} - {profile.business_hours_end.strftime('%I:%M %p')}"
+    else:
+        timing = ""
+
+    return {
+        'business_type': business_type,
+        'location': location,
+        # Same as location but empty instead of a placeholder, for text drawn on posters
+        'address_line': location if (profile.address or location_parts) else "",
+        'short_location': ", ".join(short_parts),
+        'full_location': ", ".join(part or "(not set)" for part in (profile.town, profile.district, profile.state, profile.country)),
+        'timing': timing,
+    }
+
+
+def profile_fragments(profile):
+    """
+    Derived profile strings shared by the prompts (business_type, location,
+    short_location, full_location, timing). Cached per profile version, so
+    any save of the profile produces fresh fragments.
+
+    Returns:
+        dict: fragment name -> string ('' for timing when hours are not set)
+    """
+    key = (profile.pk, profile.updated_at)
+    with _fragment_lock:
+        fragments = _fragment_cache.get(key)
+        if fragments is not None:
+            _fragment_cache.move_to_end(key)
+            return fragments
+
+    fragments = _build_profile_fragments(profile)
+    if profile.pk is not None:
+        with _fragment_lock:
+            _fragment_cache[key] = fragments
+            while len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+                _fragment_cache.popitem(last=False)
+    return fragments
+
+
+# -----------------
+# TEMPLATES
+# -----------------
+register_template('poster', 1, """
+You are a creative director. Include emotional, atmospheric, and cultural details relevant to the promotion theme (e.g., festivals, seasons, etc). Keep the business details exact, but describe the visuals vividly.
+Create a professional and eye-catching marketing poster for the business "{business_name}" to boost customer engagement and promote its latest offer.
+
+BUSINESS INFO:
+- Business Name: {business_name}
+- Business Type: {business_type}
+- Location: {location}
+- Phone: {phone}
+- Timing: {timing}
+
+PROMOTION:
+- Promotion Name: {promotion_name}
+- Main Offer: {final_offer}
+- Language: {language}
+
+DESIGN GUIDELINES:
+- Format optimized for Instagram and WhatsApp sharing
+- Display the business name clearly at the top
+- **MANDATORY: Include 2-3 keywords or service names related to {business_type} (e.g., "Hair • Makeup • Spa" or "Bridal Services • Facials • Styling") prominently on the poster**
+- Highlight the promotion name and main offer with bold and attractive fonts
+- Use colors and typography that match the business theme
+- **CRITICAL: Use ONLY cartoon/animated/illustrated style visuals. DO NOT generate realistic human photographs or images.**
+- Include relevant cartoon/animated visuals or illustrations:
+  - If {business_type} is "salon" or "beauty parlour", use cartoon/animated illustrations of beauty tools, cosmetics, or stylized beauty elements (combs, scissors, lipstick, mirrors, etc.)
+  - Otherwise, use cartoon/animated icons/illustrations that match the business type (e.g., cartoon tools, tech icons, food illustrations)
+  - **Absolutely NO realistic human faces or photographs - only cartoon/animated style**
+- Keep the layout clean and easy to read on mobile
+- Add marketing elements like badges, stickers, or call-to-action text (e.g., "Call Now", "Limited Offer", "Visit Today")
+- Ensure the design remains professional, family-friendly, and suitable for public social media marketing.
+
+POSTER GOAL:
+- Should look modern, polished, and shareable
+- Designed to attract attention and drive real engagement on social media
+- Must clearly communicate what services the business provides through keywords
+- Encourage viewers to contact the business via phone for more details
+- Evoke a sense of excitement and urgency around the promotion
+- Incorporate cultural or festive elements if relevant to the promotion timing
+""", max_tokens=1500, trim_fields=('business_type', 'promotion_name'))
+
+register_template('poster_background', 1, """
+You are a creative director. Paint the BACKGROUND ARTWORK for a marketing poster. All text will be added afterwards by another tool.
+
+THEME:
+- Promotion: {promotion_name}
+- Business Type: {business_type}
+
+ARTWORK GUIDELINES:
+- Square format optimized for Instagram and WhatsApp sharing
+- **CRITICAL: Do NOT draw any text, letters, numbers, logos, signs or watermarks anywhere in the image**
+- **CRITICAL: Use ONLY cartoon/animated/illustrated style visuals. No realistic human faces or photographs.**
+- Include cartoon/animated illustrations that match {business_type} (e.g., combs, scissors, lipstick and mirrors for a salon or beauty parlour)
+- Incorporate cultural or festive elements, colours and decorations if the promotion is a festival or season
+- Keep the top and bottom bands and the centre of the image calm and uncluttered, because headline, offer and contact details will be placed there
+- Vibrant, modern, family-friendly and suitable for public social media marketing
+""", max_tokens=600, trim_fields=('business_type', 'promotion_name'))
+
+register_template('poster_edit', 1, (
+    "Edit this marketing poster for the business \"{business_name}\".\n"
+    "Keep the layout, artwork style and every business detail (name, phone, address, timing) exactly as they are, "
+    "unless the change below asks otherwise.\n"
+    "CHANGE: {instruction}\n"
+    "Return the complete edited poster as a square image."
+), max_tokens=300, trim_fields=('instruction',))
+
+register_template('caption', 1, """Task: Output only a funny and engaging social media caption for a business named {business_name}.
+Language: {language}
+Business Name: {business_name}
+Services: {description}
+Location: {location}
+Focus: {user_input}
+Instructions: Use at least 4 relevant emojis. Output only the caption text.""",
+    max_tokens=600, trim_fields=('description', 'user_input'))
+
+# v2: tone is a variable so caption grids can ask for several ("funny and engaging" renders v1's text)
+register_template('caption', 2, """Task: Output only a {tone} social media caption for a business named {business_name}.
+Language: {language}
+Business Name: {business_name}
+Services: {description}
+Location: {location}
+Focus: {user_input}
+Instructions: Use at least 4 relevant emojis. Output only the caption text.""",
+    max_tokens=600, trim_fields=('description', 'user_input'))
+
+register_template('chatbot', 1, (
+    "You are ParlorPal’s AI assistant. Here is the user’s business profile and recent activity to help you answer their questions as a helpful, friendly, and knowledgeable assistant.\n"
+    "Business Name: {business_name}\n"
+    "Description: {description}\n"
+    "Location: {full_location}\n"
+    "Detailed Address: {address}\n"
+    "Phone: {phone}\n"
+    "Business Hours: {timing}\n"
+    "Email: {email}\n"
+    "Recent Posters: {recent_posters}\n"
+    "Captions Generated: {caption_count}\n"
+    "{page_context}\n"
+    "Help the user with any questions about their business, marketing, or navigating ParlorPal.\n"
+    "If the user asks for captions, generate creative, engaging captions using their business info.\n"
+    "If the user asks about their business, use the profile info above.\n"
+    "If the user asks about navigation or what page they're on, use the CURRENT PAGE context above.\n"
+    "Always answer naturally and conversationally, as a real human assistant would.\n"
+    "{conversation}"
+), max_tokens=6000, trim_fields=('page_context', 'description', 'address'))
+
+register_template('email_subjects', 1, (
+    "Suggest 5 engaging email subject lines for a business named '{business_name}'. "
+    "Description: {description}. "
+    "Offer: {offer}. "
+    "Target audience: {audience}. "
+    "Tone: {tone}. "
+    "Make them catchy, relevant, and suitable for a marketing campaign."
+), max_tokens=800, trim_fields=('description', 'offer', 'audience'))
+
+register_template('video', 1, (
+    "Generate a marketing video using the following details.\n"
+    "Script: {script}\n"
+    "Theme: {theme}\n"
+    "Campaign Name: {campaign_name}\n"
+    "\nUse the details below as reference only (do not include verbatim):\n"
+    "Business Name: {business_name}\n"
+    "Description: {description}"
+), max_tokens=1000, trim_fields=('description', 'script'))
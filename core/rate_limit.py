@@ -0,0 +1,435 @@
+# core/rate_limit.py
+"""
+Shared per-provider rate limiting for AI calls.
+
+Every provider/model pair gets:
+- a token bucket: `rate` requests per second, refilled continuously, with
+  bursts of up to `rate` (one piece of state: tokens + last refill time), and
+- an AIMD concurrency limit: +1 slot for every `limit` successful calls,
+  halved on each quota error. Each call holds a lease on its slot that
+  expires after `slot_ttl`, so a process that dies mid-call cannot leak it.
+
+The state is always shared by all web and worker processes. With Redis
+configured (the 'limits' cache alias) every acquire/release is a single Lua
+script; without it each provider/model has a ProviderLimitState row that is
+updated under select_for_update, so concurrent callers cannot lose updates
+either way. The database cache is never used here - its incr() is not
+atomic and its culling would evict unrelated cache entries.
+"""
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+
+import google.api_core.exceptions
+from django.conf import settings
+from django.core.cache import caches
+from django.db import OperationalError, transaction
+
+from .cache_utils import increment_counter, get_counter
+from .models import ProviderLimitState
+from .timing import stage
+
+
+LIMIT_PREFIX = "parlorpal:ratelimit"
+
+# Provider/model names seen by this process
+_registered = set()
+
+
+class ProviderBusyError(google.api_core.exceptions.ResourceExhausted):
+    """
+    Raised when no slot frees up within the queue_timeout. Subclasses
+    ResourceExhausted so callers keep showing their "too many requests" message.
+    """
+
+
+def is_quota_error(error):
+    """Quota/429 errors from Vertex, google.genai and Cohere"""
+    if isinstance(error, google.api_core.exceptions.ResourceExhausted):
+        return not isinstance(error, ProviderBusyError)
+    return getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429
+
+
+def provider_limits(provider):
+    limits = dict(settings.PROVIDER_LIMITS['default'])
+    limits.update(settings.PROVIDER_LIMITS.get(provider, {}))
+    return limits
+
+
+def shared_limits():
+    """True when limiter state can be shared through an atomic (Redis) cache"""
+    config = settings.CACHES.get('limits')
+    return bool(config) and config['BACKEND'].endswith('RedisCache')
+
+
+# -----------------
+# DATABASE STATE
+# -----------------
+class DatabaseLimiterState:
+    """
+    Limiter state of one provider/model kept in a ProviderLimitState row. Every
+    update reads the row with select_for_update inside a transaction, so callers
+    in all processes see and change the same bucket and leases.
+    """
+
+    # Threads of one process take turns before locking the row; this keeps them
+    # from queueing on the row lock (and SQLite from reporting "database is locked")
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        with self._locks_lock:
+            self.lock = self._locks.setdefault(name, threading.Lock())
+
+    @contextmanager
+    def _row(self):
+        """The locked state row, created on first use; changes are saved on exit"""
+        with self.lock, transaction.atomic():
+            state = ProviderLimitState.objects.select_for_update().filter(name=self.name).first()
+            if state is None:
+                state, _created = ProviderLimitState.objects.get_or_create(name=self.name, defaults={
+                    'tokens': float(max(self.limits['rate'], 1)),
+                    'refilled': time.time(),
+                    'concurrency_limit': float(self.limits['max_concurrency']),
+                })
+                state = ProviderLimitState.objects.select_for_update().get(pk=state.pk)
+            yield state
+            state.save()
+
+    @staticmethod
+    def _unexpired(entries, now):
+        return {key: expires for key, expires in entries.items() if expires > now}
+
+    def try_acquire(self, lease):
+        try:
+            return self._try_acquire(lease)
+        except OperationalError as e:
+            # Lock timeouts (SQLite's "database is locked") count as a busy slot; acquire() polls again
+            print(f"WARNING: Could not update limiter state of {self.name}: {e}")
+            return False
+
+    def _try_acquire(self, lease):
+        with self._row() as state:
+            now = time.time()
+            state.leases = self._unexpired(state.leases, now)
+            if len(state.leases) >= int(state.concurrency_limit):
+                return False
+            burst = max(self.limits['rate'], 1)
+            state.tokens = min(burst, state.tokens + max(now - state.refilled, 0) * self.limits['rate'])
+            state.refilled = now
+            if state.tokens < 1:
+                return False
+            state.tokens -= 1
+            state.leases[lease] = now + self.limits['slot_ttl']
+            return True
+
+    def release(self, lease, quota_error):
+        for attempt in range(3):
+            try:
+                with self._row() as state:
+                    state.leases.pop(lease, None)
+                    if quota_error:
+                        state.concurrency_limit = max(self.limits['min_concurrency'], state.concurrency_limit / 2)
+                    else:
+                        state.concurrency_limit = min(self.limits['max_concurrency'], state.concurrency_limit + 1 / state.concurrency_limit)
+                return
+            except OperationalError as e:
+                error = e
+                time.sleep(random.uniform(0.05, 0.25))
+        # The slot frees itself once the lease expires (slot_ttl)
+        print(f"WARNING: Could not release {self.name} slot {lease}: {error}")
+
+    # The waiting list only feeds queue_depth in the stats, so failing to update it is not an error
+    def add_waiter(self, lease):
+        # Keyed by when the wait gives up, so a dead waiter stops counting by itself
+        try:
+            with self._row() as state:
+                state.waiting = self._unexpired(state.waiting, time.time())
+                state.waiting[lease] = time.time() + self.limits['queue_timeout']
+        except OperationalError as e:
+            print(f"WARNING: Could not update limiter state of {self.name}: {e}")
+
+    def remove_waiter(self, lease):
+        try:
+            with self._row() as state:
+                state.waiting.pop(lease, None)
+        except OperationalError as e:
+            print(f"WARNING: Could not update limiter state of {self.name}: {e}")
+
+    def load(self):
+        state = ProviderLimitState.objects.filter(name=self.name).first()
+        if state is None:
+            return 0, float(self.limits['max_concurrency']), 0
+        now = time.time()
+        return len(self._unexpired(state.leases, now)), state.concurrency_limit, len(self._unexpired(state.waiting, now))
+
+
+# -----------------
+# SHARED (REDIS) STATE
+# -----------------
+# KEYS: bucket, leases, limit - ARGV: rate, max_concurrency, lease, slot_ttl
+ACQUIRE_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = math.max(rate, 1)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local limit = tonumber(redis.call('GET', KEYS[3])) or tonumber(ARGV[2])
+if redis.call('ZCARD', KEYS[2]) >= math.floor(limit) then
+    return 0
+end
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'refilled')
+local tokens = tonumber(bucket[1]) or burst
+local refilled = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - refilled) * rate)
+local granted = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    granted = 1
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'refilled', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+return granted
+"""
+
+# KEYS: leases, limit - ARGV: lease, quota_error, min_concurrency, max_concurrency
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local limit = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[4])
+if ARGV[2] == '1' then
+    limit = math.max(tonumber(ARGV[3]), limit / 2)
+else
+    limit = math.min(tonumber(ARGV[4]), limit + 1 / limit)
+end
+redis.call('SET', KEYS[2], tostring(limit))
+return tostring(limit)
+"""
+
+
+class RedisLimiterState:
+    """Limiter state of one provider/model shared through the 'limits' Redis cache"""
+
+    _scripts = {}
+
+    def __init__(self, name, limits):
+        self.limits = limits
+        limits_cache = caches['limits']
+        self.client = limits_cache._cache.get_client(write=True)
+        self.bucket_key = limits_cache.make_key(f"{LIMIT_PREFIX}:{name}:bucket")
+        self.leases_key = limits_cache.make_key(f"{LIMIT_PREFIX}:{name}:leases")
+        self.limit_key = limits_cache.make_key(f"{LIMIT_PREFIX}:{name}:limit")
+        self.waiting_key = limits_cache.make_key(f"{LIMIT_PREFIX}:{name}:waiting")
+
+    def _script(self, source):
+        if source not in self._scripts:
+            self._scripts[source] = self.client.register_script(source)
+        return self._scripts[source]
+
+    def try_acquire(self, lease):
+        return bool(self._script(ACQUIRE_SCRIPT)(
+            keys=[self.bucket_key, self.leases_key, self.limit_key],
+            args=[self.limits['rate'], self.limits['max_concurrency'], lease, self.limits['slot_ttl']],
+            client=self.client,
+        ))
+
+    def release(self, lease, quota_error):
+        self._script(RELEASE_SCRIPT)(
+            keys=[self.leases_key, self.limit_key],
+            args=[lease, '1' if quota_error else '0', self.limits['min_concurrency'], self.limits['max_concurrency']],
+            client=self.client,
+        )
+
+    def add_waiter(self, lease):
+        # Scored by when the wait gives up, so a dead waiter stops counting by itself
+        self.client.zadd(self.waiting_key, {lease: time.time() + self.limits['queue_timeout']})
+        self.client.expire(self.waiting_key, int(self.limits['queue_timeout']) + 60)
+
+    def remove_waiter(self, lease):
+        self.client.zrem(self.waiting_key, lease)
+
+    def load(self):
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zcount(self.leases_key, now, '+inf')
+        pipe.get(self.limit_key)
+        pipe.zcount(self.waiting_key, now, '+inf')
+        in_flight, limit, waiting = pipe.execute()
+        return in_flight, float(limit) if limit is not None else float(self.limits['max_concurrency']), waiting
+
+
+# -----------------
+# LIMITER
+# -----------------
+class ProviderLimiter:
+    """Token bucket plus AIMD concurrency limit for one provider/model"""
+
+    def __init__(self, provider, model=None):
+        self.provider = provider
+        self.model = model or 'default'
+        self.limits = provider_limits(provider)
+        self.name = f"{provider}:{self.model}"
+        if shared_limits():
+            self.state = RedisLimiterState(self.name, self.limits)
+        else:
+            self.state = DatabaseLimiterState(self.name, self.limits)
+
+    def load(self):
+        """(in_flight, concurrency_limit, queue_depth) in one round trip"""
+        return self.state.load()
+
+    def concurrency_limit(self):
+        return self.load()[1]
+
+    def in_flight(self):
+        return self.load()[0]
+
+    def _register(self):
+        """Remember this provider/model so limiter_stats() can report it"""
+        if self.name in _registered:
+            return
+        if isinstance(self.state, RedisLimiterState):
+            self.state.client.sadd(caches['limits'].make_key(f"{LIMIT_PREFIX}:names"), self.name)
+        _registered.add(self.name)
+
+    # --- slots ---
+    def acquire(self):
+        """
+        Wait (jittered polling) for a free concurrency slot and a token.
+
+        Returns:
+            str: The slot lease, to be passed to release()
+
+        Raises:
+            ProviderBusyError: if none frees up within the queue timeout
+        """
+        self._register()
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + self.limits['queue_timeout']
+        queued = False
+        try:
+            while True:
+                if self.state.try_acquire(lease):
+                    return lease
+                if not queued:
+                    queued = True
+                    self.state.add_waiter(lease)
+                if time.monotonic() >= deadline:
+                    increment_counter(f"ratelimit:{self.name}:rejected")
+                    raise ProviderBusyError(f"{self.name} is at its rate limit")
+                time.sleep(random.uniform(0.05, 0.25))
+        finally:
+            if queued:
+                self.state.remove_waiter(lease)
+
+    def release(self, lease, quota_error=False):
+        self.state.release(lease, quota_error)
+
+    def stats(self):
+        in_flight, limit, waiting = self.load()
+        return {
+            'concurrency_limit': round(limit, 2),
+            'in_flight': in_flight,
+            'queue_depth': waiting,
+            'rejected': get_counter(f"ratelimit:{self.name}:rejected"),
+            'quota_errors': get_counter(f"ratelimit:{self.name}:quota_errors"),
+            'retries': get_counter(f"ratelimit:{self.name}:retries"),
+        }
+
+
+def limited_call(provider, model, func, /, *args, **kwargs):
+    """
+    Call a provider SDK function inside the provider's limits, retrying quota
+    errors with jittered exponential backoff.
+
+    Returns:
+        Whatever func returns
+
+    Raises:
+        The last quota error once retries are exhausted, ProviderBusyError when
+        no slot frees up, and any other error from func unchanged
+    """
+    limiter = ProviderLimiter(provider, model)
+    attempt = 0
+    while True:
+        with stage('rate_limit_wait'):
+            lease = limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            quota_error = is_quota_error(e)
+            limiter.release(lease, quota_error=quota_error)
+            if not quota_error:
+                raise
+            increment_counter(f"ratelimit:{limiter.name}:quota_errors")
+            if attempt >= limiter.limits['max_retries']:
+                raise
+            attempt += 1
+            increment_counter(f"ratelimit:{limiter.name}:retries")
+            # Full jitter keeps retries from several workers from lining up
+            delay = random.uniform(0, limiter.limits['retry_base_delay'] * 2 ** attempt)
+            print(f"DEBUG: Quota error from {limiter.name}, retry {attempt} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        limiter.release(lease)
+        return result
+
+
+def limited_stream(provider, model, func, /, *args, **kwargs):
+    """
+    limited_call for streaming APIs: the slot is held until the stream is
+    exhausted or closed. Quota errors before the first event are retried
+    like limited_call; once events have been yielded they cannot be replayed,
+    so later errors are raised.
+
+    Yields:
+        The events of the stream func returns
+    """
+    limiter = ProviderLimiter(provider, model)
+    attempt = 0
+    while True:
+        with stage('rate_limit_wait'):
+            lease = limiter.acquire()
+        started = False
+        quota_error = False
+        try:
+            for event in func(*args, **kwargs):
+                started = True
+                yield event
+            return
+        except Exception as e:
+            quota_error = is_quota_error(e)
+            if not quota_error or started:
+                raise
+            increment_counter(f"ratelimit:{limiter.name}:quota_errors")
+            if attempt >= limiter.limits['max_retries']:
+                raise
+        finally:
+            limiter.release(lease, quota_error=quota_error)
+        attempt += 1
+        increment_counter(f"ratelimit:{limiter.name}:retries")
+        delay = random.uniform(0, limiter.limits['retry_base_delay'] * 2 ** attempt)
+        print(f"DEBUG: Quota error from {limiter.name} stream, retry {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def limiter_stats():
+    """
+    Current limiter state for every provider/model that has been called by any process
+    """
+    if shared_limits():
+        names = caches['limits']._cache.get_client().smembers(caches['limits'].make_key(f"{LIMIT_PREFIX}:names"))
+        names = sorted(name.decode() if isinstance(name, bytes) else name for name in names)
+    else:
+        names = list(ProviderLimitState.objects.order_by('name').values_list('name', flat=True))
+    stats = {}
+    for name in names:
+        provider, model = name.split(':', 1)
+        stats[name] = ProviderLimiter(provider, model).stats()
+    return stats
@@ -0,0 +1,104 @@
+# core/renditions.py
+"""
+Poster renditions (social media sizes and thumbnails).
+
+The rendering functions only depend on Pillow so they can run in a
+separate process: the pool uses the 'spawn' start method, which is safe
+inside threaded gunicorn workers and only has to import this module.
+"""
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageFilter, ImageOps
+
+
+# name: (width, height, mode)
+#   cover   - scale to fill and centre-crop
+#   contain - scale to fit inside, keeping the whole poster
+#   pad     - fit inside a blurred, enlarged copy of the poster (for tall story frames)
+POSTER_RENDITIONS = {
+    'instagram': (1080, 1080, 'cover'),
+    'instagram_portrait': (1080, 1350, 'pad'),
+    'whatsapp': (800, 800, 'contain'),
+    'story': (1080, 1920, 'pad'),
+    'thumbnail': (320, 320, 'cover'),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def render_rendition(image_bytes, width, height, mode, output_format='WEBP', quality=85):
+    """
+    Produce one resized rendition of a poster.
+
+    Returns:
+        bytes: The encoded rendition
+    """
+    with Image.open(BytesIO(image_bytes)) as source:
+        image = source.convert('RGB')
+
+    if mode == 'cover':
+        result = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+    elif mode == 'contain':
+        result = ImageOps.contain(image, (width, height), Image.Resampling.LANCZOS)
+    else:
+        background = ImageOps.fit(image, (width // 4, height // 4), Image.Resampling.BILINEAR)
+        background = background.filter(ImageFilter.GaussianBlur(8)).resize((width, height), Image.Resampling.BILINEAR)
+        foreground = ImageOps.contain(image, (width, height), Image.Resampling.LANCZOS)
+        background.paste(foreground, ((width - foreground.width) // 2, (height - foreground.height) // 2))
+        result = background
+
+    output = BytesIO()
+    if output_format == 'JPEG':
+        result.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    elif output_format == 'PNG':
+        result.save(output, format='PNG', optimize=True)
+    else:
+        result.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+def get_rendition_pool(max_workers):
+    """Lazily start the process pool shared by every generation in this process"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _pool
+
+
+def render_poster_renditions(image_bytes, names, max_workers=2, output_format='WEBP', quality=85):
+    """
+    Render the named renditions of a poster in the process pool.
+
+    Returns:
+        dict: rendition name -> encoded bytes (failed renditions are left out)
+    """
+    global _pool
+    pool = get_rendition_pool(max_workers)
+    futures = {}
+    for name in names:
+        width, height, mode = POSTER_RENDITIONS[name]
+        futures[name] = pool.submit(render_rendition, image_bytes, width, height, mode, output_format, quality)
+
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except BrokenProcessPool as e:
+            # A child died (e.g. OOM); start a fresh pool for the next poster
+            print(f"WARNING: Rendition pool broken while rendering {name}: {e}")
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+        except Exception as e:
+            print(f"WARNING: Could not render {name} rendition: {e}")
+    return results
@@ -1,3 +1,1650 @@
-from django.test import TestCase
+import os
+import shutil
+import contextvars
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from datetime import time as clock_time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from . import cache_utils, generation_utils, poster_layout, views
+from .ai_clients import client_status, evict_client, get_client, get_imagen_model
+from .models import ChatMessage, CustomUser, Festival, GenerationJob, GenerationTiming, PosterGeneration, ProviderLimitState, StatCounter, UserHistory
+from .cache_utils import (
+    poster_cache_key, text_cache_key, get_chat_context, set_chat_context, get_counter,
+    cache_stats, flush_counters, record_cache_event, record_latency, LATENCY_WINDOW,
+    get_cached_text, set_cached_text, text_cache_stats,
+)
+from .chat_store import _trim, append_turns, get_history
+from .generation_utils import (
+    JOB_QUEUES, build_poster_prompt, claim_generation_job, claim_next_generation_job, enqueue_generation_job,
+    heartbeat_generation_jobs, parse_bulk_poster_csv, process_generation_job, requeue_stale_generation_jobs,
+    serve_cached_poster, encode_poster_output, store_poster, store_poster_renditions,
+    generate_poster_image_hedged, hedge_delay, job_stage_reporter,
+)
+from .model_router import AUTO_MODEL, choose_poster_model, model_pressure, router_stats
+from .poster_layout import (
+    LAYOUT_TEMPLATES, block_text, fetch_image_bytes, get_scaled_logo, load_remote_image, overlay_logo,
+    render_composited_poster,
+)
+from .preflight import preflight_check
+from .prompt_templates import get_template, render_prompt
+from .renditions import POSTER_RENDITIONS, render_poster_renditions, render_rendition
+from .rate_limit import DatabaseLimiterState, ProviderLimiter, limited_call, limiter_stats
+from .timing import StageTimer, current_timer
+
+
+# Emulated providers that answer in a few milliseconds
+FAST_EMULATOR = {
+    service: {'latency_p50': 0.005, 'latency_p95': 0.01, 'payload': 64}
+    for service in ('cohere', 'gemini_text', 'gemini_image', 'imagen', 'cloudinary', 'smtp')
+}
+FAST_LIMITS = {
+    'default': {'rate': 1000, 'max_concurrency': 8, 'min_concurrency': 1, 'queue_timeout': 5,
+                'max_retries': 0, 'retry_base_delay': 0.0, 'slot_ttl': 300},
+}
+
+# The counter flusher thread would write mid-test, and SQLite's shared in-memory test
+# database fails with "table is locked" instead of waiting; tests call flush_counters()
+override_settings(COUNTER_FLUSH_INTERVAL=24 * 60 * 60).enable()
+
+
+def make_user(username='parlour'):
+    """A user with a filled-in business profile (the profile itself comes from the post_save signal)"""
+    user = CustomUser.objects.create_user(username=username, email=f"{username}@example.com", password='pass')
+    profile = user.businessprofile
+    profile.business_name = "Glow Beauty Parlour"
+    profile.description = "Beauty parlour. Bridal makeup, facials and hair styling."
+    profile.town = "Mysuru"
+    profile.district = "Mysuru"
+    profile.state = "Karnataka"
+    profile.country = "India"
+    profile.address = "12 Temple Road"
+    profile.phone = "9876543210"
+    profile.business_hours_start = clock_time(9, 30)
+    profile.business_hours_end = clock_time(20, 0)
+    profile.save()
+    return user
+
+
+class EmulatorTestMixin:
+    """Runs a test against the offline provider emulator with a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        # The cache table is not flushed between TransactionTestCases; start without stored posters
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        emulator = override_settings(
+            AI_EMULATOR=True,
+            AI_EMULATOR_CONFIG=FAST_EMULATOR,
+            GOOGLE_API_KEY='emulator',
+            PROVIDER_LIMITS=FAST_LIMITS,
+            MEDIA_ROOT=media_root,
+            GENERATION_JOBS_INLINE=False,
+            POSTER_HEDGING=False,
+        )
+        emulator.enable()
+        self.addCleanup(emulator.disable)
+        # Vertex AI is set up at import time, so give the module the emulated model it would have built
+        imagen = mock.patch.object(generation_utils, 'imagen_model_preview', get_imagen_model(generation_utils.DEFAULT_IMAGEN_MODEL))
+        imagen.start()
+        self.addCleanup(imagen.stop)
+
+
+# -----------------
+# JOB QUEUE
+# -----------------
+class GenerationJobQueueTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def queued_job(self):
+        return GenerationJob.objects.create(
+            user=self.user,
+            job_type='poster_generation',
+            input_data={'promotion_name': 'Diwali Glow', 'offer_type': '20% off'}
+        )
+
+    def test_only_one_worker_claims_a_job(self):
+        job = self.queued_job()
+        first = GenerationJob.objects.get(pk=job.pk)
+        second = GenerationJob.objects.get(pk=job.pk)
+
+        self.assertTrue(claim_generation_job(first))
+        self.assertFalse(claim_generation_job(second))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(second.status, 'queued')
+
+    def test_cancelled_jobs_are_finished(self):
+        job = self.queued_job()
+        self.assertFalse(job.is_finished)
+        for status in ('done', 'failed', 'cancelled'):
+            job.status = status
+            self.assertTrue(job.is_finished, status)
+
+    def test_video_jobs_have_their_own_queue(self):
+        video = GenerationJob.objects.create(user=self.user, job_type='video_generation', input_data={})
+        poster = self.queued_job()
+
+        self.assertEqual(claim_next_generation_job(JOB_QUEUES['images']).pk, poster.pk)
+        self.assertIsNone(claim_next_generation_job(JOB_QUEUES['images']))
+        self.assertEqual(claim_next_generation_job(JOB_QUEUES['video']).pk, video.pk)
+
+    def test_stale_jobs_are_requeued_until_out_of_attempts(self):
+        long_ago = timezone.now() - timedelta(minutes=30)
+        retry = self.queued_job()
+        exhausted = self.queued_job()
+        fresh = self.queued_job()
+        GenerationJob.objects.filter(pk=retry.pk).update(status='running', stage='generating', started_at=long_ago, heartbeat_at=long_ago, attempts=1)
+        GenerationJob.objects.filter(pk=exhausted.pk).update(status='running', started_at=long_ago, heartbeat_at=long_ago, attempts=2)
+        # Running for half an hour, but its worker is still sending heartbeats
+        GenerationJob.objects.filter(pk=fresh.pk).update(status='running', started_at=long_ago, heartbeat_at=timezone.now(), attempts=1)
+
+        requeued = requeue_stale_generation_jobs(timedelta(minutes=15), max_attempts=2)
+
+        self.assertEqual(requeued, 1)
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((retry.status, retry.stage), ('queued', 'queued'))
+        self.assertEqual(exhausted.status, 'failed')
+        self.assertTrue(exhausted.error)
+        self.assertEqual(fresh.status, 'running')
+
+    def test_heartbeats_keep_long_jobs_running(self):
+        job = self.queued_job()
+        self.assertTrue(claim_generation_job(job))
+        GenerationJob.objects.filter(pk=job.pk).update(
+            started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now() - timedelta(minutes=4)
+        )
+        self.assertEqual(heartbeat_generation_jobs([job.pk]), 1)
+
+        self.assertEqual(requeue_stale_generation_jobs(timedelta(minutes=5), max_attempts=2), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+    def test_requeued_job_can_be_claimed_again(self):
+        job = self.queued_job()
+        self.assertTrue(claim_generation_job(job))
+        GenerationJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        requeue_stale_generation_jobs(timedelta(minutes=15), max_attempts=3)
+
+        job.refresh_from_db()
+        self.assertTrue(claim_generation_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+
+
+class EmulatedGenerationJobTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def run_job(self, job_type, input_data):
+        job = enqueue_generation_job(self.user, job_type, input_data)
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        job.refresh_from_db()
+        return job
+
+    def test_poster_job_records_the_poster(self):
+        job = self.run_job('poster_generation', {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English'})
+
+        self.assertEqual(job.status, 'done', job.error)
+        self.assertEqual(job.stage, 'done')
+        poster = PosterGeneration.objects.get(user=self.user)
+        self.assertEqual(poster.poster_url, job.result_url)
+        self.assertTrue(UserHistory.objects.filter(user=self.user, poster=poster).exists())
+
+    def test_quota_errors_are_not_counted_as_safety_blocks(self):
+        config = {**FAST_EMULATOR, 'imagen': {**FAST_EMULATOR['imagen'], 'quota_error_rate': 1}}
+        blocked_before = get_counter("preflight:actual_blocked")
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            job = self.run_job('poster_generation', {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English'})
+
+        self.assertEqual(job.status, 'failed')
+        self.assertIn("Too many requests", job.error)
+        self.assertEqual(get_counter("preflight:actual_blocked"), blocked_before)
+
+    def test_bulk_job_saves_rows_in_chunks_and_resumes(self):
+        rows = [
+            {'promotion_name': f"Promo {number}", 'offer_type': f"{number}0% off", 'language': 'English',
+             'model': 'imagen-4.0-generate-preview-06-06'}
+            for number in range(1, 6)
+        ]
+        with override_settings(BULK_POSTER_SAVE_CHUNK=2, BULK_POSTER_MAX_WORKERS=2):
+            job = self.run_job('poster_bulk', {'rows': rows})
+
+        self.assertEqual(job.status, 'done', job.error)
+        self.assertEqual((job.progress['completed'], job.progress['created']), (5, 5))
+        self.assertEqual(PosterGeneration.objects.filter(user=self.user).count(), 5)
+
+        # A requeued job only generates the rows its saved progress does not cover
+        job.progress = {'results': job.progress['results'][:3]}
+        job.status = 'queued'
+        job.save()
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.progress['completed'], 5)
+        self.assertEqual(PosterGeneration.objects.filter(user=self.user).count(), 7)
+
+    def test_choosing_a_variant_is_queued_and_applied_by_the_worker(self):
+        job = self.run_job('poster_generation', {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English', 'variants': 3})
+        self.assertEqual(job.status, 'done', job.error)
+        poster = PosterGeneration.objects.get(user=self.user)
+        names = [name for name, _url in poster.variants]
+        self.assertEqual(len(names), 3)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('choose_poster_variant', args=[poster.pk]), {'variant': names[2]}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = response.json()
+        self.assertTrue(data['success'])
+        choice = GenerationJob.objects.get(pk=data['job_id'])
+        self.assertEqual((choice.job_type, choice.status), ('poster_variant', 'queued'))
+        self.assertEqual(data['status_url'], reverse('generation_job_status', args=[choice.pk]))
+        # Nothing changed during the request
+        poster.refresh_from_db()
+        self.assertNotEqual(poster.poster_url, dict(poster.variants)[names[2]])
+
+        self.assertTrue(claim_generation_job(choice))
+        process_generation_job(choice)
+        self.assertEqual(choice.status, 'done', choice.error)
+        poster.refresh_from_db()
+        self.assertEqual(poster.poster_url, dict(poster.variants)[names[2]])
+        self.assertEqual(choice.result_url, poster.poster_url)
+        self.assertEqual(len(poster.variants), 3)
+
+        response = self.client.post(reverse('choose_poster_variant', args=[poster.pk]), {'variant': 'variant_9'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(GenerationJob.objects.filter(job_type='poster_variant').count(), 1)
+
+    @override_settings(PREFLIGHT_ENABLED=True)
+    def test_bulk_rows_go_through_preflight_and_block_counters(self):
+        upload = SimpleUploadedFile('promotions.csv', (
+            "promotion_name,offer_type\n"
+            "Killer deals,20% off\n"
+            "Send nudes,10% off\n"
+        ).encode())
+        checked_before = get_counter("preflight:checked")
+        rows, errors = parse_bulk_poster_csv(upload, max_rows=10)
+        self.assertEqual(get_counter("preflight:checked"), checked_before + 2)
+        self.assertEqual([row['promotion_name'] for row in rows], ["Amazing deals"])
+        self.assertEqual(len(errors), 1)
+
+        config = {**FAST_EMULATOR, 'imagen': {**FAST_EMULATOR['imagen'], 'block_rate': 1}}
+        blocked_before = get_counter("preflight:actual_blocked")
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            job = self.run_job('poster_bulk', {'rows': rows})
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(get_counter("preflight:actual_blocked"), blocked_before + 1)
+
+
+# -----------------
+# GENERATION TIMING
+# -----------------
+class StageTimerTests(SimpleTestCase):
+
+    def test_threads_sharing_a_timer_lose_no_time(self):
+        timer = StageTimer('poster_generation')
+
+        def render():
+            for _ in range(2000):
+                timer.add('renditions', 1)
+
+        threads = [threading.Thread(target=render) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(timer.stages['renditions'], 16000)
+
+    def test_errors_leaving_the_timer_mark_it_failed(self):
+        timer = StageTimer('poster_generation')
+        with self.assertRaises(ValueError):
+            with timer:
+                self.assertIs(current_timer(), timer)
+                raise ValueError("provider went away")
+        self.assertIsNone(current_timer())
+        self.assertEqual((timer.outcome, timer.error), ('failed', "provider went away"))
+
+    def test_start_and_stop_restore_the_outer_timer(self):
+        outer, inner = StageTimer('poster_generation'), StageTimer('text_generation')
+        with outer:
+            inner.start()
+            self.assertIs(current_timer(), inner)
+            inner.stop()
+            inner.stop()
+            self.assertIs(current_timer(), outer)
+
+
+class FailedGenerationTimingTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def run_job(self, job_type, input_data):
+        job = enqueue_generation_job(self.user, job_type, input_data)
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        return job
+
+    def test_failed_and_cancelled_jobs_save_their_timing(self):
+        config = {**FAST_EMULATOR, 'imagen': {**FAST_EMULATOR['imagen'], 'error_rate': 1}}
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            job = self.run_job('poster_generation', {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English'})
+        self.assertEqual(job.status, 'failed')
+        failed = GenerationTiming.objects.get(action_type='poster_generation')
+        self.assertEqual(failed.outcome, 'failed')
+        self.assertTrue(failed.error)
+        self.assertIn('generate', failed.stages)
+
+        draft = PosterGeneration.objects.create(
+            user=self.user, promotion_name="Diwali Glow", offer_type="20% off", poster_url="/media/draft.png", upgrade_status='cancelled'
+        )
+        job = self.run_job('poster_upgrade', {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English', 'poster_id': draft.pk})
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(GenerationTiming.objects.get(action_type='poster_upgrade').outcome, 'cancelled')
+
+        self.run_job('poster_generation', {'promotion_name': 'Holi Colours', 'offer_type': '10% off', 'language': 'English'})
+        report = StringIO()
+        call_command('generation_timing_report', stdout=report)
+        self.assertIn("1 failed, 1 ok", report.getvalue())
+        self.assertIn("1 cancelled", report.getvalue())
+        self.assertIn("no ok generations", report.getvalue())
+
+        report = StringIO()
+        call_command('generation_timing_report', '--outcome', 'failed', stdout=report)
+        self.assertIn("generate", report.getvalue())
+
+
+# -----------------
+# CAPTION STREAMING
+# -----------------
+class CaptionStreamTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def stream(self):
+        response = self.client.post(reverse('ai_suggestions'), {
+            'user_input': 'Diwali facial offer', 'language': 'english', 'length': 'small', 'stream': '1', 'new_variation': '1',
+        })
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response
+
+    def test_chunks_produced_in_different_contexts(self):
+        # ASGI servers may produce every chunk of a streaming response in a fresh context
+        chunks = iter(self.stream().streaming_content)
+        body = []
+        while True:
+            chunk = contextvars.copy_context().run(next, chunks, None)
+            if chunk is None:
+                break
+            body.append(chunk.decode())
+        body = "".join(body)
+
+        self.assertIn("event: token", body)
+        self.assertIn("event: done", body)
+        timing = GenerationTiming.objects.get(user=self.user)
+        self.assertEqual(timing.outcome, 'ok')
+        self.assertIn('first_token', timing.stages)
+        self.assertIn('rate_limit_wait', timing.stages)
+        self.assertIsNotNone(timing.history)
+
+    def test_abandoned_stream_frees_its_slot(self):
+        response = self.stream()
+        self.assertIn("event: token", next(iter(response.streaming_content)).decode())
+        # What the server does when the browser goes away
+        response.close()
+
+        timing = GenerationTiming.objects.get(user=self.user)
+        self.assertEqual(timing.outcome, 'cancelled')
+        self.assertIsNone(timing.history)
+        self.assertEqual(ProviderLimiter('cohere', settings.CAPTION_STREAM_MODEL).in_flight(), 0)
+
+
+class CaptionGridTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def grid(self, **extra):
+        response = self.client.post(reverse('ai_suggestions'), {
+            'user_input': 'Diwali facial offer', 'language': 'English', 'length': 'small', 'grid': '1',
+            'grid_languages': ['English', 'Hindi', 'Klingon'], 'variants': '2', **extra,
+        })
+        return response.json()
+
+    def test_grid_has_a_caption_per_language_and_tone(self):
+        data = self.grid()
+        self.assertEqual(data['languages'], ['English', 'Hindi'])
+        self.assertEqual(data['tones'], views.CAPTION_TONES[:2])
+        self.assertEqual([(cell['language'], cell['tone']) for cell in data['grid']], [
+            (language, tone) for language in ['English', 'Hindi'] for tone in views.CAPTION_TONES[:2]
+        ])
+        self.assertTrue(all(cell['text'] for cell in data['grid']))
+
+        history = UserHistory.objects.filter(user=self.user, action_type='text_generation')
+        self.assertEqual(history.count(), 4)
+        self.assertTrue(all(row.input_data['grid_size'] == 4 for row in history))
+        # One timing row for the whole grid
+        self.assertEqual(GenerationTiming.objects.get(user=self.user).history, history.order_by('pk').first())
+
+    def test_cached_cells_are_not_generated_again(self):
+        # Stubbed so the limiter's writes from pool threads cannot make the database cache drop a set
+        with mock.patch.object(views, '_caption_cell_task', side_effect=lambda client, prompt, max_tokens: prompt.text[-40:]):
+            first = self.grid()
+        with mock.patch.object(views, '_caption_cell_task', side_effect=AssertionError("not cached")):
+            self.assertEqual(self.grid()['grid'], first['grid'])
+        with mock.patch.object(views, '_caption_cell_task', return_value="Fresh caption") as task:
+            data = self.grid(new_variation='on')
+        self.assertEqual(task.call_count, 4)
+        self.assertEqual({cell['text'] for cell in data['grid']}, {"Fresh caption"})
+
+    def test_failed_cells_do_not_fail_the_grid(self):
+        def flaky(client, prompt, max_tokens):
+            if "Hindi" in prompt.text:
+                raise RuntimeError("Too many requests")
+            return "Glow this Diwali"
+
+        with mock.patch.object(views, '_caption_cell_task', side_effect=flaky):
+            data = self.grid()
+        self.assertTrue(data['success'])
+        errors = [cell for cell in data['grid'] if 'error' in cell]
+        self.assertEqual([cell['language'] for cell in errors], ['Hindi', 'Hindi'])
+        self.assertIn("Too many requests", errors[0]['error'])
+        self.assertEqual(UserHistory.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(GenerationTiming.objects.get(user=self.user).outcome, 'ok')
+
+        with mock.patch.object(views, '_caption_cell_task', side_effect=RuntimeError("Too many requests")):
+            data = self.grid(new_variation='on')
+        self.assertTrue(all('error' in cell for cell in data['grid']))
+        self.assertEqual(GenerationTiming.objects.filter(user=self.user, outcome='failed').count(), 1)
+
+
+# -----------------
+# POSTER OUTPUT
+# -----------------
+def image_bytes(image_format='PNG', size=(64, 48), mode='RGB'):
+    output = BytesIO()
+    Image.new(mode, size, (200, 40, 90) if mode == 'RGB' else (200, 40, 90, 128)).save(output, format=image_format)
+    return output.getvalue()
+
+
+def image_format(data):
+    with Image.open(BytesIO(data)) as image:
+        return image.format, image.size
+
+
+class PosterEncodingTests(SimpleTestCase):
+
+    @override_settings(POSTER_PASSTHROUGH_FORMATS=['png', 'jpeg'])
+    def test_provider_bytes_in_a_passthrough_format_are_stored_as_is(self):
+        for source_format, extension in (('PNG', 'png'), ('JPEG', 'jpg')):
+            source = image_bytes(source_format)
+            self.assertEqual(encode_poster_output(source), (source, extension))
+
+    @override_settings(POSTER_PASSTHROUGH_FORMATS=[], POSTER_OUTPUT_FORMAT='webp')
+    def test_other_formats_are_encoded_once_to_the_output_format(self):
+        output, extension = encode_poster_output(image_bytes('PNG'))
+        self.assertEqual(extension, 'webp')
+        self.assertEqual(image_format(output), ('WEBP', (64, 48)))
+
+    @override_settings(POSTER_PASSTHROUGH_FORMATS=[], POSTER_OUTPUT_FORMAT='jpeg', POSTER_OUTPUT_QUALITY=60)
+    def test_jpeg_output_drops_the_alpha_channel(self):
+        output, extension = encode_poster_output(image_bytes('PNG', mode='RGBA'))
+        self.assertEqual(extension, 'jpg')
+        self.assertEqual(image_format(output), ('JPEG', (64, 48)))
+
+
+@override_settings(POSTER_PASSTHROUGH_FORMATS=['png'], POSTER_OUTPUT_FORMAT='webp')
+class PosterStorageTests(EmulatorTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def local_files(self):
+        return sorted(name for name in os.listdir(settings.MEDIA_ROOT) if name != 'emulator')
+
+    def test_uploaded_posters_are_not_written_to_disk(self):
+        source = image_bytes('PNG')
+        poster_url, uploaded = store_poster(self.user, source)
+        self.assertTrue(uploaded)
+        self.assertEqual(self.local_files(), [])
+        # The stored bytes are the provider's, not a re-encode
+        self.assertEqual(fetch_image_bytes(poster_url), source)
+
+    def test_failed_uploads_fall_back_to_one_local_file(self):
+        config = {**FAST_EMULATOR, 'cloudinary': {**FAST_EMULATOR['cloudinary'], 'error_rate': 1}}
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            poster_url, uploaded = store_poster(self.user, image_bytes('BMP'))
+        self.assertFalse(uploaded)
+        self.assertEqual(len(self.local_files()), 1)
+        self.assertTrue(poster_url.endswith('.webp'))
+        self.assertEqual(image_format(fetch_image_bytes(poster_url))[0], 'WEBP')
+
+
+# -----------------
+# POSTER RENDITIONS
+# -----------------
+class RenditionTests(SimpleTestCase):
+
+    def test_each_mode_produces_its_frame(self):
+        poster = image_bytes('PNG', size=(400, 300))
+        cover = render_rendition(poster, 100, 100, 'cover')
+        self.assertEqual(image_format(cover), ('WEBP', (100, 100)))
+        # contain keeps the whole poster, so the frame is only a bound
+        contain = render_rendition(poster, 100, 100, 'contain', output_format='JPEG')
+        self.assertEqual(image_format(contain), ('JPEG', (100, 75)))
+        # pad fills the whole frame around the poster
+        self.assertEqual(image_format(render_rendition(poster, 90, 160, 'pad', output_format='PNG')), ('PNG', (90, 160)))
+
+    def test_pool_renders_the_configured_sizes(self):
+        rendered = render_poster_renditions(image_bytes('PNG', size=(400, 300)), ['thumbnail', 'whatsapp'])
+        self.assertEqual(image_format(rendered['thumbnail']), ('WEBP', POSTER_RENDITIONS['thumbnail'][:2]))
+        self.assertEqual(image_format(rendered['whatsapp'])[1], (800, 600))
+
+    def test_unreadable_posters_leave_the_rendition_out(self):
+        self.assertEqual(render_poster_renditions(b"not an image", ['thumbnail']), {})
+
+
+@override_settings(POSTER_RENDITIONS=['thumbnail', 'story'])
+class RenditionStorageTests(EmulatorTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def test_renditions_are_uploaded_side_by_side(self):
+        urls = store_poster_renditions(self.user, image_bytes('PNG', size=(400, 300)))
+        self.assertEqual(set(urls), {'thumbnail', 'story'})
+        self.assertEqual(image_format(fetch_image_bytes(urls['story']))[1], (1080, 1920))
+
+    def test_failed_uploads_are_left_out(self):
+        config = {**FAST_EMULATOR, 'cloudinary': {**FAST_EMULATOR['cloudinary'], 'error_rate': 1}}
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            self.assertEqual(store_poster_renditions(self.user, image_bytes('PNG')), {})
+
+
+# -----------------
+# HEDGED GENERATION
+# -----------------
+@override_settings(
+    POSTER_HEDGE_DELAY=0.1, POSTER_HEDGE_MIN_DELAY=0.02,
+    POSTER_HEDGE_IMAGEN_MODEL='imagen-4.0-fast-generate-preview-06-06', POSTER_HEDGE_GEMINI_MODEL='gemini-3-pro-image-preview',
+)
+class HedgedGenerationTests(TestCase):
+    """Providers are replaced by a fake that answers after a set time per model"""
+
+    def setUp(self):
+        self.answers = {}
+        patch = mock.patch.object(generation_utils, 'timed_generate_poster_image', self.generate)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def generate(self, prompt_text, model_selection):
+        seconds, error = self.answers[model_selection]
+        time.sleep(seconds)
+        if error:
+            raise error
+        return model_selection.encode()
+
+    def hedge(self, imagen, gemini):
+        self.answers = {'imagen-4.0-generate-preview-06-06': imagen, 'gemini-3-pro-image-preview': gemini}
+        fired, won = get_counter('hedge:fired'), get_counter('hedge:won')
+        try:
+            return generate_poster_image_hedged("Poster for Glow Parlour", 'imagen-4.0-generate-preview-06-06')
+        finally:
+            self.counts = (get_counter('hedge:fired') - fired, get_counter('hedge:won') - won)
+
+    def test_fast_primary_is_not_hedged(self):
+        self.assertEqual(self.hedge((0, None), (0, None))[1], 'imagen-4.0-generate-preview-06-06')
+        self.assertEqual(self.counts, (0, 0))
+
+    def test_slow_primary_is_hedged_and_the_first_answer_wins(self):
+        started = time.monotonic()
+        image, served = self.hedge((1.0, None), (0, None))
+        self.assertEqual((image, served), (b'gemini-3-pro-image-preview', 'gemini-3-pro-image-preview'))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.counts, (1, 1))
+
+    def test_primary_still_wins_when_the_hedge_is_slower(self):
+        self.assertEqual(self.hedge((0.2, None), (1.0, None))[1], 'imagen-4.0-generate-preview-06-06')
+        self.assertEqual(self.counts, (1, 0))
+
+    def test_failed_primary_is_hedged_at_once(self):
+        started = time.monotonic()
+        self.assertEqual(self.hedge((0, ValueError("boom")), (0, None))[1], 'gemini-3-pro-image-preview')
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_primary_error_is_raised_when_both_fail(self):
+        with self.assertRaisesMessage(ValueError, "primary"):
+            self.hedge((0, ValueError("primary")), (0, RuntimeError("hedge")))
+
+    def test_delay_follows_the_recent_p95_within_bounds(self):
+        self.assertEqual(hedge_delay('test_provider'), 0.1)
+        for _ in range(20):
+            record_latency('provider:test_provider', 0.05)
+        self.assertEqual(hedge_delay('test_provider'), 0.05)
+        # Once the window holds only fast samples, the minimum delay applies
+        for _ in range(LATENCY_WINDOW):
+            record_latency('provider:test_provider', 0.001)
+        self.assertEqual(hedge_delay('test_provider'), 0.02)
+
+
+# -----------------
+# FESTIVAL DRAFTS
+# -----------------
+class FestivalDraftTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.opted_in = [make_user('parlour'), make_user('salon')]
+        for user in self.opted_in:
+            user.email_verified = user.notifications_enabled = True
+            user.save()
+        self.opted_out = make_user('quiet')
+        self.festival = Festival.objects.create(name="Diwali", date=timezone.localdate() + timedelta(days=3), notification_days=3)
+
+    def pregenerate(self, *args):
+        output = StringIO()
+        call_command('pregenerate_festival_posters', '--batch-interval', '0', *args, stdout=output)
+        return output.getvalue()
+
+    def test_drafts_are_made_for_opted_in_businesses_only(self):
+        output = self.pregenerate('--layout', 'classic')
+        self.assertIn("Created 2 drafts, 0 failed", output)
+
+        drafts = PosterGeneration.objects.filter(festival=self.festival)
+        self.assertEqual(sorted(drafts.values_list('user__username', flat=True)), ['parlour', 'salon'])
+        self.assertTrue(all(draft.is_draft for draft in drafts))
+        self.assertEqual(len({draft.poster_url for draft in drafts}), 2)
+        # Drafts are not in the history until the business keeps them
+        self.assertFalse(UserHistory.objects.exists())
+
+        # A second run only covers businesses still without a draft
+        self.assertIn("0 businesses need a draft", self.pregenerate('--layout', 'classic'))
+
+    def test_test_mode_generates_nothing(self):
+        self.assertIn("2 businesses need a draft", self.pregenerate('--test'))
+        self.assertFalse(PosterGeneration.objects.exists())
+
+    def test_failed_drafts_are_reported_and_retried_next_run(self):
+        config = {**FAST_EMULATOR, 'imagen': {**FAST_EMULATOR['imagen'], 'quota_error_rate': 1}}
+        with override_settings(AI_EMULATOR_CONFIG=config):
+            self.assertIn("Created 0 drafts, 2 failed", self.pregenerate('--layout', 'none'))
+        self.assertIn("Created 2 drafts, 0 failed", self.pregenerate('--layout', 'none'))
+
+    def test_keeping_a_draft_adds_it_to_the_history(self):
+        self.pregenerate('--layout', 'classic')
+        draft = PosterGeneration.objects.get(user=self.opted_in[0])
+        self.client.force_login(self.opted_in[0])
+        self.client.post(reverse('festival_poster', args=[draft.pk]))
+        draft.refresh_from_db()
+        self.assertFalse(draft.is_draft)
+        self.assertEqual(UserHistory.objects.get(poster=draft).input_data['pregenerated'], True)
+
+
+# -----------------
+# JOB PROGRESS
+# -----------------
+@override_settings(GENERATION_EVENTS_ENABLED=True, GENERATION_EVENTS_POLL_INTERVAL=0.01, GENERATION_EVENTS_TIMEOUT=5)
+class JobProgressTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+        self.job = GenerationJob.objects.create(user=self.user, input_data={'promotion_name': 'Diwali Glow'}, status='running', stage='generating')
+
+    def events(self, job=None):
+        response = self.client.get(reverse('generation_job_events', args=[(job or self.job).pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return (chunk.decode() for chunk in response.streaming_content)
+
+    def test_stream_sends_stage_changes_then_the_result(self):
+        events = self.events()
+        self.assertTrue(next(events).startswith("retry: 10"))
+        self.assertIn('"stage": "generating"', next(events))
+
+        GenerationJob.objects.filter(pk=self.job.pk).update(stage='uploading')
+        self.assertIn('"stage": "uploading"', next(events))
+        GenerationJob.objects.filter(pk=self.job.pk).update(status='done', stage='done', result_url='/media/p.webp')
+        self.assertIn('"status": "done"', next(events))
+        self.assertEqual(next(events), 'event: done\ndata: {"job_id": %d, "result_url": "/media/p.webp"}\n\n' % self.job.pk)
+        self.assertIsNone(next(events, None))
+
+    def test_failed_and_cancelled_jobs_end_the_stream(self):
+        GenerationJob.objects.filter(pk=self.job.pk).update(status='failed', error="Too many requests")
+        self.assertIn('event: failed\ndata: {"job_id": %d, "error": "Too many requests"}' % self.job.pk, "".join(self.events()))
+        GenerationJob.objects.filter(pk=self.job.pk).update(status='cancelled')
+        self.assertIn("event: cancelled", "".join(self.events()))
+
+    @override_settings(GENERATION_EVENTS_TIMEOUT=0)
+    def test_stream_closes_after_the_timeout(self):
+        body = "".join(self.events())
+        self.assertIn('"stage": "generating"', body)
+        self.assertNotIn("event: done", body)
+
+    def test_other_users_jobs_are_not_found(self):
+        other = GenerationJob.objects.create(user=make_user('other'), input_data={})
+        self.assertEqual(self.client.get(reverse('generation_job_events', args=[other.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('generation_job_status', args=[other.pk])).status_code, 404)
+
+    @override_settings(GENERATION_EVENTS_ENABLED=False)
+    def test_pages_poll_when_streams_are_disabled(self):
+        self.assertEqual(self.client.get(reverse('generation_job_events', args=[self.job.pk])).status_code, 404)
+        data = self.client.get(reverse('generation_job_status', args=[self.job.pk])).json()
+        self.assertEqual((data['status'], data['stage']), ('running', 'generating'))
+
+    def test_stage_reporter_writes_only_changes(self):
+        report = job_stage_reporter(self.job)
+        with self.assertNumQueries(1):
+            report('prompt')
+            report('cache_lookup')
+            report('rate_limit_wait')
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.stage, 'prompting')
+
+
+# -----------------
+# MODEL ROUTER
+# -----------------
+@override_settings(
+    POSTER_MODEL_ROUTE=['imagen-best', 'gemini-image', 'imagen-fast'],
+    MODEL_ROUTER_FALLBACK='imagen-fast',
+    MODEL_ROUTER_MAX_P95=5,
+    MODEL_ROUTER_BACKLOG=1,
+    GOOGLE_API_KEY='key',
+)
+class ModelRouterTests(TestCase):
+
+    def setUp(self):
+        caches['stats'].clear()
+        self.user = make_user()
+
+    def make_slow(self, model):
+        for _ in range(LATENCY_WINDOW):
+            record_latency(f"model:{model}", 20)
+
+    def test_pinned_models_are_not_routed(self):
+        self.make_slow('imagen-best')
+        self.assertEqual(choose_poster_model('imagen-best'), 'imagen-best')
+        self.assertEqual(router_stats()['served']['imagen-best'], 0)
+
+    def test_auto_picks_the_best_model_with_headroom(self):
+        self.assertEqual(choose_poster_model(AUTO_MODEL), 'imagen-best')
+        self.make_slow('imagen-best')
+        self.assertEqual(model_pressure('imagen-best'), ['slow'])
+        self.assertEqual(choose_poster_model(AUTO_MODEL), 'gemini-image')
+        self.assertEqual(router_stats(), {'degraded': 1, 'served': {'imagen-best': 1, 'gemini-image': 1, 'imagen-fast': 0}})
+
+    def test_backlog_skips_the_top_model(self):
+        for _ in range(2):
+            GenerationJob.objects.create(user=self.user, input_data={})
+        self.assertEqual(choose_poster_model(AUTO_MODEL), 'gemini-image')
+
+    @override_settings(GOOGLE_API_KEY='')
+    def test_models_without_credentials_are_skipped(self):
+        self.make_slow('imagen-best')
+        self.assertEqual(choose_poster_model(AUTO_MODEL), 'imagen-fast')
+
+    def test_busy_limiters_and_quota_cuts_count_as_pressure(self):
+        limits = ProviderLimiter('imagen', 'imagen-best').limits['max_concurrency']
+        with mock.patch.object(ProviderLimiter, 'load', return_value=(limits, limits, 2)):
+            self.assertEqual(model_pressure('imagen-best'), ['busy', 'queued'])
+        with mock.patch.object(ProviderLimiter, 'load', return_value=(0, 1, 0)):
+            self.assertEqual(model_pressure('imagen-best'), ['quota'])
+
+    def test_fallback_when_every_model_is_under_pressure(self):
+        for model in settings.POSTER_MODEL_ROUTE:
+            self.make_slow(model)
+        self.assertEqual(choose_poster_model(AUTO_MODEL), 'imagen-fast')
+        self.assertEqual(router_stats()['degraded'], 1)
+
+
+# -----------------
+# PROGRESSIVE POSTERS
+# -----------------
+class ProgressivePosterTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def run_job(self, job):
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        return job
+
+    def draft(self):
+        input_data = {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English', 'progressive': True}
+        job = self.run_job(enqueue_generation_job(self.user, 'poster_generation', input_data))
+        self.assertEqual(job.status, 'done', job.error)
+        return PosterGeneration.objects.get(user=self.user)
+
+    def test_draft_is_swapped_for_the_full_render(self):
+        poster = self.draft()
+        self.assertEqual((poster.upgrade_status, poster.served_model), ('pending', settings.POSTER_DRAFT_MODEL))
+        upgrade = GenerationJob.objects.get(job_type='poster_upgrade')
+        self.assertEqual((upgrade.status, upgrade.input_data['poster_id']), ('queued', poster.pk))
+
+        self.assertEqual(self.run_job(upgrade).status, 'done', upgrade.error)
+        poster.refresh_from_db()
+        self.assertEqual(poster.upgrade_status, 'done')
+        self.assertEqual(poster.poster_url, upgrade.result_url)
+        self.assertEqual(UserHistory.objects.get(poster=poster).output_data, upgrade.result_url)
+
+    def test_cancelling_keeps_the_draft(self):
+        poster = self.draft()
+        draft_url = poster.poster_url
+        url = reverse('cancel_poster_upgrade', args=[poster.pk])
+        data = self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(data, {'success': True, 'upgrade_status': 'cancelled'})
+        self.assertEqual(GenerationJob.objects.get(job_type='poster_upgrade').status, 'cancelled')
+        # Nothing left to cancel
+        self.assertFalse(self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()['success'])
+        poster.refresh_from_db()
+        self.assertEqual(poster.poster_url, draft_url)
+
+    def test_cancel_during_the_render_discards_the_result(self):
+        poster = self.draft()
+        upgrade = GenerationJob.objects.get(job_type='poster_upgrade')
+        produce = generation_utils.produce_poster
+
+        def cancel_then_produce(*args, **kwargs):
+            self.assertTrue(generation_utils.cancel_poster_upgrade(poster))
+            return produce(*args, **kwargs)
+
+        with mock.patch.object(generation_utils, 'produce_poster', side_effect=cancel_then_produce):
+            self.assertEqual(self.run_job(upgrade).status, 'cancelled')
+        self.assertEqual(PosterGeneration.objects.get(pk=poster.pk).poster_url, poster.poster_url)
+
+    def test_draft_model_requests_need_no_upgrade(self):
+        self.assertFalse(generation_utils.wants_draft({'progressive': True, 'model': settings.POSTER_DRAFT_MODEL}))
+        self.assertFalse(generation_utils.wants_draft({'model': 'imagen-4.0-generate-preview-06-06'}))
+        self.assertTrue(generation_utils.wants_draft({'progressive': True}))
+
+
+# -----------------
+# POSTER EDITS
+# -----------------
+class PosterEditTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+        with open(os.path.join(settings.MEDIA_ROOT, 'parent.png'), 'wb') as f:
+            f.write(image_bytes('PNG', (64, 64)))
+        self.poster = PosterGeneration.objects.create(
+            user=self.user, promotion_name="Diwali Glow", offer_type="20% off", poster_url="/media/parent.png"
+        )
+
+    def edit(self, poster, instruction):
+        return self.client.post(
+            reverse('edit_poster', args=[poster.pk]), {'instruction': instruction}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_edit_is_queued_and_recorded_as_a_child_poster(self):
+        data = self.edit(self.poster, "Make the background gold").json()
+        self.assertTrue(data['success'], data)
+        job = GenerationJob.objects.get(pk=data['job_id'])
+        self.assertEqual(job.job_type, 'poster_edit')
+        self.assertEqual(job.input_data, {'parent_id': self.poster.pk, 'instruction': "Make the background gold"})
+
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        self.assertEqual(job.status, 'done', job.error)
+        edited = PosterGeneration.objects.get(parent=self.poster)
+        self.assertEqual((edited.poster_url, edited.promotion_name), (job.result_url, "Diwali Glow"))
+        self.assertEqual(UserHistory.objects.get(poster=edited).input_data['edit_of'], self.poster.pk)
+        self.assertEqual(GenerationTiming.objects.get(action_type='poster_edit').outcome, 'ok')
+
+    def test_invalid_instructions_are_not_queued(self):
+        self.assertEqual(self.edit(self.poster, "  ").json()['error'], "Please describe what to change.")
+        self.assertIn("500 characters", self.edit(self.poster, "x" * 501).json()['error'])
+        self.assertFalse(self.edit(self.poster, "Send nudes").json()['success'])
+        with override_settings(GOOGLE_API_KEY=''):
+            self.assertIn("GOOGLE_API_KEY", self.edit(self.poster, "Make it gold").json()['error'])
+        self.assertFalse(GenerationJob.objects.exists())
+
+    def test_only_your_own_posters_can_be_edited(self):
+        other = PosterGeneration.objects.create(
+            user=make_user('other'), promotion_name="Holi", offer_type="10% off", poster_url="/media/parent.png"
+        )
+        self.assertEqual(self.edit(other, "Make it gold").status_code, 404)
+
+    def test_missing_source_image_fails_the_job(self):
+        os.remove(os.path.join(settings.MEDIA_ROOT, 'parent.png'))
+        job = enqueue_generation_job(self.user, 'poster_edit', {'parent_id': self.poster.pk, 'instruction': "Make it gold"})
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, "The original poster could not be loaded for editing.")
+        self.assertFalse(PosterGeneration.objects.filter(parent=self.poster).exists())
+
+
+# -----------------
+# POSTER COMPOSITING
+# -----------------
+POSTER_FIELDS = {
+    'business_name': "Glow Beauty Parlour",
+    'promotion_name': "Diwali Glow",
+    'offer': "20% OFF",
+    'phone': "9876543210",
+    'timing': "09:30 AM - 08:00 PM",
+    'location': "12 Temple Road, Mysuru",
+}
+
+
+def layout_block(layout, first_part):
+    return next(block for block in LAYOUT_TEMPLATES[layout] if block['type'] == 'text' and block['parts'][0] == first_part)
+
+
+class PosterLayoutTests(SimpleTestCase):
+
+    def test_contact_line_only_joins_fields_that_are_set(self):
+        block = layout_block('classic', 'Call {phone}')
+        self.assertEqual(block_text(block, POSTER_FIELDS), "Call 9876543210  |  09:30 AM - 08:00 PM")
+        self.assertEqual(block_text(block, {**POSTER_FIELDS, 'phone': ''}), "09:30 AM - 08:00 PM")
+        self.assertEqual(block_text(block, {**POSTER_FIELDS, 'timing': ''}), "Call 9876543210")
+        self.assertEqual(block_text(block, {**POSTER_FIELDS, 'phone': '', 'timing': ' '}), "")
+
+    def test_banner_footer_has_no_dangling_separators(self):
+        block = layout_block('banner', '{phone}')
+        self.assertEqual(block_text(block, {**POSTER_FIELDS, 'phone': '', 'timing': ''}), "12 Temple Road, Mysuru")
+        self.assertEqual(block_text(block, {**POSTER_FIELDS, 'timing': ''}), "9876543210  |  12 Temple Road, Mysuru")
+        self.assertEqual(block_text(layout_block('banner', '{promotion_name}'), {**POSTER_FIELDS, 'offer': ''}), "Diwali Glow")
+
+    def test_every_layout_draws_the_details_over_the_background(self):
+        background = Image.new('RGB', (256, 256), (30, 120, 200))
+        for layout in LAYOUT_TEMPLATES:
+            poster = render_composited_poster(background, POSTER_FIELDS, layout)
+            self.assertEqual((poster.mode, poster.size), ('RGB', (256, 256)))
+            self.assertNotEqual(poster.tobytes(), background.tobytes(), layout)
+            # The background passed in is never drawn on
+            self.assertEqual(background.getpixel((5, 5)), (30, 120, 200))
+
+    def test_missing_details_are_not_drawn(self):
+        background = Image.new('RGB', (256, 256), (30, 120, 200))
+        empty = dict.fromkeys(POSTER_FIELDS, '')
+        blank = render_composited_poster(background, empty, 'banner')
+        with_details = render_composited_poster(background, POSTER_FIELDS, 'banner')
+        self.assertNotEqual(blank.tobytes(), with_details.tobytes())
+
+
+class RemoteImageCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        for name in ('a', 'b', 'c'):
+            Image.new('RGB', (32, 32), (200, 0, 0)).save(f"{media_root}/{name}.png")
+        media = override_settings(MEDIA_ROOT=media_root, MEDIA_URL='/media/')
+        media.enable()
+        self.addCleanup(media.disable)
+        poster_layout._remote_images.clear()
+        poster_layout._remote_bytes = 0
+
+    @override_settings(POSTER_REMOTE_IMAGE_CACHE_BYTES=32 * 32 * 4 * 2)
+    def test_cache_is_bounded_by_decoded_bytes(self):
+        first = load_remote_image('/media/a.png')
+        self.assertIs(load_remote_image('/media/a.png'), first)
+        load_remote_image('/media/b.png')
+        load_remote_image('/media/c.png')
+
+        self.assertEqual(list(poster_layout._remote_images), ['/media/b.png', '/media/c.png'])
+        self.assertEqual(poster_layout._remote_bytes, 32 * 32 * 4 * 2)
+
+
+class LogoOverlayTests(SimpleTestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        Image.new('RGB', (64, 32), (200, 0, 0)).save(f"{self.media_root}/logo.png")
+        media = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        media.enable()
+        self.addCleanup(media.disable)
+        poster_layout._logos.clear()
+        poster_layout._logo_etags.clear()
+        poster_layout._logo_bytes = 0
+
+    def test_scaled_logos_are_cached_per_box(self):
+        with mock.patch.object(poster_layout, '_fetch_logo', wraps=poster_layout._fetch_logo) as fetch:
+            small = get_scaled_logo('/media/logo.png', (16, 16))
+            self.assertIs(get_scaled_logo('/media/logo.png', (16, 16)), small)
+            large = get_scaled_logo('/media/logo.png', (40, 40))
+        self.assertEqual((small.mode, small.size, large.size), ('RGBA', (16, 8), (40, 20)))
+        # The original is decoded once and scaled from memory for the second box
+        self.assertEqual(fetch.call_count, 1)
+
+    @override_settings(POSTER_LOGO_REVALIDATE=0)
+    def test_changed_logo_replaces_the_cached_one(self):
+        first = get_scaled_logo('/media/logo.png', (16, 16))
+        self.assertIs(get_scaled_logo('/media/logo.png', (16, 16)), first)
+
+        Image.new('RGB', (32, 32), (0, 0, 200)).save(f"{self.media_root}/logo.png")
+        os.utime(f"{self.media_root}/logo.png", ns=(0, 10**9))
+        second = get_scaled_logo('/media/logo.png', (16, 16))
+        self.assertEqual((second.size, second.getpixel((8, 8))), ((16, 16), (0, 0, 200, 255)))
+
+    @override_settings(POSTER_LOGO_REVALIDATE=0)
+    def test_not_modified_remote_logo_is_not_downloaded_again(self):
+        data = image_bytes('PNG', (32, 32))
+        fresh = mock.Mock(status_code=200, content=data, headers={'ETag': '"v1"'})
+        with mock.patch.object(poster_layout.requests, 'get', side_effect=[fresh, mock.Mock(status_code=304)]) as get:
+            first = get_scaled_logo('https://cdn.example.com/logo.png', (16, 16))
+            self.assertIs(get_scaled_logo('https://cdn.example.com/logo.png', (16, 16)), first)
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+
+    @override_settings(POSTER_LOGO_CACHE_BYTES=64 * 32 * 4 + 32 * 16 * 4)
+    def test_cache_is_bounded_by_decoded_bytes(self):
+        get_scaled_logo('/media/logo.png', (16, 16))
+        get_scaled_logo('/media/logo.png', (32, 32))
+        # The least recently used copy goes; the original was just used to scale the second one
+        self.assertEqual([box for _url, _etag, box in poster_layout._logos], [None, (32, 32)])
+        self.assertEqual(poster_layout._logo_bytes, 64 * 32 * 4 + 32 * 16 * 4)
+
+    @override_settings(POSTER_LOGO_SCALE=0.25)
+    def test_logo_is_drawn_in_the_chosen_corner(self):
+        poster = Image.new('RGB', (200, 200), (255, 255, 255))
+        with_logo = overlay_logo(poster, '/media/logo.png', 'bottom-right')
+        self.assertEqual(with_logo.getpixel((185, 185)), (200, 0, 0))
+        self.assertEqual(with_logo.getpixel((15, 15)), (255, 255, 255))
+        self.assertEqual(poster.getpixel((185, 185)), (255, 255, 255))
+
+    def test_broken_logo_keeps_the_poster(self):
+        data = image_bytes('PNG', (64, 64))
+        self.assertEqual(generation_utils.add_poster_logo(data, '/media/missing.png', 'top-left'), data)
+
+
+class CompositedPosterQueueTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+
+    def test_layout_posters_are_never_composited_in_the_request(self):
+        input_data = {'promotion_name': 'Diwali Glow', 'offer_type': '20% off', 'language': 'English', 'layout': 'classic'}
+        self.assertIsNone(serve_cached_poster(self.user, input_data))
+
+        job = enqueue_generation_job(self.user, 'poster_generation', input_data)
+        self.assertTrue(claim_generation_job(job))
+        process_generation_job(job)
+        self.assertEqual(job.status, 'done', job.error)
+
+        # The second poster reuses the stored background, still through the job queue
+        self.assertIsNone(serve_cached_poster(self.user, input_data))
+        second = enqueue_generation_job(self.user, 'poster_generation', input_data)
+        self.assertTrue(claim_generation_job(second))
+        process_generation_job(second)
+        self.assertEqual(second.status, 'done', second.error)
+        self.assertEqual(UserHistory.objects.filter(user=self.user, input_data__cache_hit=True).count(), 1)
+
+
+# -----------------
+# PROVIDER CLIENTS
+# -----------------
+@override_settings(AI_EMULATOR=True)
+class ClientRegistryTests(SimpleTestCase):
+
+    def test_clients_are_built_once_and_counted(self):
+        first = get_client('cohere', api_key='registry-test')
+        self.assertIs(get_client('cohere', api_key='registry-test'), first)
+        evict_client('cohere', api_key='registry-test')
+        self.assertIsNot(get_client('cohere', api_key='registry-test'), first)
+        uses = [entry['uses'] for entry in client_status() if entry['provider'] == 'cohere']
+        self.assertIn(1, uses)
+
+    def test_eviction_racing_with_use_does_not_fail(self):
+        errors = []
+
+        def use():
+            try:
+                for _ in range(300):
+                    get_client('cohere', api_key='race-test')
+            except Exception as e:
+                errors.append(e)
+
+        def evict():
+            for _ in range(300):
+                evict_client('cohere', api_key='race-test')
+
+        threads = [threading.Thread(target=use) for _ in range(4)] + [threading.Thread(target=evict)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+# -----------------
+# RATE LIMITER
+# -----------------
+class QuotaError(Exception):
+    code = 429
+
+
+@override_settings(PROVIDER_LIMITS=FAST_LIMITS)
+class ProviderLimiterTests(TransactionTestCase):
+    """Database limiter state (no Redis configured)"""
+
+    def raise_error(self, error):
+        raise error
+
+    def test_slots_are_released_when_calls_fail(self):
+        limiter = ProviderLimiter('test_errors', 'model')
+        with self.assertRaises(ValueError):
+            limited_call('test_errors', 'model', self.raise_error, ValueError("boom"))
+        with self.assertRaises(QuotaError):
+            limited_call('test_errors', 'model', self.raise_error, QuotaError())
+
+        self.assertEqual(limiter.in_flight(), 0)
+        # The quota error halved the concurrency limit
+        self.assertEqual(limiter.concurrency_limit(), 4)
+
+    def test_concurrent_failures_leave_no_slot_held(self):
+        limiter = ProviderLimiter('test_threads', 'model')
+        outcomes = []
+
+        def call(number):
+            try:
+                outcomes.append(limited_call('test_threads', 'model', self.raise_error if number % 2 else str, ValueError("boom") if number % 2 else number))
+            except ValueError:
+                outcomes.append('error')
+
+        threads = [threading.Thread(target=call, args=(number,)) for number in range(24)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), 24)
+        self.assertEqual(outcomes.count('error'), 12)
+        self.assertEqual(limiter.in_flight(), 0)
+
+    def test_acquire_and_release_balance(self):
+        limiter = ProviderLimiter('test_leases', 'model')
+        leases = [limiter.acquire() for _ in range(3)]
+        self.assertEqual(limiter.in_flight(), 3)
+        for lease in leases:
+            limiter.release(lease)
+        # Releasing a lease twice must not free someone else's slot
+        limiter.release(leases[0])
+        self.assertEqual(limiter.in_flight(), 0)
+
+    @override_settings(PROVIDER_LIMITS={'default': {**FAST_LIMITS['default'], 'max_concurrency': 2}})
+    def test_slots_are_shared_between_processes(self):
+        first = ProviderLimiter('test_shared', 'model')
+        leases = [first.acquire(), first.acquire()]
+        self.assertEqual(ProviderLimitState.objects.get(name='test_shared:model').leases.keys(), set(leases))
+
+        # Another process has its own locks and objects but the same row
+        with mock.patch.object(DatabaseLimiterState, '_locks', {}):
+            other = ProviderLimiter('test_shared', 'model')
+            self.assertFalse(other.state.try_acquire('other-process'))
+            first.release(leases[0])
+            self.assertTrue(other.state.try_acquire('other-process'))
+        self.assertEqual(first.in_flight(), 2)
+
+    @override_settings(PROVIDER_LIMITS={'default': {**FAST_LIMITS['default'], 'max_concurrency': 1, 'slot_ttl': 0.05}})
+    def test_leases_of_dead_callers_expire(self):
+        limiter = ProviderLimiter('test_expiry', 'model')
+        limiter.acquire()
+        self.assertFalse(limiter.state.try_acquire('waiting'))
+        time.sleep(0.1)
+        self.assertTrue(limiter.state.try_acquire('waiting'))
+        self.assertIn('test_expiry:model', limiter_stats())
+
+
+# -----------------
+# CACHE KEYS
+# -----------------
+class CacheKeyTests(SimpleTestCase):
+
+    def test_poster_key_ignores_whitespace_only(self):
+        key = poster_cache_key("Poster for\n  Glow   Parlour ", "imagen-4.0-generate-preview-06-06")
+        self.assertEqual(key, poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06"))
+        self.assertNotEqual(key, poster_cache_key("Poster for Glow Parlour", "gemini-3-pro-image-preview"))
+        self.assertNotEqual(key, poster_cache_key("Poster for glow parlour", "imagen-4.0-generate-preview-06-06"))
+
+    def test_poster_key_is_stable(self):
+        # Stored posters stay reachable only while the key format is unchanged
+        self.assertEqual(
+            poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06"),
+            poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06", ''),
+        )
+        self.assertEqual(
+            poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06"),
+            "parlorpal:poster:fb93d00d9859a6aea868ddce7de8bbc7c55a2072ca848fbfe5cc8ee0e92f4a5d",
+        )
+        self.assertNotEqual(
+            poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06"),
+            poster_cache_key("Poster for Glow Parlour", "imagen-4.0-generate-preview-06-06", 'logo:top-left:x'),
+        )
+
+    def test_text_key_ignores_case_whitespace_and_param_order(self):
+        key = text_cache_key('caption', "Caption for  Glow\nParlour", 'command', {'max_tokens': 100, 'temperature': 0.7})
+        self.assertEqual(key, text_cache_key('caption', "caption for glow parlour", 'command', {'temperature': 0.7, 'max_tokens': 100}))
+        self.assertNotEqual(key, text_cache_key('caption', "caption for glow parlour", 'command', {'temperature': 0.7, 'max_tokens': 200}))
+        self.assertNotEqual(key, text_cache_key('email_subjects', "caption for glow parlour", 'command', {'temperature': 0.7, 'max_tokens': 100}))
+        self.assertTrue(key.startswith("parlorpal:text:caption:"))
+
+
+class TextCacheTests(EmulatorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def caption(self, **extra):
+        response = self.client.post(reverse('ai_suggestions'), {
+            'user_input': 'Diwali facial offer', 'language': 'English', 'length': 'small', **extra,
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        return response.json()['marketing_text']
+
+    def test_repeated_caption_is_served_from_the_cache(self):
+        before = text_cache_stats()['caption']
+        with mock.patch.object(views, 'limited_call', wraps=views.limited_call) as provider:
+            first = self.caption()
+            self.assertEqual(self.caption(user_input='DIWALI  facial offer'), first)
+            self.assertEqual(provider.call_count, 1)
+            # "New variation" always asks the provider, and its reply replaces the cached one
+            self.caption(new_variation='on')
+            self.assertEqual(provider.call_count, 2)
+
+        stats = text_cache_stats()['caption']
+        self.assertEqual((stats['hits'] - before['hits'], stats['misses'] - before['misses']), (1, 1))
+        self.assertEqual(list(GenerationTiming.objects.order_by('pk').values_list('cache_hit', flat=True)), [False, True, False])
+        # Every caption is in the history, cached or not
+        self.assertEqual(UserHistory.objects.filter(user=self.user, action_type='text_generation').count(), 3)
+
+    def test_email_subjects_are_cached(self):
+        with mock.patch.object(views, 'limited_call', wraps=views.limited_call) as provider:
+            for _ in range(2):
+                response = self.client.post(reverse('email_subjects'), {'offer': '20% off facials', 'audience': 'brides', 'tone': 'warm'})
+                self.assertTrue(response.context['subject_lines'])
+        self.assertEqual(provider.call_count, 1)
+
+    @override_settings(TEXT_CACHE_TTLS={'caption': 0, 'email_subjects': 60, 'chatbot': 60})
+    def test_endpoints_with_no_ttl_are_not_cached(self):
+        set_cached_text('caption', "Caption for Glow Parlour", 'command', "Glow this Diwali")
+        self.assertIsNone(get_cached_text('caption', "Caption for Glow Parlour", 'command'))
+        set_cached_text('chatbot', "Hi", 'gemini-2.5-flash', "Hello!")
+        self.assertEqual(get_cached_text('chatbot', "hi", 'gemini-2.5-flash'), "Hello!")
+        self.assertIsNone(get_cached_text('chatbot', "hi", 'gemini-2.5-flash', {'temperature': 1}))
+
+
+# -----------------
+# CHATBOT CONTEXT AND HISTORY
+# -----------------
+class ChatContextInvalidationTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+        set_chat_context(self.user.pk, {'business_name': 'Glow Beauty Parlour'})
+
+    def test_profile_save_drops_the_context(self):
+        self.assertIsNotNone(get_chat_context(self.user.pk))
+        profile = self.user.businessprofile
+        profile.phone = "9000000000"
+        profile.save()
+        self.assertIsNone(get_chat_context(self.user.pk))
+
+    def test_new_poster_drops_the_context(self):
+        PosterGeneration.objects.create(user=self.user, promotion_name="Diwali Glow", offer_type="20% off", poster_url="/media/p.png")
+        self.assertIsNone(get_chat_context(self.user.pk))
+
+    def test_other_users_keep_their_context(self):
+        other = make_user('other')
+        set_chat_context(other.pk, {'business_name': 'Other'})
+        PosterGeneration.objects.create(user=self.user, promotion_name="Diwali Glow", offer_type="20% off", poster_url="/media/p.png")
+        self.assertEqual(get_chat_context(other.pk), {'business_name': 'Other'})
+
+
+class CacheCounterTests(TestCase):
+
+    def test_cache_events_are_counted_without_database_writes(self):
+        before = cache_stats('test_batched')
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                record_cache_event('test_batched', hit=True)
+            record_cache_event('test_batched', hit=False)
+
+        # Unflushed increments of this process are already part of the stats
+        self.assertEqual(cache_stats('test_batched')['hits'], before['hits'] + 3)
+        flush_counters()
+        self.assertEqual(StatCounter.objects.get(name='test_batched:hits').value, before['hits'] + 3)
+        self.assertEqual(cache_stats('test_batched'), {'hits': before['hits'] + 3, 'misses': before['misses'] + 1, 'hit_rate': 0.75})
+
+    def test_failed_flush_keeps_the_counts(self):
+        record_cache_event('test_unflushed', hit=True)
+        with mock.patch.object(cache_utils, '_write_counter', side_effect=DatabaseError("gone")):
+            flush_counters()
+        self.assertEqual(get_counter('test_unflushed:hits'), 1)
+        flush_counters()
+        self.assertEqual(StatCounter.objects.get(name='test_unflushed:hits').value, 1)
+
+
+CHAT_CACHES = {
+    **settings.CACHES,
+    'chat': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chat-tests'},
+}
+
+
+@override_settings(CHAT_HISTORY_MAX_TURNS=4, CHAT_HISTORY_PERSIST=False)
+class ChatStoreTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def chat(self, *messages):
+        for message in messages:
+            append_turns(self.user.pk, 'tab-1', [{'role': 'user', 'content': message}, {'role': 'bot', 'content': f"re: {message}"}])
+
+    def test_without_redis_the_table_is_the_store(self):
+        with self.assertNumQueries(2):
+            self.chat("hi")
+        self.chat("offers?", "timings?")
+        self.assertEqual([turn['content'] for turn in get_history(self.user.pk, 'tab-1')], ["offers?", "re: offers?", "timings?", "re: timings?"])
+        self.assertEqual(get_history(self.user.pk, 'tab-2'), [])
+
+    @override_settings(CACHES=CHAT_CACHES)
+    def test_with_a_chat_cache_turns_cost_no_queries(self):
+        caches['chat'].clear()
+        with self.assertNumQueries(0):
+            self.chat("hi", "offers?", "timings?")
+            history = get_history(self.user.pk, 'tab-1')
+        self.assertEqual(len(history), 4)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    @override_settings(CACHES=CHAT_CACHES, CHAT_HISTORY_PERSIST=True)
+    def test_evicted_conversations_are_restored_from_the_table(self):
+        caches['chat'].clear()
+        self.chat("hi", "offers?")
+        caches['chat'].clear()
+        self.assertEqual([turn['content'] for turn in get_history(self.user.pk, 'tab-1')], ["hi", "re: hi", "offers?", "re: offers?"])
+
+
+@override_settings(CHAT_HISTORY_MAX_TURNS=4, CHAT_HISTORY_MAX_BYTES=30)
+class ChatHistoryTrimTests(SimpleTestCase):
+
+    def turns(self, *texts):
+        return [{'role': 'user' if index % 2 == 0 else 'bot', 'content': text} for index, text in enumerate(texts)]
+
+    def test_turn_cap_keeps_the_newest_turns(self):
+        trimmed = _trim(self.turns('a', 'b', 'c', 'd', 'e', 'f'))
+        self.assertEqual([turn['content'] for turn in trimmed], ['c', 'd', 'e', 'f'])
+
+    def test_byte_cap_drops_the_oldest_turns(self):
+        trimmed = _trim(self.turns('x' * 12, 'y' * 12, 'z' * 12))
+        self.assertEqual([turn['content'] for turn in trimmed], ['y' * 12, 'z' * 12])
+
+    def test_oversized_turn_is_truncated_on_a_character_boundary(self):
+        # "ನ" is 3 bytes in UTF-8, so 30 bytes fit exactly 10 of them
+        trimmed = _trim(self.turns('ನ' * 25))
+        self.assertEqual(trimmed[0]['content'], 'ನ' * 10)
+        trimmed = _trim(self.turns('a' + 'ನ' * 25))
+        self.assertEqual(trimmed[0]['content'], 'a' + 'ನ' * 9)
+
+    def test_input_is_not_modified(self):
+        turns = self.turns('q' * 50)
+        _trim(turns)
+        self.assertEqual(turns[0]['content'], 'q' * 50)
+
+
+# -----------------
+# PREFLIGHT
+# -----------------
+@override_settings(PREFLIGHT_ENABLED=True, PREFLIGHT_BLOCK_THRESHOLD=0.8, PREFLIGHT_EXTRA_BLOCK_TERMS=[])
+class PreflightTests(TestCase):
+
+    def test_marketing_slang_is_rewritten(self):
+        result = preflight_check('poster', {'promotion_name': "Killer deals this Diwali", 'offer_type': "Nude makeup at 20% off"})
+        self.assertTrue(result['success'])
+        self.assertEqual(result['fields'], {'promotion_name': "Amazing deals this Diwali", 'offer_type': "Natural makeup at 20% off"})
+        self.assertEqual(result['rewritten'], ['promotion_name', 'offer_type'])
+
+    def test_plain_requests_pass_unchanged(self):
+        result = preflight_check('poster', {'promotion_name': "Bridal Season", 'offer_type': "Free consultation"})
+        self.assertTrue(result['success'])
+        self.assertEqual(result['rewritten'], [])
+        self.assertLess(result['score'], 0.8)
+
+    def test_blocked_terms_reject_the_request(self):
+        result = preflight_check('poster', {'promotion_name': "Send nudes", 'offer_type': "20% off"})
+        self.assertFalse(result['success'])
+        self.assertEqual(result['score'], 1.0)
+        self.assertTrue(result['error'])
+
+    def test_risky_term_combinations_reject_the_request(self):
+        result = preflight_check('video', {'script': "Kids body waxing with a gun and drugs"})
+        self.assertFalse(result['success'])
+        self.assertIn('body+kids', result['reasons'])
+
+    @override_settings(PREFLIGHT_ENABLED=False)
+    def test_disabled_preflight_passes_everything(self):
+        result = preflight_check('poster', {'promotion_name': "Send nudes"})
+        self.assertTrue(result['success'])
+
+
+# -----------------
+# PROMPT TEMPLATES
+# -----------------
+# The prompt strings as the views built them before templates existed. Templates must keep
+# producing them byte for byte, or cached results and stored history stop matching.
+BASELINE_POSTER = """
+You are a creative director. Include emotional, atmospheric, and cultural details relevant to the promotion theme (e.g., festivals, seasons, etc). Keep the business details exact, but describe the visuals vividly.
+Create a professional and eye-catching marketing poster for the business "{business_name}" to boost customer engagement and promote its latest offer.
+
+BUSINESS INFO:
+- Business Name: {business_name}
+- Business Type: {business_type}
+- Location: {location}
+- Phone: {phone}
+- Timing: {timing}
+
+PROMOTION:
+- Promotion Name: {promotion_name}
+- Main Offer: {final_offer}
+- Language: {language}
+
+DESIGN GUIDELINES:
+- Format optimized for Instagram and WhatsApp sharing
+- Display the business name clearly at the top
+- **MANDATORY: Include 2-3 keywords or service names related to {business_type} (e.g., "Hair • Makeup • Spa" or "Bridal Services • Facials • Styling") prominently on the poster**
+- Highlight the promotion name and main offer with bold and attractive fonts
+- Use colors and typography that match the business theme
+- **CRITICAL: Use ONLY cartoon/animated/illustrated style visuals. DO NOT generate realistic human photographs or images.**
+- Include relevant cartoon/animated visuals or illustrations:
+  - If {business_type} is "salon" or "beauty parlour", use cartoon/animated illustrations of beauty tools, cosmetics, or stylized beauty elements (combs, scissors, lipstick, mirrors, etc.)
+  - Otherwise, use cartoon/animated icons/illustrations that match the business type (e.g., cartoon tools, tech icons, food illustrations)
+  - **Absolutely NO realistic human faces or photographs - only cartoon/animated style**
+- Keep the layout clean and easy to read on mobile
+- Add marketing elements like badges, stickers, or call-to-action text (e.g., "Call Now", "Limited Offer", "Visit Today")
+- Ensure the design remains professional, family-friendly, and suitable for public social media marketing.
+
+POSTER GOAL:
+- Should look modern, polished, and shareable
+- Designed to attract attention and drive real engagement on social media
+- Must clearly communicate what services the business provides through keywords
+- Encourage viewers to contact the business via phone for more details
+- Evoke a sense of excitement and urgency around the promotion
+- Incorporate cultural or festive elements if relevant to the promotion timing
+"""
+
+BASELINE_CAPTION = """Task: Output only a funny and engaging social media caption for a business named {business_name}.
+Language: {language}
+Business Name: {business_name}
+Services: {description}
+Location: {location}
+Focus: {user_input}
+Instructions: Use at least 4 relevant emojis. Output only the caption text."""
+
+
+class PromptTemplateTests(TestCase):
+
+    def test_poster_prompt_matches_baseline(self):
+        user = make_user()
+        prompt, _details = build_poster_prompt(user.businessprofile, "Diwali Glow", "20% OFF", "Kannada")
+        expected = BASELINE_POSTER.format(
+            business_name="Glow Beauty Parlour",
+            business_type="Beauty parlour",
+            location="12 Temple Road, Mysuru, Mysuru, Karnataka, India",
+            phone="9876543210",
+            timing="09:30 AM - 08:00 PM",
+            promotion_name="Diwali Glow",
+            final_offer="20% OFF",
+            language="Kannada",
+        )
+        self.assertEqual(prompt.text, expected)
+        self.assertEqual(prompt.trimmed, [])
+
+    def test_poster_prompt_defaults_match_baseline(self):
+        user = CustomUser.objects.create_user(username='blank', password='pass')
+        prompt, _details = build_poster_prompt(user.businessprofile, "Summer Sale", "Buy 1 Get 1", "English")
+        expected = BASELINE_POSTER.format(
+            business_name="blank's Business",
+            business_type="Business profile for blank",
+            location="Your Location",
+            phone="Your Phone",
+            timing="9:00 AM - 8:00 PM",
+            promotion_name="Summer Sale",
+            final_offer="Buy 1 Get 1",
+            language="English",
+        )
+        self.assertEqual(prompt.text, expected)
+
+    def test_over_budget_poster_prompt_trims_the_business_type_only(self):
+        user = make_user()
+        profile = user.businessprofile
+        profile.description = "Beauty parlour " + "with bridal, party and everyday looks " * 120 + ". Rest."
+        profile.address = "12 Temple Road, Near the Old Bus Stand"
+        profile.save()
+
+        prompt, details = build_poster_prompt(profile, "Diwali Glow", "20% OFF on all facials", "English")
+
+        self.assertEqual(prompt.trimmed, ['business_type'])
+        self.assertLessEqual(prompt.estimated_tokens, get_template('poster').max_tokens)
+        self.assertIn("- Location: 12 Temple Road, Near the Old Bus Stand, Mysuru, Mysuru, Karnataka, India\n", prompt.text)
+        self.assertIn("- Main Offer: 20% OFF on all facials\n", prompt.text)
+        self.assertIn("- Promotion Name: Diwali Glow\n", prompt.text)
+        self.assertIn("- Business Type: Beauty parlour with bridal", prompt.text)
+
+    def test_caption_versions_match_baseline(self):
+        variables = {
+            'business_name': "Glow Beauty Parlour",
+            'description': "Beauty parlour. Bridal makeup, facials and hair styling.",
+            'location': "Mysuru, Karnataka",
+            'language': "Hindi",
+            'user_input': "monsoon hair spa",
+        }
+        expected = BASELINE_CAPTION.format(**variables)
+        self.assertEqual(render_prompt('caption', tone="funny and engaging", **variables).text, expected)
+        self.assertEqual(get_template('caption', 1).render(**variables).text, expected)
+
+    def test_email_subjects_prompt_matches_baseline(self):
+        prompt = render_prompt(
+            'email_subjects',
+            business_name="Glow Beauty Parlour",
+            description="Beauty parlour",
+            offer="20% off facials",
+            audience="brides",
+            tone="warm",
+        )
+        self.assertEqual(prompt.text, (
+            "Suggest 5 engaging email subject lines for a business named 'Glow Beauty Parlour'. "
+            "Description: Beauty parlour. "
+            "Offer: 20% off facials. "
+            "Target audience: brides. "
+            "Tone: warm. "
+            "Make them catchy, relevant, and suitable for a marketing campaign."
+        ))
+
+    def test_video_prompt_matches_baseline(self):
+        prompt = render_prompt(
+            'video',
+            script="Show the salon at dawn",
+            theme="Festive",
+            campaign_name="Diwali",
+            business_name="Glow Beauty Parlour",
+            description="Beauty parlour",
+        )
+        self.assertEqual(prompt.text, (
+            "Generate a marketing video using the following details.\n"
+            "Script: Show the salon at dawn\n"
+            "Theme: Festive\n"
+            "Campaign Name: Diwali\n"
+            "\nUse the details below as reference only (do not include verbatim):\n"
+            "Business Name: Glow Beauty Parlour\n"
+            "Description: Beauty parlour"
+        ))
+
+    def test_chatbot_prompt_matches_baseline(self):
+        context = {
+            'business_name': "Glow Beauty Parlour",
+            'description': "Beauty parlour",
+            'full_location': "Mysuru, Mysuru, Karnataka, India",
+            'address': "12 Temple Road",
+            'phone': "9876543210",
+            'timing': "09:30 AM - 08:00 PM",
+            'email': "parlour@example.com",
+            'recent_posters': "Diwali Glow (20% off)",
+            'caption_count': 3,
+        }
+        page_context = "\n\nCURRENT PAGE: /dashboard/\nThe user is currently on this page. Help them based on the page URL and context."
+        system_prompt = (
+            "You are ParlorPal’s AI assistant. Here is the user’s business profile and recent activity to help you answer their questions as a helpful, friendly, and knowledgeable assistant.\n"
+            f"Business Name: {context['business_name']}\n"
+            f"Description: {context['description']}\n"
+            f"Location: {context['full_location']}\n" + f"Detailed Address: {context['address']}\n"
+            f"Phone: {context['phone']}\n"
+            f"Business Hours: {context['timing']}\n"
+            f"Email: {context['email']}\n"
+            f"Recent Posters: {context['recent_posters']}\n"
+            f"Captions Generated: {context['caption_count']}\n"
+            f"{page_context}\n"
+            "Help the user with any questions about their business, marketing, or navigating ParlorPal.\n"
+            "If the user asks for captions, generate creative, engaging captions using their business info.\n"
+            "If the user asks about their business, use the profile info above.\n"
+            "If the user asks about navigation or what page they're on, use the CURRENT PAGE context above.\n"
+            "Always answer naturally and conversationally, as a real human assistant would.\n"
+        )
+        expected = "\n".join([system_prompt, "User: hi", "Bot: Hello!", "User: ideas?"])
+
+        prompt = render_prompt(
+            'chatbot',
+            **context,
+            page_context=page_context,
+            conversation="\n".join(["", "User: hi", "Bot: Hello!", "User: ideas?"])
+        )
+        self.assertEqual(prompt.text, expected)
@@ -0,0 +1,139 @@
+# core/timing.py
+"""
+Per-stage timing for AI generations.
+
+A StageTimer is started around one generation; code anywhere below it
+marks stages with `stage("encode")` and payload sizes with
+`record_bytes("output", n)` without the timer being passed down. Outside
+a timer (bulk and festival runs, scripts) both are no-ops. The finished
+timer is saved as one compact GenerationTiming row linked to the
+UserHistory entry, for the generation_timing_report command. Failed and
+cancelled generations are saved too, with their outcome and error, so
+slow failures (timeouts, quota waits) show up in the report.
+
+Stages may nest: `generate` includes `rate_limit_wait`.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from .models import GenerationTiming
+
+
+_current_timer = contextvars.ContextVar('generation_timer', default=None)
+
+
+class StageTimer:
+    """Collects stage durations (seconds), payload sizes (bytes) and the model for one generation"""
+
+    def __init__(self, action_type, model='', on_stage=None):
+        self.action_type = action_type
+        self.model = model
+        # Called with each stage name as it starts (job progress reporting)
+        self.on_stage = on_stage
+        self.stages = {}
+        self.sizes = {}
+        self.cache_hit = False
+        self.outcome = 'ok'
+        self.error = ''
+        self._started = time.monotonic()
+        self._token = None
+        # Threads of one generation (variants, renditions, caption grids) share the timer
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is not None:
+            self.fail(exc)
+        self.stop()
+        return False
+
+    def start(self):
+        """Make this the active timer of the current context"""
+        self._token = _current_timer.set(self)
+
+    def stop(self):
+        """Restore the timer that was active before start()"""
+        if self._token is not None:
+            _current_timer.reset(self._token)
+            self._token = None
+
+    def fail(self, error, outcome='failed'):
+        """Record that the generation did not succeed; the first failure is kept"""
+        if self.outcome == 'ok':
+            self.outcome = outcome
+            self.error = (str(error) or type(error).__name__)[:200]
+
+    def add(self, name, seconds):
+        # A stage can run more than once (retries, renditions per size); keep the total
+        with self._lock:
+            self.stages[name] = round(self.stages.get(name, 0) + seconds, 4)
+
+    @contextmanager
+    def stage(self, name):
+        if self.on_stage is not None:
+            self.on_stage(name)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def save(self, user, history=None):
+        """
+        Persist the timings. Never raises, so a metrics failure cannot fail the generation.
+
+        Returns:
+            GenerationTiming: The saved row, or None if saving failed
+        """
+        try:
+            return GenerationTiming.objects.create(
+                user=user,
+                history=history,
+                action_type=self.action_type,
+                model=self.model[:100],
+                cache_hit=self.cache_hit,
+                outcome=self.outcome,
+                error=self.error,
+                total_seconds=round(time.monotonic() - self._started, 4),
+                stages=self.stages,
+                sizes=self.sizes,
+            )
+        except Exception as e:
+            print(f"WARNING: Could not save generation timing: {e}")
+            return None
+
+
+def current_timer():
+    """The StageTimer active in this context, or None"""
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as `name` on the active timer (no-op without one)"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def record_bytes(name, size):
+    """Record a payload size on the active timer (no-op without one)"""
+    timer = _current_timer.get()
+    if timer is not None and size is not None:
+        with timer._lock:
+            timer.sizes[name] = size
+
+
+def record_model(model):
+    """Record the model that actually served the generation (e.g. a winning hedge)"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.model = model
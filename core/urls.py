@@ -14,6 +14,13 @@ urlpatterns = [
     path('2fa/', views.two_factor_view, name='two_factor'),
     # path('ai-suggestions/', views.ai_suggestions_view, name='ai_suggestions'),
     path('generate_poster/', views.poster_generator_view, name='generate_poster'),
+    path('generate_poster/bulk/', views.bulk_poster_view, name='bulk_posters'),
+    path('festival-posters/<int:poster_id>/', views.festival_poster_view, name='festival_poster'),
+    path('posters/<int:poster_id>/choose/', views.choose_poster_variant_view, name='choose_poster_variant'),
+    path('posters/<int:poster_id>/edit/', views.edit_poster_view, name='edit_poster'),
+    path('posters/<int:poster_id>/cancel-upgrade/', views.cancel_poster_upgrade_view, name='cancel_poster_upgrade'),
+    path('generation-jobs/<int:job_id>/', views.generation_job_status_view, name='generation_job_status'),
+    path('generation-jobs/<int:job_id>/events/', views.generation_job_events_view, name='generation_job_events'),
     path('chatbot/', views.chatbot_view, name='chatbot'),
     path('generate-video/', views.generate_video_view, name='generate_video'),
     
@@ -27,6 +34,8 @@ urlpatterns = [
     path('preview-festival-notification/', views.preview_festival_notification, name='preview_festival_notification'),
     path('email-templates/', views.email_templates_view, name='email_templates'),
     path('email-subjects/', views.email_subjects_view, name='email_subjects'),
+    path('ai-clients/status/', views.ai_clients_status_view, name='ai_clients_status'),
+    path('generation-stats/', views.generation_stats_view, name='generation_stats'),
     path('history/', views.user_history_view, name='user_history'),
     path('insights/', views.insights_view, name='insights'),
     
@@ -6,38 +6,57 @@
 # -----------------
 # Standard Library
 import os
+import time
 import uuid
 import traceback
 from io import BytesIO
 from datetime import datetime
 import json
 from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-Party Imports
 import cohere
 import vertexai
 import google.api_core.exceptions
 import cloudinary.uploader
-from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 
 # Django Imports
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, JsonResponse
-from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import connections, transaction
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
 
 # Local Application Imports
 from .forms import RegisterForm, LoginForm, BusinessProfileForm
-from .models import CustomUser, BusinessProfile, SearchHistory, Festival, PosterGeneration, UserHistory
+from .models import CustomUser, BusinessProfile, SearchHistory, Festival, PosterGeneration, UserHistory, GenerationJob
 from .email_utils import send_verification_email, send_festival_notifications, is_token_valid
 from .cloudinary_utils import upload_image_to_cloudinary, optimize_image_for_cloudinary
+from .generation_utils import (
+    POSTER_MODELS, POSTER_LANGUAGES, PosterGenerationError,
+    enqueue_generation_job, serve_cached_poster, parse_bulk_poster_csv,
+    cancel_poster_upgrade,
+)
+from .ai_clients import get_cohere_client, get_cohere_chat_client, get_genai_client, client_status
+from .cache_utils import (
+    cache_stats, get_counter, latency_stats, get_cached_text, set_cached_text, text_cache_stats,
+    get_chat_context, set_chat_context, invalidate_chat_context,
+)
+from .prompt_templates import profile_fragments, render_prompt
+from .chat_store import conversation_id, get_history, append_turns
+from .poster_layout import LAYOUT_TEMPLATES, LOGO_POSITIONS
+from .rate_limit import limited_call, limited_stream, limiter_stats
+from .model_router import AUTO_MODEL, router_stats
+from .preflight import preflight_check, preflight_stats
+from .timing import StageTimer, record_bytes, stage
 # --- MODIFICATION: Using the old 'preview' library as requested ---
 from vertexai.preview.vision_models import ImageGenerationModel
 import google.generativeai as genai
@@ -53,147 +72,11 @@ from google.genai import types
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Cohere Client once
-try:
-    cohere_client = cohere.Client(os.getenv("COHERE_API_KEY"))
-except Exception as e:
-    print(f"CRITICAL: Could not initialize Cohere client. Error: {e}")
+# AI provider clients (Cohere, Gemini, Imagen) are built lazily and shared
+# across requests and threads by the ai_clients registry.
 
-# Initialize Vertex AI once
-import os
-import json
-import vertexai
-from vertexai.preview.vision_models import ImageGenerationModel
-from google.api_core.exceptions import GoogleAPIError
-import traceback
-
-# Handle Google credentials - support both file and environment variable
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-CREDENTIALS_PATH = os.path.join(BASE_DIR, 'secrets', 'image-gen-demo-epsilon-d9e1f100bfc8.json')
-
-# Try to set credentials from environment variable first (for production)
-google_creds_json = os.getenv('GOOGLE_CREDENTIALS_JSON')
-if google_creds_json:
-    # Production: credentials provided as JSON string in environment variable
-    try:
-        credentials_file = '/tmp/google-credentials.json'
-        with open(credentials_file, 'w') as f:
-            f.write(google_creds_json)
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_file
-        print("SUCCESS: Using Google credentials from environment variable")
-    except Exception as e:
-        print(f"ERROR: Failed to write credentials from environment: {e}")
-elif os.path.exists(CREDENTIALS_PATH):
-    # Development: use local credentials file
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIALS_PATH
-    print(f"SUCCESS: Using local credentials file at {CREDENTIALS_PATH}")
-else:
-    print(f"WARNING: No Google credentials found. Image generation will not work.")
-
-# Initialize Vertex AI
-imagen_model_preview = None
-try:
-    if os.getenv('GOOGLE_APPLICATION_CREDENTIALS'):
-        vertexai.init(project=os.getenv('GCP_PROJECT_ID'), location="us-central1")
-
-        # A balanced model that offers a good mix of quality and speed for general-purpose image generation.
-        # Imagen_Model = "imagen-4.0-generate-preview-06-06"
-
-        # A model optimized for speed and low latency, ideal for real-time applications.
-        # Imagen_Model = "imagen-4.0-fast-generate-preview-06-06"
-
-        # The highest quality model in the family, best for complex prompts, high detail, and accurate text rendering.
-        # Imagen_Model = "imagen-4.0-ultra-generate-preview-06-06"
-
-
-        # NOTE: We are now using Gemini 3 Pro Image (Nano Banana) via the generate_poster_gemini_3() function
-        # This old Vertex AI initialization is kept for backwards compatibility but not actively used
-        # Gemini 3 Pro Image is NOT available via ImageGenerationModel - it requires the google.genai library
-        Imagen_Model = "imagen-4.0-ultra-generate-preview-06-06"  # Keep using Imagen as fallback
-
-
-        imagen_model_preview = ImageGenerationModel.from_pretrained(Imagen_Model)
-        
-        if imagen_model_preview:
-            print(f"imagen_model_preview initialized successfully: {imagen_model_preview}")
-            print(f"Using model: {Imagen_Model}")
-        else:
-            print(f"imagen_model_preview failed to initialize")
-            print(f"Model failed: {Imagen_Model}")
-        print("SUCCESS: Vertex AI initialized successfully")
-    else:
-        print("WARNING: Skipping Vertex AI initialization - no credentials available")
-except Exception as e:
-    error_details = traceback.format_exc()
-    print(f"CRITICAL: Could not initialize Vertex AI. Error: {e}")
-    print(f"DEBUG: Full error traceback: {error_details}")
-    imagen_model_preview = None
-
-
-# -----------------
-# 2B. GEMINI 3 PRO IMAGE INITIALIZATION (NANO BANANA)
-# -----------------
-def generate_poster_gemini_3(user_prompt):
-    """
-    Generates a poster using Gemini 3 Pro Image (Nano Banana).
-    This model handles TEXT and EMOTIONS much better than Imagen.
-    
-    Args:
-        user_prompt: The detailed prompt for poster generation
-        
-    Returns:
-        PIL Image object if successful, None otherwise
-    """
-    try:
-        # 1. Initialize the Client (different from Vertex AI)
-        if not settings.GOOGLE_API_KEY:
-            print("ERROR: GOOGLE_API_KEY not configured in settings.py")
-            return None
-            
-        client = google_genai.Client(api_key=settings.GOOGLE_API_KEY)
-        
-        # 2. Define the Model ID (This is Nano Banana Pro)
-        model_id = "gemini-3-pro-image-preview"
-        
-        # 3. Create a config to ensure high quality (simplified config)
-        config = types.GenerateContentConfig(
-            response_modalities=['IMAGE']  # Request an image back
-        )
-        
-        print(f"DEBUG: Sending prompt to {model_id} (Nano Banana)...")
-        
-        # 4. Generate content
-        response = client.models.generate_content(
-            model=model_id,
-            contents=[user_prompt],
-            config=config
-        )
-        
-        print(f"DEBUG: Received response from Gemini 3 Pro Image")
-        
-        # 5. Extract the Image - EXACT same logic as working test script
-        if hasattr(response, 'candidates') and response.candidates:
-            for candidate in response.candidates:
-                if hasattr(candidate, 'content') and candidate.content:
-                    content = candidate.content
-                    if hasattr(content, 'parts') and content.parts:
-                        for part in content.parts:
-                            if hasattr(part, 'inline_data') and part.inline_data:
-                                if hasattr(part.inline_data, 'data'):
-                                    # Data is already raw binary (not base64)
-                                    image_data = part.inline_data.data
-                                    pil_image = Image.open(BytesIO(image_data))
-                                    print(f"DEBUG: Successfully extracted PIL Image")
-                                    print(f"DEBUG: Image size: {pil_image.size}")
-                                    return pil_image
-        
-        print("WARNING: No image found in Gemini 3 Pro response")
-        return None
-        
-    except Exception as e:
-        print(f"ERROR: Gemini 3 Pro Image generation failed: {e}")
-        print(f"DEBUG: Full error traceback: {traceback.format_exc()}")
-        return None
+# Google credentials, Vertex AI and Gemini 3 Pro Image setup live in generation_utils
+# so the run_generation_worker command shares them with the web process.
 
 
 # -----------------
@@ -351,11 +234,20 @@ def dashboard_view(request):
         suggestion = "We miss you! It's been a while—generate new content to re-engage your audience."
     else:
         suggestion = "Keep up the great work! Explore more AI tools to supercharge your marketing."
+    recent_posters = PosterGeneration.objects.filter(user=request.user, is_draft=False)[:6]
+    # Festival posters pre-generated overnight and waiting for the user
+    festival_drafts = PosterGeneration.objects.filter(
+        user=request.user,
+        is_draft=True,
+        festival__date__gte=now.date()
+    ).select_related('festival')
     return render(request, 'core/dashboard.html', {
         'user': request.user, 
         'profile': profile,
         'current_date': now,
-        'suggestion': suggestion
+        'suggestion': suggestion,
+        'recent_posters': recent_posters,
+        'festival_drafts': festival_drafts
     })
 
 @login_required
@@ -401,46 +293,80 @@ def ai_suggestions_view(request):
         
         token_map = {"small": 100, "medium": 200, "long": 300}
         max_tokens = token_map.get(length, 100)
-        # Get location details
-        location_parts = []
-        if profile.town:
-            location_parts.append(profile.town)
-        if profile.state:
-            location_parts.append(profile.state)
-        location_str = ", ".join(location_parts) if location_parts else "your area"
-        
-        prompt = f"""Task: Output only a funny and engaging social media caption for a business named {profile.business_name}.
-Language: {language}
-Business Name: {profile.business_name}
-Services: {profile.description}
-Location: {location_str}
-Focus: {user_input}
-Instructions: Use at least 4 relevant emojis. Output only the caption text."""
-        try:
-            response = cohere_client.generate(
-                model="command",
-                prompt=prompt,
-                max_tokens=max_tokens,
-                temperature=0.7
+        # "New variation" skips the text cache lookup; the fresh caption still replaces the cached one
+        new_variation = request.POST.get('new_variation') == 'on'
+        if request.POST.get('grid') == '1':
+            # Several languages x tones in one request, for side-by-side comparison
+            languages = [lang for lang in request.POST.getlist('grid_languages') if lang in CAPTION_LANGUAGES] or [language]
+            try:
+                variants = int(request.POST.get('variants', 1))
+            except ValueError:
+                variants = 1
+            tones = CAPTION_TONES[:max(1, min(variants, len(CAPTION_TONES)))]
+            cells = generate_caption_grid(
+                request.user, profile, user_input, languages, tones, length, max_tokens, new_variation
             )
-            marketing_text = response.generations[0].text.strip()
-        except Exception as e:
-            marketing_text = f"❌ Error: {str(e)}"
-        
-        # Track text generation in user history
-        # Only save if not an error message
-        if marketing_text and not marketing_text.startswith("❌ Error:"):
-            UserHistory.objects.create(
-                user=request.user,
-                action_type='text_generation',
-                input_data={
-                    'user_input': user_input,
-                    'language': language,
-                    'length': length
-                },
-                output_data=marketing_text,
-                prompt_used=prompt
+            return JsonResponse({'success': True, 'languages': languages, 'tones': tones, 'grid': cells})
+
+        if request.POST.get('stream') == '1':
+            # Tokens are forwarded as they arrive; history is written when the stream completes
+            response = StreamingHttpResponse(
+                stream_caption(request.user, profile, user_input, language, length, max_tokens, new_variation),
+                content_type='text/event-stream'
             )
+            # Ask proxies (nginx, Cloudflare) not to buffer the tokens
+            response['X-Accel-Buffering'] = 'no'
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        timer = StageTimer('text_generation', 'command')
+        history = None
+        try:
+            with timer:
+                with stage('prompt'):
+                    prompt = caption_prompt(profile, language, user_input)
+                params = {'max_tokens': max_tokens, 'temperature': 0.7}
+                cached_text = None if new_variation else get_cached_text('caption', prompt.text, 'command', params)
+                if cached_text:
+                    timer.cache_hit = True
+                    marketing_text = cached_text
+                else:
+                    try:
+                        cohere_client = get_cohere_client(os.getenv("COHERE_API_KEY"))
+                        with stage('generate'):
+                            response = limited_call(
+                                'cohere',
+                                'command',
+                                cohere_client.generate,
+                                model="command",
+                                prompt=prompt.text,
+                                **params
+                            )
+                        marketing_text = response.generations[0].text.strip()
+                        set_cached_text('caption', prompt.text, 'command', marketing_text, params)
+                    except Exception as e:
+                        timer.fail(e)
+                        marketing_text = f"❌ Error: {str(e)}"
+                record_bytes('prompt', len(prompt.text.encode()))
+                record_bytes('response', len(marketing_text.encode()))
+
+                # Track text generation in user history
+                # Only save if not an error message
+                if marketing_text and not marketing_text.startswith("❌ Error:"):
+                    with stage('db_write'):
+                        history = UserHistory.objects.create(
+                            user=request.user,
+                            action_type='text_generation',
+                            input_data={
+                                'user_input': user_input,
+                                'language': language,
+                                'length': length
+                            },
+                            output_data=marketing_text,
+                            **prompt.history_fields()
+                        )
+        finally:
+            timer.save(request.user, history)
         
         # Check if this is an AJAX request
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -460,9 +386,219 @@ Instructions: Use at least 4 relevant emojis. Output only the caption text."""
     return render(request, 'core/ai_suggestions.html', {
         'marketing_text': marketing_text,
         'profile': profile,
-        'previous_searches': previous_searches
+        'previous_searches': previous_searches,
+        'caption_languages': CAPTION_LANGUAGES,
+        'caption_tones': CAPTION_TONES,
     })
 
+CAPTION_LANGUAGES = ["English", "Kannada", "Hindi"]
+# The first tone is the one single captions use
+CAPTION_TONES = ["funny and engaging", "warm and friendly", "bold and urgent"]
+
+
+def caption_prompt(profile, language, user_input, tone=CAPTION_TONES[0]):
+    """Render the caption prompt for the user's business"""
+    return render_prompt(
+        'caption',
+        business_name=profile.business_name,
+        description=profile.description,
+        location=profile_fragments(profile)['short_location'] or "your area",
+        language=language,
+        user_input=user_input,
+        tone=tone
+    )
+
+
+def _caption_cell_task(client, prompt, max_tokens):
+    try:
+        response = limited_call(
+            'cohere',
+            'command',
+            client.generate,
+            model="command",
+            prompt=prompt.text,
+            max_tokens=max_tokens,
+            temperature=0.7
+        )
+        return response.generations[0].text.strip()
+    finally:
+        # The rate limiter's state is read through the database cache from this thread
+        connections.close_all()
+
+
+def generate_caption_grid(user, profile, user_input, languages, tones, length, max_tokens, new_variation=False):
+    """
+    Generate one caption per language and tone, with at most
+    CAPTION_GRID_MAX_WORKERS provider calls in flight, and record the
+    successful ones with a single bulk_create. Cells already in the text
+    cache are not sent to the provider unless new_variation is set.
+
+    Returns:
+        list: One dict per cell - language, tone, and text or error
+    """
+    timer = StageTimer('text_generation', 'command')
+    history = []
+    try:
+        with timer:
+            with stage('prompt'):
+                cells = [
+                    {'language': language, 'tone': tone, 'prompt': caption_prompt(profile, language, user_input, tone)}
+                    for language in languages for tone in tones
+                ]
+            params = {'max_tokens': max_tokens, 'temperature': 0.7}
+            pending = []
+            for cell in cells:
+                cached_text = None if new_variation else get_cached_text('caption', cell['prompt'].text, 'command', params)
+                if cached_text:
+                    cell['text'] = cached_text
+                else:
+                    pending.append(cell)
+            timer.cache_hit = not pending
+            if pending:
+                client = get_cohere_client(os.getenv("COHERE_API_KEY"))
+                with stage('generate'), ThreadPoolExecutor(max_workers=min(settings.CAPTION_GRID_MAX_WORKERS, len(pending))) as executor:
+                    futures = [executor.submit(_caption_cell_task, client, cell['prompt'], max_tokens) for cell in pending]
+                    for cell, future in zip(pending, futures):
+                        try:
+                            cell['text'] = future.result()
+                            set_cached_text('caption', cell['prompt'].text, 'command', cell['text'], params)
+                        except Exception as e:
+                            print(f"DEBUG: Caption {cell['language']}/{cell['tone']} failed: {e}")
+                            cell['error'] = f"❌ Error: {str(e)}"
+            if all('error' in cell for cell in cells):
+                timer.fail(cells[0]['error'])
+            record_bytes('response', sum(len(cell.get('text', '').encode()) for cell in cells))
+
+            rows = [
+                UserHistory(
+                    user=user,
+                    action_type='text_generation',
+                    input_data={
+                        'user_input': user_input,
+                        'language': cell['language'],
+                        'length': length,
+                        'tone': cell['tone'],
+                        'grid_size': len(cells)
+                    },
+                    output_data=cell['text'],
+                    **cell['prompt'].history_fields()
+                )
+                for cell in cells if cell.get('text')
+            ]
+            if rows:
+                with stage('db_write'):
+                    history = UserHistory.objects.bulk_create(rows)
+                # bulk_create sends no post_save
+                invalidate_chat_context(user.pk)
+    finally:
+        # One timing row for the whole grid, linked to its first caption
+        timer.save(user, history[0] if history and history[0].pk else None)
+    return [{key: value for key, value in cell.items() if key != 'prompt'} for cell in cells]
+
+
+def stream_caption(user, profile, user_input, language, length, max_tokens, new_variation=False):
+    """
+    Generate a caption with Cohere's streaming chat API as Server-Sent Events:
+    a `token` event per text delta, then `done` with the full caption (after
+    the UserHistory row is written) or `error`. A cached caption is sent as a
+    single `token` event.
+    """
+    model = settings.CAPTION_STREAM_MODEL
+    timer = StageTimer('text_generation', model)
+    params = {'max_tokens': max_tokens, 'temperature': 0.7}
+    # The timer is only current between yields: under ASGI each chunk of a streaming response
+    # can be produced in a different context, so a ContextVar set before a yield cannot be
+    # reset after it. Hence start()/stop() around every step instead of one `with timer:`.
+    history = None
+    events = None
+    try:
+        timer.start()
+        try:
+            with stage('prompt'):
+                prompt = caption_prompt(profile, language, user_input)
+            record_bytes('prompt', len(prompt.text.encode()))
+            cached_text = None if new_variation else get_cached_text('caption', prompt.text, model, params)
+        finally:
+            timer.stop()
+
+        parts = []
+        if cached_text:
+            timer.cache_hit = True
+            parts.append(cached_text)
+            yield _sse_event('token', {'text': cached_text})
+        else:
+            try:
+                client = get_cohere_chat_client(os.getenv("COHERE_API_KEY"))
+                started = time.monotonic()
+                events = limited_stream(
+                    'cohere',
+                    model,
+                    client.chat_stream,
+                    model=model,
+                    messages=[{'role': 'user', 'content': prompt.text}],
+                    max_tokens=max_tokens,
+                    temperature=0.7
+                )
+                while True:
+                    # Waiting for a limiter slot happens inside next() and is timed as a stage
+                    timer.start()
+                    try:
+                        event = next(events, None)
+                    finally:
+                        timer.stop()
+                    if event is None:
+                        break
+                    if getattr(event, 'type', None) != 'content-delta':
+                        continue
+                    text = event.delta.message.content.text or ''
+                    if not parts:
+                        timer.add('first_token', time.monotonic() - started)
+                    parts.append(text)
+                    yield _sse_event('token', {'text': text})
+                timer.add('generate', time.monotonic() - started)
+            except Exception as e:
+                timer.fail(e)
+                print(f"DEBUG: Caption stream failed: {e}")
+                yield _sse_event('error', {'error': f"❌ Error: {str(e)}"})
+                return
+
+        marketing_text = "".join(parts).strip()
+        timer.start()
+        try:
+            record_bytes('response', len(marketing_text.encode()))
+            if not cached_text:
+                set_cached_text('caption', prompt.text, model, marketing_text, params)
+            if marketing_text:
+                with stage('db_write'):
+                    history = UserHistory.objects.create(
+                        user=user,
+                        action_type='text_generation',
+                        input_data={
+                            'user_input': user_input,
+                            'language': language,
+                            'length': length,
+                            'streamed': True
+                        },
+                        output_data=marketing_text,
+                        **prompt.history_fields()
+                    )
+        finally:
+            timer.stop()
+        yield _sse_event('done', {'marketing_text': marketing_text})
+    except GeneratorExit:
+        # The browser closed the stream
+        timer.fail("Client disconnected", outcome='cancelled')
+        raise
+    except Exception as e:
+        timer.fail(e)
+        raise
+    finally:
+        if events is not None:
+            # Frees the provider slot right away when the stream was abandoned
+            events.close()
+        timer.save(user, history)
+
+
 @login_required
 def feedback_view(request):
     return render(request, "core/feedback.html")
@@ -470,7 +606,7 @@ def feedback_view(request):
 @login_required
 def user_history_view(request):
     """View for displaying user's complete activity history"""
-    user_history = UserHistory.objects.filter(user=request.user)
+    user_history = UserHistory.objects.filter(user=request.user).select_related('poster')
     
     # Filter by action type if requested
     action_type = request.GET.get('action_type')
@@ -601,7 +737,7 @@ def profile_view(request):
     recent_searches = search_history[:5]  # Last 5 searches
     
     # Get user's poster generation statistics
-    poster_generations = PosterGeneration.objects.filter(user=request.user)
+    poster_generations = PosterGeneration.objects.filter(user=request.user, is_draft=False)
     total_posters = poster_generations.count()
     recent_posters = poster_generations[:5]  # Last 5 posters
     
@@ -625,8 +761,8 @@ def profile_view(request):
 @login_required
 def poster_generator_view(request):
     """
-    Handles poster generation using Gemini 3 Pro Image (Nano Banana).
-    This model has better text rendering and emotional understanding than Imagen.
+    Queues poster generation for the run_generation_worker command.
+    The page polls generation_job_status_view with the returned job id.
     """
     try:
         profile = BusinessProfile.objects.get(user=request.user)
@@ -637,239 +773,373 @@ def poster_generator_view(request):
     poster_url = None
     
     # Always load the most recent poster for this user (in case of timeout/broken pipe)
-    latest_poster = PosterGeneration.objects.filter(user=request.user).order_by('-id').first()
+    latest_poster = PosterGeneration.objects.filter(user=request.user, is_draft=False).order_by('-id').first()
     if latest_poster:
         poster_url = latest_poster.poster_url
         print(f"DEBUG: Loaded latest poster from DB: {poster_url}")
 
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
     if request.method == 'POST':
         promotion_name = request.POST.get("promotion_name", "").strip()
         offer_type = request.POST.get("offer_type")
         custom_offer = request.POST.get("custom_offer")
         language = request.POST.get("language")
-        model_selection = request.POST.get("model_selection", "imagen-4.0-ultra-generate-preview-06-06").strip()
+        # 'auto' lets the router pick a model from current load; anything else is pinned
+        model_selection = request.POST.get("model_selection", AUTO_MODEL).strip() or AUTO_MODEL
+        if model_selection not in POSTER_MODELS:
+            model_selection = AUTO_MODEL
         
         # Check if model requires API key (Gemini models)
         if "gemini" in model_selection.lower():
             if not settings.GOOGLE_API_KEY:
-                messages.error(request, "Gemini models require GOOGLE_API_KEY. Please configure it in your .env file or use Imagen models.")
+                error = "Gemini models require GOOGLE_API_KEY. Please configure it in your .env file or use Imagen models."
+                if is_ajax:
+                    return JsonResponse({'success': False, 'error': error})
+                messages.error(request, error)
                 return redirect('dashboard')
 
         if not promotion_name:
+            if is_ajax:
+                return JsonResponse({'success': False, 'error': "Please provide a promotion name."})
             messages.error(request, "Please provide a promotion name.")
         else:
             final_offer = custom_offer if offer_type == "Other" else offer_type
-            
-            # Extract key business details for marketing
-            business_name = profile.business_name
-            business_type = profile.description.split('.')[0] if profile.description else "Business"
-            
-            # Build location string from detailed fields
-            location_parts = []
-            if profile.town:
-                location_parts.append(profile.town)
-            if profile.district:
-                location_parts.append(profile.district)
-            if profile.state:
-                location_parts.append(profile.state)
-            if profile.country:
-                location_parts.append(profile.country)
-            location = ", ".join(location_parts) if location_parts else "Your Location"
-            
-            # Add detailed address if available
-            if profile.address:
-                location = f"{profile.address}, {location}"
-            
-            phone = profile.phone if profile.phone else "Your Phone"
-            
-            # Format business hours
-            if profile.business_hours_start and profile.business_hours_end:
-                timing = f"{profile.business_hours_start.strftime('%I:%M %p')} - {profile.business_hours_end.strftime('%I:%M %p')}"
-            else:
-                timing = "9:00 AM - 8:00 PM"
-            
-            prompt_text = f"""
-You are a creative director. Include emotional, atmospheric, and cultural details relevant to the promotion theme (e.g., festivals, seasons, etc). Keep the business details exact, but describe the visuals vividly.
-Create a professional and eye-catching marketing poster for the business "{business_name}" to boost customer engagement and promote its latest offer.
-
-BUSINESS INFO:
-- Business Name: {business_name}
-- Business Type: {business_type}
-- Location: {location}
-- Phone: {phone}
-- Timing: {timing}
-
-PROMOTION:
-- Promotion Name: {promotion_name}
-- Main Offer: {final_offer}
-- Language: {language}
-
-DESIGN GUIDELINES:
-- Format optimized for Instagram and WhatsApp sharing
-- Display the business name clearly at the top
-- **MANDATORY: Include 2-3 keywords or service names related to {business_type} (e.g., "Hair • Makeup • Spa" or "Bridal Services • Facials • Styling") prominently on the poster**
-- Highlight the promotion name and main offer with bold and attractive fonts
-- Use colors and typography that match the business theme
-- **CRITICAL: Use ONLY cartoon/animated/illustrated style visuals. DO NOT generate realistic human photographs or images.**
-- Include relevant cartoon/animated visuals or illustrations:
-  - If {business_type} is "salon" or "beauty parlour", use cartoon/animated illustrations of beauty tools, cosmetics, or stylized beauty elements (combs, scissors, lipstick, mirrors, etc.)
-  - Otherwise, use cartoon/animated icons/illustrations that match the business type (e.g., cartoon tools, tech icons, food illustrations)
-  - **Absolutely NO realistic human faces or photographs - only cartoon/animated style**
-- Keep the layout clean and easy to read on mobile
-- Add marketing elements like badges, stickers, or call-to-action text (e.g., "Call Now", "Limited Offer", "Visit Today")
-- Ensure the design remains professional, family-friendly, and suitable for public social media marketing.
-
-POSTER GOAL:
-- Should look modern, polished, and shareable
-- Designed to attract attention and drive real engagement on social media
-- Must clearly communicate what services the business provides through keywords
-- Encourage viewers to contact the business via phone for more details
-- Evoke a sense of excitement and urgency around the promotion
-- Incorporate cultural or festive elements if relevant to the promotion timing
-"""
-
-
-
-
-            
-            print(prompt_text)
+            # Reject or rewrite text the provider's safety filter would block, before paying for the call
+            preflight = preflight_check('poster', {'promotion_name': promotion_name, 'offer_type': final_offer or ''})
+            if not preflight['success']:
+                if is_ajax:
+                    return JsonResponse({'success': False, 'error': preflight['error']})
+                messages.error(request, preflight['error'])
+                return redirect('generate_poster')
+            promotion_name = preflight['fields']['promotion_name']
+            final_offer = preflight['fields']['offer_type']
+            input_data = {
+                'promotion_name': promotion_name,
+                'offer_type': final_offer,
+                'language': language,
+                'model': model_selection,
+                'regenerate': request.POST.get('regenerate') == 'on',
+            }
+            layout = request.POST.get('layout', '')
+            if layout in LAYOUT_TEMPLATES:
+                input_data['layout'] = layout
+            elif request.POST.get('logo_position') in LOGO_POSITIONS:
+                # Layouts place the logo themselves; AI-drawn posters get it overlaid
+                input_data['logo_position'] = request.POST['logo_position']
             try:
-                print(f"DEBUG: About to generate image with model: {model_selection}")
-                
-                # Route to appropriate generation function based on model selection
-                pil_image = None
-                
-                if "gemini" in model_selection.lower():
-                    # Use Gemini 3 Pro Image (Nano Banana) for better text rendering
-                    print(f"DEBUG: Using Gemini 3 Pro Image API")
-                    pil_image = generate_poster_gemini_3(prompt_text)
-                else:
-                    # Use Vertex AI Imagen models (free with credits)
-                    print(f"DEBUG: Using Vertex AI Imagen: {model_selection}")
-                    if not imagen_model_preview:
-                        messages.error(request, "Imagen models are not initialized. Please check your Google credentials.")
-                        return redirect('generate_poster')
-                    
-                    # Reinitialize with selected model
-                    try:
-                        imagen_model = ImageGenerationModel.from_pretrained(model_selection)
-                        response = imagen_model.generate_images(
-                            prompt=prompt_text,
-                            number_of_images=1,
-                            aspect_ratio="1:1",
-                            safety_filter_level="block_some",
-                            person_generation="allow_all"
-                        )
-                        # ImageGenerationResponse has .images attribute
-                        if response and hasattr(response, 'images') and len(response.images) > 0:
-                            # Convert Imagen response to PIL Image
-                            image_bytes = response.images[0]._image_bytes
-                            pil_image = Image.open(BytesIO(image_bytes))
-                            print(f"DEBUG: Successfully generated image with Imagen: {model_selection}")
-                        else:
-                            print(f"DEBUG: Imagen returned no images (may be blocked by safety filters)")
-                            messages.warning(request, "Image could not be generated. It may have been blocked by safety filters. Try rephrasing your promotion.")
-                    except Exception as img_error:
-                        print(f"DEBUG: Imagen generation error: {img_error}")
-                        print(f"DEBUG: Full error traceback: {traceback.format_exc()}")
-                        messages.error(request, f"Image generation failed with selected model. Please try a different model or contact support.")
-                        return redirect('generate_poster')
-                
-                if pil_image:
-                    print(f"DEBUG: Successfully generated PIL Image")
-                    
-                    # Convert PIL Image to bytes
-                    img_byte_arr = BytesIO()
-                    pil_image.save(img_byte_arr, format='PNG')
-                    image_bytes = img_byte_arr.getvalue()
-                    
-                    # Save the image locally
-                    filename = f"{uuid.uuid4()}.png"
-                    save_path = os.path.join(settings.MEDIA_ROOT, filename)
-                    print(f"DEBUG: Attempting to save to: {save_path}")
-                    
-                    # Save the image bytes
-                    with open(save_path, 'wb') as f:
-                        f.write(image_bytes)
-                    
-                    print(f"DEBUG: Image saved successfully")
-
-                    # Upload to Cloudinary
-                    print("DEBUG: Uploading to Cloudinary...")
-                    cloudinary_result = upload_image_to_cloudinary(
-                        image_bytes,
-                        folder="posters",
-                        public_id=f"poster_{request.user.username}_{uuid.uuid4().hex[:8]}"
-                    )
-                    
-                    if cloudinary_result['success']:
-                        poster_url = cloudinary_result['url']
-                        print(f"DEBUG: Cloudinary URL = {poster_url}")
-                        
-                        # Track poster generation
-                        PosterGeneration.objects.create(
-                            user=request.user,
-                            promotion_name=promotion_name,
-                            offer_type=final_offer,
-                            poster_url=poster_url
-                        )
-                        
-                        # Track in user history
-                        UserHistory.objects.create(
-                            user=request.user,
-                            action_type='poster_generation',
-                            input_data={
-                                'promotion_name': promotion_name,
-                                'offer_type': final_offer,
-                                'language': language,
-                                'model': model_selection,
-                                'business_name': business_name,
-                                'location': location,
-                                'phone': phone,
-                                'timing': timing
-                            },
-                            output_data=poster_url,
-                            prompt_used=prompt_text
-                        )
-                        
-                        print(f"DEBUG: About to return response with poster_url = {poster_url}")
-                        messages.success(request, "🎉 Poster generated successfully! Check below.")
-                    else:
-                        print(f"DEBUG: Cloudinary upload failed: {cloudinary_result['error']}")
-                        # Fallback to local storage
-                        poster_url = settings.MEDIA_URL + filename
-                        PosterGeneration.objects.create(
-                            user=request.user,
-                            promotion_name=promotion_name,
-                            offer_type=final_offer,
-                            poster_url=poster_url
-                        )
-                        messages.warning(request, "Poster generated but Cloudinary upload failed. Using local storage.")
-                else:
-                    print(f"DEBUG: Gemini 3 Pro Image failed to generate an image")
-                    messages.warning(request, "Image could not be generated (it may have been blocked by safety filters).")
-
-            except google.api_core.exceptions.ResourceExhausted as e:
-                # You will STILL get this error if you make requests too quickly.
-                messages.error(request, "🚦 Too many requests! Please wait a minute and try again.")
-                print(f"Quota Error: {e}")
-            except Exception as e:
-                messages.error(request, f"An unexpected error occurred: {e}")
-                print(f"General Error: {e}")
-                import traceback
-                print(f"DEBUG: Full traceback: {traceback.format_exc()}")
+                variants = int(request.POST.get('variants', 1))
+            except ValueError:
+                variants = 1
+            if 'layout' not in input_data and variants > 1:
+                # Several candidates from one provider call; the user picks one afterwards
+                input_data['variants'] = min(variants, settings.POSTER_MAX_VARIANTS)
+            elif 'layout' not in input_data and request.POST.get('progressive') == 'on':
+                # Quick draft from the fast model, full quality rendered in the background
+                input_data['progressive'] = True
+
+            # Identical prompt + model (or a cached background for crisp-text posters): answer right away
+            job = serve_cached_poster(request.user, input_data)
+            if job is None:
+                job = enqueue_generation_job(request.user, 'poster_generation', input_data)
+                print(f"DEBUG: Queued poster job #{job.pk} ({job.status})")
+
+            if is_ajax:
+                return JsonResponse({
+                    'success': True,
+                    'job_id': job.pk,
+                    'status': job.status,
+                    'status_url': reverse('generation_job_status', args=[job.pk]),
+                    'events_url': job_events_url(job),
+                })
+            if job.status == 'done':
+                messages.success(request, "🎉 Poster generated successfully! Check below.")
+            else:
+                messages.info(request, "🎨 Your poster is being generated. It will appear here when ready.")
         
         # Redirect after POST to prevent resubmission on refresh
         return redirect('generate_poster')
 
+    # Resume polling for a job still in flight (e.g. after a page refresh)
+    pending_job = GenerationJob.objects.filter(
+        user=request.user,
+        job_type__in=['poster_generation', 'poster_edit', 'poster_variant'],
+        status__in=['queued', 'running']
+    ).first()
+
+    # Full-quality render still being made for a quick draft
+    upgrade_job = None
+    if latest_poster and latest_poster.upgrade_status == 'pending':
+        upgrade_job = GenerationJob.objects.filter(
+            user=request.user,
+            job_type='poster_upgrade',
+            status__in=['queued', 'running'],
+            input_data__poster_id=latest_poster.pk
+        ).first()
+
     context = {
         'profile': profile,
         'poster_url': poster_url,
+        'latest_poster': latest_poster,
+        'upgrade_job': upgrade_job,
+        'can_edit': bool(settings.GOOGLE_API_KEY),
+        'variant_counts': range(1, settings.POSTER_MAX_VARIANTS + 1),
+        'pending_job': pending_job,
+        'job_events': settings.GENERATION_EVENTS_ENABLED,
+        'layouts': list(LAYOUT_TEMPLATES),
+        'logo_positions': [(position, position.replace('-', ' ').capitalize()) for position in LOGO_POSITIONS],
         'MEDIA_URL': settings.MEDIA_URL,
     }
     return render(request, "core/generate_poster.html", context)
 
 
+@login_required
+@require_POST
+def choose_poster_variant_view(request, poster_id):
+    """Queue making the chosen variant of a variants request the user's poster"""
+    poster = get_object_or_404(PosterGeneration, pk=poster_id, user=request.user)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    variant = request.POST.get('variant', '')
+    if variant not in dict(poster.variants):
+        error = "That variant does not exist for this poster."
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': error}, status=400)
+        messages.error(request, error)
+        return redirect('generate_poster')
+
+    # Downloading the variant and uploading its renditions happen in the worker
+    job = enqueue_generation_job(request.user, 'poster_variant', {'poster_id': poster.pk, 'variant': variant})
+    print(f"DEBUG: Queued variant job #{job.pk} for poster #{poster.pk} ({job.status})")
+    if is_ajax:
+        return JsonResponse({
+            'success': True,
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': reverse('generation_job_status', args=[job.pk]),
+            'events_url': job_events_url(job),
+        })
+    if job.status == 'done':
+        messages.success(request, "✅ Great pick! That design is now your poster.")
+    else:
+        messages.info(request, "✅ Great pick! Your poster will switch to that design in a moment.")
+    return redirect('generate_poster')
+
+
+@login_required
+@require_POST
+def cancel_poster_upgrade_view(request, poster_id):
+    """Keep a quick draft and skip its full-quality render"""
+    poster = get_object_or_404(PosterGeneration, pk=poster_id, user=request.user)
+    cancelled = cancel_poster_upgrade(poster)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': cancelled, 'upgrade_status': PosterGeneration.objects.get(pk=poster.pk).upgrade_status})
+    if cancelled:
+        messages.info(request, "👍 Keeping your draft. The full-quality version was cancelled.")
+    else:
+        messages.info(request, "The full-quality version has already finished.")
+    return redirect('generate_poster')
+
+
+@login_required
+@require_POST
+def edit_poster_view(request, poster_id):
+    """
+    Queue an edit of one of the user's posters: the image and a short change
+    instruction go to Gemini instead of regenerating from the full prompt.
+    """
+    poster = get_object_or_404(PosterGeneration, pk=poster_id, user=request.user)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    instruction = request.POST.get('instruction', '').strip()
+
+    error = None
+    if not settings.GOOGLE_API_KEY:
+        error = "Editing posters needs Gemini. Please configure GOOGLE_API_KEY or generate a new poster."
+    elif not instruction:
+        error = "Please describe what to change."
+    elif len(instruction) > 500:
+        error = "Please keep the change under 500 characters."
+    else:
+        preflight = preflight_check('poster_edit', {'instruction': instruction})
+        instruction = preflight['fields']['instruction']
+        error = preflight.get('error')
+    if error:
+        if is_ajax:
+            return JsonResponse({'success': False, 'error': error})
+        messages.error(request, error)
+        return redirect('generate_poster')
+
+    job = enqueue_generation_job(request.user, 'poster_edit', {'parent_id': poster.pk, 'instruction': instruction})
+    print(f"DEBUG: Queued poster edit job #{job.pk} for poster #{poster.pk} ({job.status})")
+    if is_ajax:
+        return JsonResponse({
+            'success': True,
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': reverse('generation_job_status', args=[job.pk]),
+            'events_url': job_events_url(job),
+        })
+    messages.info(request, "✏️ Your edit is being applied. The new poster will appear here when ready.")
+    return redirect('generate_poster')
+
+
+@login_required
+def festival_poster_view(request, poster_id):
+    """Show a pre-generated festival poster; POST keeps it in the user's posters and history"""
+    poster = get_object_or_404(
+        PosterGeneration.objects.select_related('festival'),
+        pk=poster_id,
+        user=request.user,
+        festival__isnull=False
+    )
+
+    if request.method == 'POST' and poster.is_draft:
+        with transaction.atomic():
+            poster.is_draft = False
+            poster.save(update_fields=['is_draft'])
+            UserHistory.objects.create(
+                user=request.user,
+                action_type='poster_generation',
+                input_data={
+                    'promotion_name': poster.promotion_name,
+                    'offer_type': poster.offer_type,
+                    'festival': poster.festival.name,
+                    'pregenerated': True,
+                },
+                output_data=poster.poster_url,
+                poster=poster
+            )
+        messages.success(request, f"🎉 Your {poster.festival.name} poster has been added to your posters!")
+        return redirect('festival_poster', poster_id=poster.pk)
+
+    return render(request, 'core/festival_poster.html', {'poster': poster})
+
+
+@login_required
+def bulk_poster_view(request):
+    """
+    Generate posters for a whole CSV of promotions at once.
+    The rows become one poster_bulk job for the generation worker; the page
+    polls the job's status URL, whose progress lists each finished row.
+    """
+    try:
+        profile = BusinessProfile.objects.get(user=request.user)
+    except BusinessProfile.DoesNotExist:
+        messages.error(request, "You must create a business profile first.")
+        return redirect('dashboard')
+
+    if request.method == 'POST':
+        csv_file = request.FILES.get('csv_file')
+        if not csv_file:
+            return JsonResponse({'success': False, 'errors': ["Please upload a CSV file."]})
+
+        rows, errors = parse_bulk_poster_csv(csv_file, settings.BULK_POSTER_MAX_ROWS)
+        if not rows:
+            return JsonResponse({'success': False, 'errors': errors or ["The CSV file has no promotions."]})
+
+        job = enqueue_generation_job(request.user, 'poster_bulk', {'rows': rows})
+        return JsonResponse({
+            'success': True,
+            'job_id': job.pk,
+            'status': job.status,
+            'status_url': reverse('generation_job_status', args=[job.pk]),
+            'total': len(rows),
+            'errors': errors,
+        })
+
+    return render(request, 'core/bulk_posters.html', {
+        'profile': profile,
+        'max_rows': settings.BULK_POSTER_MAX_ROWS,
+        'models': POSTER_MODELS,
+        'languages': POSTER_LANGUAGES,
+    })
+
+
+@login_required
+def generation_job_status_view(request, job_id):
+    """Return the status of one of the user's generation jobs as JSON for polling"""
+    job = GenerationJob.objects.filter(pk=job_id, user=request.user).first()
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'Job not found.'}, status=404)
+
+    return JsonResponse({
+        'success': True,
+        'job_id': job.pk,
+        'status': job.status,
+        'stage': job.stage,
+        'result_url': job.result_url,
+        'error': job.error,
+        'progress': job.progress,
+    })
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def job_events_url(job):
+    """The job's event stream URL, or None when pages should poll the status endpoint instead"""
+    if not settings.GENERATION_EVENTS_ENABLED:
+        return None
+    return reverse('generation_job_events', args=[job.pk])
+
+
+@login_required
+def generation_job_events_view(request, job_id):
+    """
+    Server-Sent Events stream of a generation job: a `stage` event on every
+    progress change, then one `done` (with result_url), `failed` or
+    `cancelled` event.
+
+    Each open stream holds a server worker, so streams are off unless
+    GENERATION_EVENTS_ENABLED (async/gevent workers only), and are closed
+    after GENERATION_EVENTS_TIMEOUT seconds; EventSource reconnects by itself
+    and picks up the current state.
+    """
+    if not settings.GENERATION_EVENTS_ENABLED:
+        return JsonResponse({'success': False, 'error': 'Event streams are disabled; poll the status endpoint.'}, status=404)
+    if not GenerationJob.objects.filter(pk=job_id, user=request.user).exists():
+        return JsonResponse({'success': False, 'error': 'Job not found.'}, status=404)
+
+    def stream():
+        poll_interval = settings.GENERATION_EVENTS_POLL_INTERVAL
+        yield f"retry: {int(poll_interval * 1000)}\n\n"
+        deadline = time.monotonic() + settings.GENERATION_EVENTS_TIMEOUT
+        last_sent = time.monotonic()
+        last_state = None
+        while True:
+            job = GenerationJob.objects.filter(pk=job_id).values('status', 'stage', 'result_url', 'error').first()
+            if job is None:
+                yield _sse_event('failed', {'job_id': job_id, 'error': 'Job not found.'})
+                return
+            state = (job['status'], job['stage'])
+            if state != last_state:
+                last_state = state
+                last_sent = time.monotonic()
+                yield _sse_event('stage', {'job_id': job_id, 'status': job['status'], 'stage': job['stage']})
+            if job['status'] == 'done':
+                yield _sse_event('done', {'job_id': job_id, 'result_url': job['result_url']})
+                return
+            if job['status'] == 'failed':
+                yield _sse_event('failed', {'job_id': job_id, 'error': job['error']})
+                return
+            if job['status'] == 'cancelled':
+                yield _sse_event('cancelled', {'job_id': job_id})
+                return
+            if time.monotonic() >= deadline:
+                return
+            if time.monotonic() - last_sent >= 15:
+                # Comment line so idle proxies keep the connection open
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(poll_interval)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    # Ask proxies (nginx, Cloudflare) not to buffer the events
+    response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @login_required
 def insights_view(request):
     from datetime import timedelta
@@ -1050,6 +1320,66 @@ def email_templates_view(request):
     
     return render(request, 'core/email_templates.html')
 
+@login_required
+def ai_clients_status_view(request):
+    """Staff-only JSON listing the warm AI provider clients in this worker process"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only.'}, status=403)
+
+    return JsonResponse({
+        'success': True,
+        'pid': os.getpid(),
+        'clients': client_status(),
+    })
+
+@login_required
+def generation_stats_view(request):
+    """Staff-only JSON with cache hit rates, provider latency, hedging counts, rate limiter, router and preflight state"""
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Staff only.'}, status=403)
+
+    return JsonResponse({
+        'success': True,
+        'poster_cache': cache_stats('poster_cache'),
+        'text_cache': text_cache_stats(),
+        'chat_context': cache_stats('chat_context'),
+        'provider_latency': {
+            provider: latency_stats(f"provider:{provider}") for provider in ('gemini', 'imagen')
+        },
+        'hedging': {
+            'enabled': settings.POSTER_HEDGING,
+            'fired': get_counter('hedge:fired'),
+            'won': get_counter('hedge:won'),
+        },
+        'provider_limits': limiter_stats(),
+        'model_router': router_stats(),
+        'preflight': preflight_stats(),
+    })
+
+def chatbot_context(user):
+    """
+    Snapshot of the user's profile and activity for the chatbot prompt.
+
+    Returns:
+        dict: chatbot template variables (business_name ... caption_count)
+    """
+    profile = BusinessProfile.objects.filter(user=user).first()
+    fragments = profile_fragments(profile) if profile else {}
+    last_posters = PosterGeneration.objects.filter(user=user, is_draft=False).order_by('-id')[:3]
+    poster_list = [f"{poster.promotion_name} ({poster.offer_type})" for poster in last_posters]
+    return {
+        'business_name': profile.business_name if profile and profile.business_name else "(not set)",
+        'description': profile.description if profile and profile.description else "(not set)",
+        'full_location': fragments.get('full_location') or "(not set)",
+        'address': profile.address if profile and profile.address else "(not set)",
+        'phone': profile.phone if profile and profile.phone else "(not set)",
+        'timing': fragments.get('timing') or "(not set)",
+        'email': user.email or "(not set)",
+        'recent_posters': ", ".join(poster_list) if poster_list else "No posters generated yet.",
+        'caption_count': UserHistory.objects.filter(user=user, action_type='text_generation').count(),
+    }
+
+
 @login_required
 @csrf_exempt
 def chatbot_view(request):
@@ -1060,42 +1390,15 @@ def chatbot_view(request):
         if not user_message:
             return JsonResponse({'success': False, 'error': 'Empty message.'})
 
-        # --- Fetch user business profile and recent activity ---
-        profile = BusinessProfile.objects.filter(user=request.user).first()
-        business_name = profile.business_name if profile and profile.business_name else "(not set)"
-        description = profile.description if profile and profile.description else "(not set)"
-        
-        # Location details
-        country = profile.country if profile and profile.country else "(not set)"
-        state = profile.state if profile and profile.state else "(not set)"
-        district = profile.district if profile and profile.district else "(not set)"
-        town = profile.town if profile and profile.town else "(not set)"
-        address = profile.address if profile and profile.address else "(not set)"
-        full_location = f"{town}, {district}, {state}, {country}" if all([town, district, state, country]) else "(not set)"
-        
-        phone = profile.phone if profile and profile.phone else "(not set)"
-        
-        # Business hours
-        if profile and profile.business_hours_start and profile.business_hours_end:
-            timing = f"{profile.business_hours_start.strftime('%I:%M %p')} - {profile.business_hours_end.strftime('%I:%M %p')}"
-        else:
-            timing = "(not set)"
-        
-        email = request.user.email if hasattr(request.user, 'email') else "(not set)"
-
-        # Recent posters
-        from core.models import PosterGeneration, UserHistory
-        last_posters = PosterGeneration.objects.filter(user=request.user).order_by('-id')[:3]
-        poster_list = []
-        for poster in last_posters:
-            poster_list.append(f"{poster.promotion_name} ({poster.offer_type})")
-        poster_str = ", ".join(poster_list) if poster_list else "No posters generated yet."
+        # --- Business profile and recent activity (cached until any of them changes) ---
+        context = get_chat_context(request.user.pk)
+        if context is None:
+            context = chatbot_context(request.user)
+            set_chat_context(request.user.pk, context)
 
-        # Caption count
-        caption_count = UserHistory.objects.filter(user=request.user, action_type='text_generation').count()
-
-        # --- Multi-turn context: Store and use last 10 turns ---
-        history = request.session.get('chat_history', [])
+        # --- Multi-turn context: recent turns from the conversation store (not the session) ---
+        thread = conversation_id(request.POST.get('conversation'))
+        history = get_history(request.user.pk, thread)
         history.append({'role': 'user', 'content': user_message})
 
         # Build page-specific context
@@ -1107,51 +1410,42 @@ def chatbot_view(request):
             else:
                 page_context += "\nThe user is currently on this page. Help them based on the page URL and context."
 
-        # --- Build rich system prompt ---
-        system_prompt = (
-            "You are ParlorPal’s AI assistant. Here is the user’s business profile and recent activity to help you answer their questions as a helpful, friendly, and knowledgeable assistant.\n"
-            f"Business Name: {business_name}\n"
-            f"Description: {description}\n"
-            f"Location: {full_location}\n" + f"Detailed Address: {address}\n"
-            f"Phone: {phone}\n"
-            f"Business Hours: {timing}\n"
-            f"Email: {email}\n"
-            f"Recent Posters: {poster_str}\n"
-            f"Captions Generated: {caption_count}\n"
-            f"{page_context}\n"
-            "Help the user with any questions about their business, marketing, or navigating ParlorPal.\n"
-            "If the user asks for captions, generate creative, engaging captions using their business info.\n"
-            "If the user asks about their business, use the profile info above.\n"
-            "If the user asks about navigation or what page they're on, use the CURRENT PAGE context above.\n"
-            "Always answer naturally and conversationally, as a real human assistant would.\n"
-        )
-        prompt_parts = [system_prompt]
-        for msg in history[-10:]:
+        # --- Build rich system prompt, followed by the conversation ---
+        conversation = [""]
+        for msg in history:
             prefix = "User:" if msg['role'] == 'user' else "Bot:"
-            prompt_parts.append(f"{prefix} {msg['content']}")
-        full_prompt = "\n".join(prompt_parts)
+            conversation.append(f"{prefix} {msg['content']}")
+        full_prompt = render_prompt(
+            'chatbot',
+            **context,
+            page_context=page_context,
+            conversation="\n".join(conversation)
+        ).text
 
         try:
-            from google import genai
-            from google.genai import types
-            import os
-            client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=full_prompt,
-                config=types.GenerateContentConfig(
-                    thinking_config=types.ThinkingConfig(thinking_budget=0)
+            # The prompt carries the profile, page and conversation, so only identical
+            # questions in identical context (typically FAQs opening a chat) hit
+            ai_reply = get_cached_text('chatbot', full_prompt, 'gemini-2.5-flash')
+            if not ai_reply:
+                client = get_genai_client(os.getenv('GEMINI_API_KEY'))
+                response = limited_call(
+                    'gemini',
+                    'gemini-2.5-flash',
+                    client.models.generate_content,
+                    model="gemini-2.5-flash",
+                    contents=full_prompt,
+                    config=types.GenerateContentConfig(
+                        thinking_config=types.ThinkingConfig(thinking_budget=0)
+                    )
                 )
-            )
-            ai_reply = response.text
-            history.append({'role': 'bot', 'content': ai_reply})
-            request.session['chat_history'] = history[-10:]
+                ai_reply = response.text
+                set_cached_text('chatbot', full_prompt, 'gemini-2.5-flash', ai_reply)
+            append_turns(request.user.pk, thread, [history[-1], {'role': 'bot', 'content': ai_reply}])
             return JsonResponse({'success': True, 'reply': ai_reply})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
     else:
-        # Optionally clear history on GET
-        request.session['chat_history'] = []
+        # The conversation carries on from the floating widget
         return render(request, 'core/chatbot.html', {'user': request.user})
 
 def email_subjects_view(request):
@@ -1168,28 +1462,33 @@ def email_subjects_view(request):
             offer = request.POST.get('offer', '').strip()
             audience = request.POST.get('audience', '').strip()
             tone = request.POST.get('tone', '').strip()
-            prompt = (
-                f"Suggest 5 engaging email subject lines for a business named '{business_name}'. "
-                f"Description: {description}. "
-                f"Offer: {offer}. "
-                f"Target audience: {audience}. "
-                f"Tone: {tone}. "
-                "Make them catchy, relevant, and suitable for a marketing campaign."
+            prompt = render_prompt(
+                'email_subjects',
+                business_name=business_name,
+                description=description,
+                offer=offer,
+                audience=audience,
+                tone=tone
             )
+            new_variation = request.POST.get('new_variation') == 'on'
             try:
-                from google import genai
-                from google.genai import types
-                import os
-                client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-                response = client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=prompt,
-                    config=types.GenerateContentConfig(
-                        thinking_config=types.ThinkingConfig(thinking_budget=0)
+                text = None if new_variation else get_cached_text('email_subjects', prompt.text, 'gemini-2.5-flash')
+                if not text:
+                    client = get_genai_client(os.getenv('GEMINI_API_KEY'))
+                    response = limited_call(
+                        'gemini',
+                        'gemini-2.5-flash',
+                        client.models.generate_content,
+                        model="gemini-2.5-flash",
+                        contents=prompt.text,
+                        config=types.GenerateContentConfig(
+                            thinking_config=types.ThinkingConfig(thinking_budget=0)
+                        )
                     )
-                )
+                    text = response.text
+                    set_cached_text('email_subjects', prompt.text, 'gemini-2.5-flash', text)
                 # Split lines if possible
-                lines = response.text.strip().split('\n')
+                lines = text.strip().split('\n')
                 subject_lines = [line for line in lines if line.strip()]
             except Exception as e:
                 error = str(e)
@@ -1200,16 +1499,14 @@ def email_subjects_view(request):
         })
     return inner(request)
 
+@login_required
 def generate_video_view(request):
-    import os
-    import time
-    import requests
-    from django.contrib.auth.decorators import login_required
-    from django.utils.decorators import method_decorator
-    from .models import BusinessProfile
-    from django.conf import settings
-    video_url = None
-    error = None
+    """
+    Queues Veo video generation for the run_generation_worker command.
+    The page polls generation_job_status_view (or follows
+    generation_job_events_view when event streams are enabled).
+    """
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     if request.method == 'POST':
         campaign_name = request.POST.get('campaign_name', '').strip()
         if campaign_name == 'Other':
@@ -1217,72 +1514,40 @@ def generate_video_view(request):
         theme = request.POST.get('theme', '').strip()
         if theme == 'Other':
             theme = request.POST.get('theme_custom', '').strip()
-        aspect_ratio = request.POST.get('aspect_ratio', '16:9')
-        script = request.POST.get('script', '').strip()
-        api_key = os.getenv('GOOGLE_VERTEX_API_KEY')
-        # Fetch business profile details
-        profile = BusinessProfile.objects.filter(user=request.user).first()
-        business_name = profile.business_name if profile and profile.business_name else ""
-        description = profile.description if profile and profile.description else ""
-        try:
-            from google import genai
-            from google.genai import types
-            client = genai.Client(api_key=api_key)
-            prompt = (
-                f"Generate a marketing video using the following details.\n"
-                f"Script: {script}\n"
-                f"Theme: {theme}\n"
-                f"Campaign Name: {campaign_name}\n"
-                f"\nUse the details below as reference only (do not include verbatim):\n"
-                f"Business Name: {business_name}\n"
-                f"Description: {description}"
-            )
-            operation = client.models.generate_videos(
-                model="veo-3.0-generate-preview",
-                prompt=prompt,
-                config=types.GenerateVideosConfig(
-                    person_generation="allow_all",
-                    aspect_ratio=aspect_ratio,
-                ),
-            )
-            # Wait for operation to complete (polling)
-            for _ in range(30):  # Wait up to 10 minutes (20s * 30)
-                if operation.done:
-                    break
-                time.sleep(20)
-                operation = client.operations.get(operation)
-            if operation.done and hasattr(operation.response, 'generated_videos') and operation.response.generated_videos:
-                generated_video = operation.response.generated_videos[0]
-                if hasattr(generated_video.video, 'uri'):
-                    video_uri = generated_video.video.uri
-                    # Download the video file and save to media/videos
-                    try:
-                        media_videos_path = os.path.join(settings.MEDIA_ROOT, 'videos')
-                        os.makedirs(media_videos_path, exist_ok=True)
-                        filename = f"video_{int(time.time())}.mp4"
-                        file_path = os.path.join(media_videos_path, filename)
-                        r = requests.get(video_uri, stream=True)
-                        if r.status_code == 200:
-                            with open(file_path, 'wb') as f:
-                                for chunk in r.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                            video_url = settings.MEDIA_URL + f"videos/{filename}"
-                        else:
-                            error = 'Failed to download generated video.'
-                            video_url = 'https://www.w3schools.com/html/mov_bbb.mp4'  # Fallback
-                    except Exception as e:
-                        error = f"Video download failed: {str(e)}"
-                        video_url = 'https://www.w3schools.com/html/mov_bbb.mp4'  # Fallback
-                else:
-                    video_url = 'https://www.w3schools.com/html/mov_bbb.mp4'  # Fallback
-            else:
-                error = 'Video generation did not complete successfully.'
-        except Exception as e:
-            error = f"Video generation failed: {str(e)}"
-            video_url = 'https://www.w3schools.com/html/mov_bbb.mp4'  # Fallback
+        preflight = preflight_check('video', {
+            'campaign_name': campaign_name,
+            'theme': theme,
+            'script': request.POST.get('script', '').strip(),
+        })
+        if not preflight['success']:
+            if is_ajax:
+                return JsonResponse({'success': False, 'error': preflight['error']})
+            messages.error(request, preflight['error'])
+            return redirect('generate_video')
+        job = enqueue_generation_job(request.user, 'video_generation', {
+            **preflight['fields'],
+            'aspect_ratio': request.POST.get('aspect_ratio', '16:9'),
+        })
+        print(f"DEBUG: Queued video job #{job.pk} ({job.status})")
+        if is_ajax:
+            return JsonResponse({
+                'success': True,
+                'job_id': job.pk,
+                'status': job.status,
+                'status_url': reverse('generation_job_status', args=[job.pk]),
+                'events_url': job_events_url(job),
+            })
+        # Redirect after POST to prevent resubmission on refresh
+        return redirect('generate_video')
+
+    video_jobs = GenerationJob.objects.filter(user=request.user, job_type='video_generation')
+    latest_job = video_jobs.filter(status__in=['done', 'failed']).first()
     return render(request, 'core/generate_video.html', {
-        'video_url': video_url,
-        'error': error
+        'video_url': latest_job.result_url if latest_job and latest_job.status == 'done' else None,
+        'error': latest_job.error if latest_job and latest_job.status == 'failed' else None,
+        # Resume following a job still in flight (e.g. after a page refresh)
+        'pending_job': video_jobs.filter(status__in=['queued', 'running']).first(),
+        'job_events': settings.GENERATION_EVENTS_ENABLED,
     })
 
 
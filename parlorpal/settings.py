@@ -14,6 +14,7 @@ from pathlib import Path
 # from decouple import config  # This import doesn't exist
 
 import os
+import json
 from dotenv import load_dotenv
 
 
@@ -219,3 +220,216 @@ DEFAULT_FROM_EMAIL = os.getenv('GMAIL_USER', 'your-gmail@gmail.com')  # Set in .
 
 # Site URL for email links
 SITE_URL = os.environ.get('SITE_URL', 'http://127.0.0.1:8000')  # Change to your domain in production
+
+# Generation job queue
+# Posters are queued as GenerationJob rows and processed by `python manage.py run_generation_worker`.
+# Set GENERATION_JOBS_INLINE=True to process jobs inside the web request (local development without a worker).
+GENERATION_JOBS_INLINE = os.environ.get('GENERATION_JOBS_INLINE', 'False') == 'True'
+
+# Cache
+# Shared by the web and worker processes, so it must not be per-process.
+# Uses Redis when REDIS_URL is set (requires the `redis` package), otherwise database tables
+# created with `python manage.py createcachetable`.
+#   default - results: posters, backgrounds, text replies and chat context
+#   stats   - latency windows for /generation-stats/ and the model router; never expires
+#   limits  - provider rate limiter state (Redis only; without it the limiter uses ProviderLimitState rows)
+#   chat    - chatbot conversation buffers (Redis only; without it they are ChatMessage rows)
+# Hit/miss counters use atomic Redis increments with Redis, otherwise StatCounter rows
+# (core/cache_utils.py). The database cache's incr() is a get-and-set that also resets
+# the expiry, so it is not used for anything that has to persist.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'stats': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'stats',
+            'TIMEOUT': None,
+        },
+        # Provider rate limiter state, updated with atomic scripts (core/rate_limit.py)
+        'limits': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'limits',
+        },
+        # Chatbot conversations (core/chat_store.py); without Redis they are ChatMessage rows
+        'chat': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'chat',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'parlorpal_cache',
+            # Django's default of 300 entries culls week-long poster results within minutes
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 20000))},
+        },
+        'stats': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'parlorpal_stats',
+            'TIMEOUT': None,
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+    }
+
+# Seconds between writes of the batched cache hit/miss counters of each process (core/cache_utils.py)
+COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 10))
+
+# Poster result cache: seconds an identical prompt + model reuses the stored poster (0 disables)
+POSTER_CACHE_TTL = int(os.environ.get('POSTER_CACHE_TTL', 7 * 24 * 3600))
+
+# Bulk poster generation from CSV (one poster_bulk job per upload): rows per upload, concurrent
+# provider calls per job, and finished rows saved (posters, history and job progress) per transaction
+BULK_POSTER_MAX_ROWS = int(os.environ.get('BULK_POSTER_MAX_ROWS', 50))
+BULK_POSTER_MAX_WORKERS = int(os.environ.get('BULK_POSTER_MAX_WORKERS', 4))
+BULK_POSTER_SAVE_CHUNK = int(os.environ.get('BULK_POSTER_SAVE_CHUNK', 5))
+
+# Poster output encoding
+# Provider bytes in one of POSTER_PASSTHROUGH_FORMATS are stored as-is; anything else is
+# encoded once to POSTER_OUTPUT_FORMAT ('webp', 'jpeg' or 'png').
+POSTER_PASSTHROUGH_FORMATS = [f.strip() for f in os.environ.get('POSTER_PASSTHROUGH_FORMATS', 'png,jpeg,webp').split(',') if f.strip()]
+POSTER_OUTPUT_FORMAT = os.environ.get('POSTER_OUTPUT_FORMAT', 'webp')
+POSTER_OUTPUT_QUALITY = int(os.environ.get('POSTER_OUTPUT_QUALITY', 85))  # JPEG/WebP quality (1-100)
+POSTER_PNG_COMPRESS_LEVEL = int(os.environ.get('POSTER_PNG_COMPRESS_LEVEL', 6))  # zlib level (0-9)
+
+# Poster renditions rendered after generation (see core/renditions.py for sizes), and the
+# number of processes used for the Pillow work
+POSTER_RENDITIONS = [r.strip() for r in os.environ.get('POSTER_RENDITIONS', 'instagram,instagram_portrait,whatsapp,story,thumbnail').split(',') if r.strip()]
+RENDITION_PROCESSES = int(os.environ.get('RENDITION_PROCESSES', 2))
+
+# Hedged poster generation (opt-in)
+# When the provider for the selected model has not answered after the hedge delay, the same
+# prompt is also sent to the other backend (Gemini <-> Imagen) and the first valid image wins.
+# The delay follows the primary provider's recent p95 latency, bounded by the two values below.
+POSTER_HEDGING = os.environ.get('POSTER_HEDGING', 'False') == 'True'
+POSTER_HEDGE_DELAY = float(os.environ.get('POSTER_HEDGE_DELAY', 12))  # seconds; also used until enough samples exist
+POSTER_HEDGE_MIN_DELAY = float(os.environ.get('POSTER_HEDGE_MIN_DELAY', 3))
+POSTER_HEDGE_IMAGEN_MODEL = os.environ.get('POSTER_HEDGE_IMAGEN_MODEL', 'imagen-4.0-fast-generate-preview-06-06')
+POSTER_HEDGE_GEMINI_MODEL = os.environ.get('POSTER_HEDGE_GEMINI_MODEL', 'gemini-3-pro-image-preview')
+
+# Offline provider emulator (core/emulators.py)
+# AI_EMULATOR=True replaces Cohere, Gemini, Imagen, Veo, Cloudinary and SMTP with local stand-ins
+# that need no keys or network. AI_EMULATOR_CONFIG is a JSON object of per-service overrides, e.g.
+# {"imagen": {"latency_p50": 2, "latency_p95": 20, "quota_error_rate": 0.1}}
+AI_EMULATOR = os.environ.get('AI_EMULATOR', 'False') == 'True'
+AI_EMULATOR_CONFIG = json.loads(os.environ.get('AI_EMULATOR_CONFIG', '{}'))
+AI_EMULATOR_SEED = int(os.environ['AI_EMULATOR_SEED']) if os.environ.get('AI_EMULATOR_SEED') else None
+if AI_EMULATOR:
+    EMAIL_BACKEND = 'core.emulators.EmulatedEmailBackend'
+    # Emulated clients accept any key; this keeps the "key configured" checks happy
+    GOOGLE_API_KEY = GOOGLE_API_KEY or 'emulator'
+
+# Composited posters (core/poster_layout.py)
+# TrueType fonts used to draw business details over generated backgrounds. Use fonts that cover
+# the scripts your businesses write in (e.g. Noto Sans Kannada/Devanagari); Pillow's built-in
+# font is used when unset.
+POSTER_FONT_REGULAR = os.environ.get('POSTER_FONT_REGULAR', '')
+POSTER_FONT_BOLD = os.environ.get('POSTER_FONT_BOLD', '')
+# Memory budget of decoded backgrounds kept per process for compositing (4 bytes per pixel)
+POSTER_REMOTE_IMAGE_CACHE_BYTES = int(os.environ.get('POSTER_REMOTE_IMAGE_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Festival draft posters (python manage.py pregenerate_festival_posters)
+FESTIVAL_DRAFT_OFFER = os.environ.get('FESTIVAL_DRAFT_OFFER', 'Festive Offer')
+
+# Provider rate limits (core/rate_limit.py), shared by all processes through the 'limits'
+# cache alias when Redis is configured, otherwise through ProviderLimitState rows
+#   rate             - requests started per second (token bucket, bursts of up to `rate`)
+#   max_concurrency  - ceiling of the adaptive concurrent-call limit (halved on quota errors)
+#   queue_timeout    - seconds a call waits for a slot before failing with "too many requests"
+#   max_retries / retry_base_delay - jittered exponential backoff on quota (429) errors
+#   slot_ttl         - seconds after which a call's slot lease expires if its process died
+# PROVIDER_LIMITS_CONFIG (JSON) overrides per provider, e.g. {"imagen": {"rate": 2}}
+PROVIDER_LIMITS = {
+    'default': {'rate': 5, 'max_concurrency': 8, 'min_concurrency': 1, 'queue_timeout': 20,
+                'max_retries': 3, 'retry_base_delay': 1.0, 'slot_ttl': 300},
+    'imagen': {'rate': 1, 'max_concurrency': 4},
+    'gemini_image': {'rate': 1, 'max_concurrency': 2},
+    'gemini': {'rate': 5, 'max_concurrency': 8},
+    'cohere': {'rate': 5, 'max_concurrency': 8},
+    'veo': {'rate': 1, 'max_concurrency': 1, 'queue_timeout': 60},
+}
+for _provider, _overrides in json.loads(os.environ.get('PROVIDER_LIMITS_CONFIG', '{}')).items():
+    PROVIDER_LIMITS.setdefault(_provider, {}).update(_overrides)
+
+# Generation progress stream (generation_job_events_view)
+# Each open stream occupies a server worker for its whole lifetime, so pages poll the short
+# status endpoint unless GENERATION_EVENTS_ENABLED=True. Only enable it with an async worker
+# class (e.g. `gunicorn -k gevent`), never with the default sync workers.
+# POLL_INTERVAL: seconds between job status checks; TIMEOUT: seconds one stream stays open before
+# the browser reconnects (keep well below the gunicorn --timeout of 120)
+GENERATION_EVENTS_ENABLED = os.environ.get('GENERATION_EVENTS_ENABLED', 'False') == 'True'
+GENERATION_EVENTS_POLL_INTERVAL = float(os.environ.get('GENERATION_EVENTS_POLL_INTERVAL', '1.0'))
+GENERATION_EVENTS_TIMEOUT = int(os.environ.get('GENERATION_EVENTS_TIMEOUT', '20'))
+
+# Business logo overlay on AI-drawn posters (core/poster_layout.py)
+# POSTER_LOGO_SCALE: logo box width as a fraction of the poster width
+# POSTER_LOGO_CACHE_BYTES: memory budget of decoded and pre-scaled logos per process
+# POSTER_LOGO_REVALIDATE: seconds before a cached logo's ETag is checked again
+POSTER_LOGO_SCALE = float(os.environ.get('POSTER_LOGO_SCALE', '0.16'))
+POSTER_LOGO_CACHE_BYTES = int(os.environ.get('POSTER_LOGO_CACHE_BYTES', 32 * 1024 * 1024))
+POSTER_LOGO_REVALIDATE = int(os.environ.get('POSTER_LOGO_REVALIDATE', '3600'))
+
+# Load-aware model routing for posters requested with model 'auto' (core/model_router.py)
+# POSTER_MODEL_ROUTE: candidates in order of preference; the first one with headroom serves the request
+# MODEL_ROUTER_MAX_UTILIZATION: share of a model's rate-limiter slots in use that counts as busy
+# MODEL_ROUTER_MAX_P95: seconds of recent p95 latency that counts as slow
+# MODEL_ROUTER_BACKLOG: queued + running poster jobs above which the first model is skipped
+# MODEL_ROUTER_FALLBACK: model used when every candidate is under pressure
+POSTER_MODEL_ROUTE = [m.strip() for m in os.environ.get(
+    'POSTER_MODEL_ROUTE',
+    'imagen-4.0-ultra-generate-preview-06-06,imagen-4.0-generate-preview-06-06,'
+    'imagen-4.0-fast-generate-preview-06-06,gemini-3-pro-image-preview'
+).split(',') if m.strip()]
+MODEL_ROUTER_MAX_UTILIZATION = float(os.environ.get('MODEL_ROUTER_MAX_UTILIZATION', '0.8'))
+MODEL_ROUTER_MAX_P95 = float(os.environ.get('MODEL_ROUTER_MAX_P95', '30'))
+MODEL_ROUTER_BACKLOG = int(os.environ.get('MODEL_ROUTER_BACKLOG', '10'))
+MODEL_ROUTER_FALLBACK = os.environ.get('MODEL_ROUTER_FALLBACK', 'imagen-4.0-fast-generate-preview-06-06')
+
+# Most poster candidates one "variants" request may ask for (Imagen returns up to 4 per call)
+POSTER_MAX_VARIANTS = int(os.environ.get('POSTER_MAX_VARIANTS', '4'))
+
+# Model for the quick draft of progressive poster requests; the requested model renders the final in the background
+POSTER_DRAFT_MODEL = os.environ.get('POSTER_DRAFT_MODEL', 'imagen-4.0-fast-generate-preview-06-06')
+
+# Local prompt pre-flight before provider calls (core/preflight.py)
+# PREFLIGHT_BLOCK_THRESHOLD: predicted block probability at which a request is rejected without a provider call
+# PREFLIGHT_EXTRA_BLOCK_TERMS: comma-separated extra words to always reject, e.g. from provider block logs
+PREFLIGHT_ENABLED = os.environ.get('PREFLIGHT_ENABLED', 'True') == 'True'
+PREFLIGHT_BLOCK_THRESHOLD = float(os.environ.get('PREFLIGHT_BLOCK_THRESHOLD', '0.8'))
+PREFLIGHT_EXTRA_BLOCK_TERMS = [t.strip() for t in os.environ.get('PREFLIGHT_EXTRA_BLOCK_TERMS', '').split(',') if t.strip()]
+
+# Cohere chat model for streamed captions (ai_suggestions_view with stream=1)
+CAPTION_STREAM_MODEL = os.environ.get('CAPTION_STREAM_MODEL', 'command-r-08-2024')
+
+# Caption grids (several languages x tones per request): Cohere calls in flight at once per request.
+# The default covers a full 3 x 3 grid in one round trip; PROVIDER_LIMITS['cohere'] still caps all callers together.
+CAPTION_GRID_MAX_WORKERS = int(os.environ.get('CAPTION_GRID_MAX_WORKERS', '9'))
+
+# LLM text reply cache (core/cache_utils.py): seconds per endpoint, 0 disables an endpoint.
+# Requests with "new variation" ticked skip the lookup. TEXT_CACHE_TTLS_CONFIG (JSON) overrides, e.g. {"chatbot": 0}
+TEXT_CACHE_TTLS = {
+    'caption': 24 * 3600,
+    'email_subjects': 7 * 24 * 3600,
+    'chatbot': 3600,
+}
+TEXT_CACHE_TTLS.update(json.loads(os.environ.get('TEXT_CACHE_TTLS_CONFIG', '{}')))
+
+# Chatbot context snapshot (profile, recent posters, caption count) per user, in seconds.
+# Saves invalidate it through signals; the TTL only bounds staleness from writes that skip them.
+CHAT_CONTEXT_TTL = int(os.environ.get('CHAT_CONTEXT_TTL', 24 * 3600))
+
+# Chatbot conversation store (core/chat_store.py): recent turns per user/conversation kept in the 'chat'
+# Redis cache, or read from the ChatMessage table without Redis.
+# Oldest turns are dropped beyond either cap; the TTL runs from the last message.
+# CHAT_HISTORY_PERSIST also appends every turn to the ChatMessage table with Redis and restores evicted conversations from it.
+CHAT_HISTORY_MAX_TURNS = int(os.environ.get('CHAT_HISTORY_MAX_TURNS', 10))
+CHAT_HISTORY_MAX_BYTES = int(os.environ.get('CHAT_HISTORY_MAX_BYTES', 16 * 1024))
+CHAT_HISTORY_TTL = int(os.environ.get('CHAT_HISTORY_TTL', 7 * 24 * 3600))
+CHAT_HISTORY_PERSIST = os.environ.get('CHAT_HISTORY_PERSIST', 'False') == 'True'